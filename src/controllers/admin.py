@@ -20,17 +20,27 @@ These handlers are only available for actions performed by administrators. This
 is configured in app.yaml. Addtional logic is provided by utility functions.
 
   AddUserHandler: Allows admins to view and grant users access to the app.
+  CacheStatsHandler: Outputs the response cache counters of the instance.
+  FlushCountersHandler: Writes buffered request counts to the datastore.
+  MigrateResponsesHandler: Moves saved responses under their API Query.
   QueryTaskWorker: Executes API Query tasks from the task queue
+  ScaleShardsHandler: Scales request counter and timestamp shards.
 """
 
 __author__ = 'pete.frisella@gmail.com (Pete Frisella)'
 
+import hashlib
+import logging
+
 from controllers import base
 from controllers.util import co
 from controllers.util import query_helper
+from controllers.util import response_cache
 from controllers.util import users_helper
 import webapp2
 
+from google.appengine.api import taskqueue
+
 
 class AddUserHandler(base.BaseHandler):
   """Handles viewing and adding users of the to the service."""
@@ -54,6 +64,87 @@ class AddUserHandler(base.BaseHandler):
     self.redirect(co.LINKS['admin_users'])
 
 
+class CacheStatsHandler(base.BaseHandler):
+  """Handles requests for the response cache counters.
+
+  The counters are kept per instance, so they describe the cache of the
+  instance that serves the request.
+  """
+
+  def get(self):
+    self.RenderJson(response_cache.GetStats())
+
+
+class FlushCountersHandler(base.BaseHandler):
+  """Handles the periodic flush of request counts and times from cron.
+
+  Buffered request counts are written to the datastore and the latest request
+  times are rolled up.
+  """
+
+  def get(self):
+    status = query_helper.FlushApiQueryCounters()
+    rolled_up_timestamps = query_helper.RollUpApiQueryTimestamps()
+    self.RenderJson({
+        'last_flush': str(status.last_flush),
+        'flushed_counters': status.flushed_counters,
+        'flushed_increments': status.flushed_increments,
+        'rolled_up_timestamps': rolled_up_timestamps
+    })
+
+
+class ScaleShardsHandler(base.BaseHandler):
+  """Handles the periodic scaling of request counter and timestamp shards."""
+
+  def get(self):
+    self.RenderJson(query_helper.ScaleApiQueryShards())
+
+
+class MigrateResponsesHandler(base.BaseHandler):
+  """Handles moving API Query Responses saved without a parent.
+
+  Visiting the page only starts the migration in the task queue. Each task
+  migrates one batch and adds a task for the next batch until every response
+  was checked. Tasks are named after the cursor of their batch so visiting
+  the page again, or a task that is retried, doesn't start another chain of
+  tasks. Run it once after upgrading.
+  """
+
+  def get(self):
+    self.RenderJson({'started': _AddMigrateResponsesTask(None)})
+
+  def post(self):
+    cursor = self.request.get('cursor') or None
+    (migrated, next_cursor) = query_helper.MigrateApiQueryResponses(cursor)
+    if next_cursor:
+      _AddMigrateResponsesTask(next_cursor)
+    self.RenderJson({'migrated': migrated, 'done': next_cursor is None})
+
+
+def _AddMigrateResponsesTask(cursor):
+  """Adds the task that migrates the batch of responses at a cursor.
+
+  Args:
+    cursor: The cursor of the batch or None for the first batch.
+
+  Returns:
+    True if the task was added and False if it was already added.
+  """
+  name = 'migrate-responses-start'
+  params = {}
+  if cursor:
+    name = 'migrate-responses-%s' % hashlib.md5(cursor).hexdigest()
+    params['cursor'] = cursor
+
+  try:
+    taskqueue.add(url=co.LINKS['admin_migrate_responses'], name=name,
+                  params=params)
+  except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+    logging.info('Migration task %s was already added.', name)
+    return False
+  return True
+
+
 class QueryTaskWorker(base.BaseHandler):
   """Handles API Query requests and responses from the task queue."""
 
@@ -65,5 +156,9 @@ class QueryTaskWorker(base.BaseHandler):
 
 app = webapp2.WSGIApplication(
     [(co.LINKS['admin_users'], AddUserHandler),
-     (co.LINKS['admin_runtask'], QueryTaskWorker)],
+     (co.LINKS['admin_runtask'], QueryTaskWorker),
+     (co.LINKS['admin_cache_stats'], CacheStatsHandler),
+     (co.LINKS['admin_flush_counters'], FlushCountersHandler),
+     (co.LINKS['admin_scale_shards'], ScaleShardsHandler),
+     (co.LINKS['admin_migrate_responses'], MigrateResponsesHandler)],
     debug=True)
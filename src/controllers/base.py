@@ -26,11 +26,13 @@ import os
 import urllib
 
 from controllers.util import co
+from controllers.util import compression_helper
 from controllers.util import users_helper
 import jinja2
 import webapp2
 
 from google.appengine.api import users
+from google.appengine.ext import ndb
 
 jinja_environment = jinja2.Environment(
     loader=jinja2.FileSystemLoader(
@@ -41,6 +43,16 @@ jinja_environment = jinja2.Environment(
 class BaseHandler(webapp2.RequestHandler):
   """Base handler for generating responses for most types of requests."""
 
+  @ndb.toplevel
+  def dispatch(self):
+    """Dispatches the request and then waits for its pending async work.
+
+    Work that doesn't affect the response, like tracking requests, is started
+    without waiting for it so it runs while the response is rendered. It is
+    finished here, after the handler has written the response.
+    """
+    return super(BaseHandler, self).dispatch()
+
   def RenderHtmlTemplate(self, template_name, template_values=None):
     """Renders HTML using a template.
 
@@ -74,18 +86,42 @@ class BaseHandler(webapp2.RequestHandler):
     template = jinja_environment.get_template(template_name)
     self.response.write(template.render(template_values))
 
-  def RenderCsv(self, csv_content, status=200):
+  def GetAcceptedEncoding(self):
+    """Returns the preferred compressed content encoding of the client.
+
+    Returns:
+      One of the configured compressed encodings (e.g. 'gzip') or None if the
+      client doesn't accept any of them.
+    """
+    return compression_helper.GetAcceptedEncoding(
+        self.request.headers.get('Accept-Encoding'))
+
+  def SetContentEncoding(self, content_encoding=None):
+    """Sets the headers for content that may be served compressed.
+
+    Args:
+      content_encoding: The encoding of the content to output or None if the
+                        content is not compressed.
+    """
+    self.response.headers['Vary'] = 'Accept-Encoding'
+    if content_encoding:
+      self.response.headers['Content-Encoding'] = content_encoding
+
+  def RenderCsv(self, csv_content, status=200, content_encoding=None):
     """Renders CSV content.
 
     Args:
-      csv_content: The CSV content to output.
+      csv_content: The CSV content to output. Either a string or an iterable
+                   of strings that are written as they are produced.
       status: The HTTP status code to send.
+      content_encoding: The encoding of compressed content, if any.
     """
     self.response.headers['Content-Type'] = 'text/csv; charset=UTF-8'
     self.response.headers['Content-Disposition'] = (
         'attachment; filename=query_response.csv')
+    self.SetContentEncoding(content_encoding)
     self.response.set_status(status)
-    self.response.write(csv_content)
+    self.WriteContent(csv_content)
 
   def RenderHtml(self, html_content, status=200):
     """Renders HTML content.
@@ -99,50 +135,85 @@ class BaseHandler(webapp2.RequestHandler):
     self.response.set_status(status)
     self.response.write(html_content)
 
-  def RenderJson(self, json_response, status=200):
+  def RenderJson(self, json_response, status=200, content_encoding=None):
     """Renders JSON/Javascript content.
 
     If a callback parameter is included as part of the request then a
     Javascript function is output (JSONP support).
 
     Args:
-      json_response: The JSON content to output.
+      json_response: The JSON content to output. Either a string of
+                     serialized JSON, which is output as is, or an object to
+                     serialize.
       status: The HTTP status code to send.
+      content_encoding: The encoding of compressed content, if any. Compressed
+                        content is output as is and can't be used for JSONP.
     """
+    if not isinstance(json_response, basestring):
+      json_response = json.dumps(json_response)
+
     self.response.set_status(status)
     self.response.headers['Content-Disposition'] = 'inline'
-    if self.request.get('callback'):  # JSONP Support
+    self.SetContentEncoding(content_encoding)
+    if self.request.get('callback') and not content_encoding:  # JSONP Support
       self.response.headers['Content-Type'] = (
           'application/javascript; charset=UTF-8')
       self.response.out.write('(%s)(%s);' %
                               (urllib.unquote(self.request.get('callback')),
-                               json.dumps(json_response)))
+                               json_response))
     else:
       self.response.headers['Content-Type'] = 'application/json; charset=UTF-8'
-      self.response.write(json.dumps(json_response))
+      self.response.write(json_response)
 
-  def RenderText(self, text, status=200):
+  def RenderNotModified(self):
+    """Renders a 304 (Not Modified) response without a body."""
+    self.SetContentEncoding()
+    self.response.set_status(304)
+    self.response.clear()
+
+  def RenderText(self, text, status=200, content_encoding=None):
     """Renders plain text content.
 
     Args:
       text: The plain text to output.
       status: The HTTP status code to send.
+      content_encoding: The encoding of compressed content, if any.
     """
     self.response.headers['Content-Type'] = 'text/plain; charset=UTF-8'
     self.response.headers['Content-Disposition'] = 'inline'
+    self.SetContentEncoding(content_encoding)
     self.response.set_status(status)
     self.response.write(text)
 
-  def RenderTsv(self, tsv_content, status=200):
+  def RenderTsv(self, tsv_content, status=200, content_encoding=None):
     """Renders TSV for Excel content.
 
     Args:
-      tsv_content: The TSV for Excel content to output.
+      tsv_content: The TSV for Excel content to output. Either a string or an
+                   iterable of strings that are written as they are produced.
       status: The HTTP status code to send.
+      content_encoding: The encoding of compressed content, if any.
     """
     self.response.headers['Content-Type'] = ('application/vnd.ms-excel; '
                                              'charset=UTF-16LE')
     self.response.headers['Content-Disposition'] = (
         'attachment; filename=query_response.tsv')
+    self.SetContentEncoding(content_encoding)
     self.response.set_status(status)
-    self.response.write(tsv_content)
+    self.WriteContent(tsv_content)
+
+  def WriteContent(self, content):
+    """Writes content to the response.
+
+    Args:
+      content: A string or an iterable of strings. Each string from an
+               iterable is written as soon as it is produced so that no
+               intermediate copy of the whole content is built. The python27
+               runtime still buffers the response body until the handler
+               returns, so the output itself is held in memory once.
+    """
+    if content is None or isinstance(content, basestring):
+      self.response.write(content)
+    else:
+      for chunk in content:
+        self.response.write(chunk)
@@ -102,6 +102,8 @@ class AdminHandler(base.BaseHandler):
         'revoke_token_url': '%s?revoke=true' % co.LINKS['owner_auth'],
         'oauth_url': analytics_auth_helper.OAUTH_URL
     }
+    if users.is_current_user_admin():
+      template_values.update(template_helper.GetCounterFlushForTemplate())
     self.RenderHtmlTemplate('admin.html', template_values)
 
 
@@ -21,6 +21,7 @@ be signed in. This is configured in app.yaml. Additional logic is provided by
 utility functions.
 
   PublicQueryResponseHandler: Outputs the API response for the requested query.
+  PublicBatchQueryResponseHandler: Outputs the API responses for many queries.
   NotAuthorizedHandler: Handles unauthorized requests.
 """
 
@@ -47,7 +48,8 @@ class PublicQueryResponseHandler(base.BaseHandler):
 
     Gets the public response and then uses the transformer to render the
     content. If there is an error then the error message will be rendered
-    using the default response format.
+    using the default response format. Conditional requests for a response
+    the client already has get a 304 (Not Modified) response.
     """
     query_id = self.request.get('id')
     response_format = str(self.request.get('format', co.DEFAULT_FORMAT))
@@ -58,16 +60,79 @@ class PublicQueryResponseHandler(base.BaseHandler):
 
     transform = transformers.GetTransform(response_format, tqx)
 
+    # JSONP responses are wrapped in a callback so they can't be served from
+    # the compressed content.
+    accepted_encoding = None
+    if not self.request.get('callback'):
+      accepted_encoding = self.GetAcceptedEncoding()
+
     try:
-      (content, status) = query_helper.GetPublicEndpointResponse(
-          query_id, response_format, transform)
+      # View parameters filter, sort, page and select the columns of the
+      # response on the server.
+      view = query_helper.GetReportView(
+          sort=self.request.get('sort', None),
+          columns=self.request.get('columns', None),
+          filters=self.request.get('filter', None),
+          start=self.request.get('start', None),
+          limit=self.request.get('limit', None))
+      (content, status, headers) = query_helper.GetPublicEndpointResponse(
+          query_id, response_format, transform,
+          if_none_match=self.request.headers.get('If-None-Match'),
+          if_modified_since=self.request.headers.get('If-Modified-Since'),
+          accepted_encoding=accepted_encoding,
+          view=view)
     except errors.GaSuperProxyHttpError, proxy_error:
       # For error responses use the transform of the default format.
       transform = transformers.GetTransform(co.DEFAULT_FORMAT)
       content = proxy_error.content
       status = proxy_error.status
+      headers = {}
+
+    content_encoding = headers.pop('Content-Encoding', None)
+    for name, value in headers.items():
+      self.response.headers[name] = value
+
+    if status == 304:
+      self.RenderNotModified()
+    else:
+      transform.Render(self, content, status, content_encoding)
+
+
+class PublicBatchQueryResponseHandler(base.BaseHandler):
+  """Handles public requests for the responses of several API Queries.
+
+  The query ids are passed as a comma separated list in the id parameter, or
+  as repeated id parameters, along with an optional format. All the responses
+  are returned in a single JSON envelope with a status for each query id.
+  """
+
+  def get(self):
+    """Renders the API Responses in the format requested."""
+    query_ids = []
+    for value in self.request.get_all('id'):
+      for query_id in value.split(','):
+        query_id = query_id.strip()
+        if query_id:
+          query_ids.append(query_id)
+    response_format = str(self.request.get('format', co.DEFAULT_FORMAT))
+
+    if not query_ids or len(query_ids) > co.MAX_BATCH_QUERIES:
+      status = 400
+      content = {
+          'error': co.ERROR_INVALID_BATCH,
+          'code': status,
+          'message': co.ERROR_MESSAGES[co.ERROR_INVALID_BATCH]}
+      self.RenderJson(content, status)
+      return
+
+    responses = query_helper.GetPublicEndpointBatchResponse(
+        query_ids, response_format)
+    self.RenderJson(query_helper.GetPublicEndpointBatchJson(
+        responses, response_format))
 
-    transform.Render(self, content, status)
+  def post(self):
+    """Renders the API Responses for query ids sent in the request body."""
+    self.get()
 
 
 class NotAuthorizedHandler(base.BaseHandler):
@@ -79,5 +144,6 @@ class NotAuthorizedHandler(base.BaseHandler):
 
 app = webapp2.WSGIApplication(
     [(co.LINKS['public_query'], PublicQueryResponseHandler),
+     (co.LINKS['public_query_batch'], PublicBatchQueryResponseHandler),
      (co.LINKS['public_default'], NotAuthorizedHandler)],
     debug=True)
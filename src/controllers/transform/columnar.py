@@ -0,0 +1,220 @@
+#!/usr/bin/python2.7
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Typed columnar representation of a Core Reporting API response.
+
+  The rows of a response are strings. A ColumnarReport converts them once to
+  the Python type of each column and stores them by column: integer metrics
+  in array('l'), float metrics in array('d') and dimensions in lists of
+  interned unicode strings, so repeated dimension values share one string.
+
+  ColumnarReport: The typed columns and column headers of a response.
+  GetConverter: Returns the function that converts the values of a column.
+"""
+
+import array
+import itertools
+
+# The label to use for unknown data types.
+UNKNOWN_LABEL = 'UNKNOWN'
+
+# Maps the types used in a Core Reporting API response to Python types.
+# Dimension values are kept as unicode since they aren't always ASCII.
+BUILTIN_DATA_TYPES = {
+    'STRING': unicode,
+    'INTEGER': int,
+    'FLOAT': float,
+    'CURRENCY': float,
+    UNKNOWN_LABEL: unicode
+}
+
+# Maps Python types to the typecode of the array that stores them.
+ARRAY_TYPECODES = {
+    int: 'l',
+    float: 'd'
+}
+
+
+class ColumnarReport(object):
+  """The typed columns and column headers of a Core Reporting API response."""
+  __slots__ = ('column_headers', 'names', 'columns', 'row_count')
+
+  def __init__(self, column_headers, columns, row_count):
+    """Initialize the report.
+
+    Args:
+      column_headers: The list of column header dicts of the response.
+      columns: A list with the sequence of typed values of each column, in
+               the order of the column headers.
+      row_count: The number of rows of the response.
+    """
+    self.column_headers = column_headers
+    self.names = [header.get('name', UNKNOWN_LABEL)
+                  for header in column_headers]
+    self.columns = columns
+    self.row_count = row_count
+
+  @classmethod
+  def FromContent(cls, content, data_types=None):
+    """Builds a report from a Core Reporting API response.
+
+    Args:
+      content: A dict representing the Core Reporting API JSON response.
+      data_types: A dict that maps the data types in the content to Python
+                  types. Defaults to BUILTIN_DATA_TYPES.
+
+    Returns:
+      A ColumnarReport or None if there are no column headers in the
+      response.
+
+    Raises:
+      ValueError: A value can't be converted to the type of its column.
+    """
+    if not content:
+      return None
+
+    column_headers = content.get('columnHeaders')
+    if not column_headers:
+      return None
+
+    if data_types is None:
+      data_types = BUILTIN_DATA_TYPES
+
+    rows = content.get('rows') or []
+    columns = []
+    for index, header in enumerate(column_headers):
+      convert_to = GetConverter(header.get('dataType'), data_types)
+      values = [row[index] for row in rows]
+      columns.append(_BuildColumn(convert_to, values))
+    return cls(column_headers, columns, len(rows))
+
+  def Take(self, indexes):
+    """Returns a report with some of the rows of this report.
+
+    Args:
+      indexes: A list of the indexes of the rows to take, in the order of the
+               rows of the new report.
+
+    Returns:
+      A ColumnarReport with the same column headers.
+    """
+    columns = []
+    for column in self.columns:
+      values = [column[index] for index in indexes]
+      typecode = getattr(column, 'typecode', None)
+      if typecode:
+        values = array.array(typecode, values)
+      columns.append(values)
+    return ColumnarReport(self.column_headers, columns, len(indexes))
+
+  def Select(self, column_indexes):
+    """Returns a report with some of the columns of this report.
+
+    Args:
+      column_indexes: A list of the indexes of the columns to select, in the
+                      order of the columns of the new report.
+
+    Returns:
+      A ColumnarReport with the same rows.
+    """
+    return ColumnarReport(
+        [self.column_headers[index] for index in column_indexes],
+        [self.columns[index] for index in column_indexes],
+        self.row_count)
+
+  def IsNumeric(self, column_index):
+    """Returns True if the values of a column compare as numbers.
+
+    Every metric compares as a number, including the metrics with a data type
+    that is kept as a string, like PERCENT and TIME.
+    """
+    header = self.column_headers[column_index]
+    return (header.get('columnType') == 'METRIC' or
+            GetConverter(header.get('dataType')) in ARRAY_TYPECODES)
+
+  def GetComparableColumn(self, column_index):
+    """Returns the values of a column in the type they compare as.
+
+    Args:
+      column_index: The index of the column.
+
+    Returns:
+      The values of the column. Numeric columns that are kept as strings are
+      converted to floats.
+
+    Raises:
+      ValueError: A value of a numeric column isn't a number.
+    """
+    column = self.columns[column_index]
+    if not self.IsNumeric(column_index):
+      return column
+    data_type = self.column_headers[column_index].get('dataType')
+    if GetConverter(data_type) in ARRAY_TYPECODES:
+      return column
+    return array.array('d', [float(value) for value in column])
+
+  def Rows(self):
+    """Returns an iterator of the typed values of each row as a tuple."""
+    if not self.columns:
+      return iter([])
+    return itertools.izip(*self.columns)
+
+
+def GetConverter(data_type, data_types=None):
+  """Returns the function that converts the values of a column.
+
+  Args:
+    data_type: The data type of the column in the column header.
+    data_types: A dict that maps the data types in the content to Python
+                types. Defaults to BUILTIN_DATA_TYPES.
+
+  Returns:
+    A function that takes a value from a row and returns it converted.
+  """
+  if data_types is None:
+    data_types = BUILTIN_DATA_TYPES
+  convert_to = data_types.get(data_type, data_types.get(UNKNOWN_LABEL))
+  if convert_to:
+    return convert_to
+  return lambda value: value.encode('UTF-8')
+
+
+def _BuildColumn(convert_to, values):
+  """Converts the values of a column and stores them in a compact sequence.
+
+  Args:
+    convert_to: The function that converts each value.
+    values: The list of values of the column from the response rows.
+
+  Returns:
+    An array for numeric types that fit in one or a list otherwise. Strings
+    in the list are interned.
+  """
+  typecode = ARRAY_TYPECODES.get(convert_to)
+  if typecode:
+    converted = [convert_to(value) for value in values]
+    try:
+      return array.array(typecode, converted)
+    except OverflowError:
+      # Integers larger than a C long are kept as Python longs.
+      return converted
+
+  interned = {}
+  column = []
+  for value in values:
+    value = convert_to(value)
+    column.append(interned.setdefault(value, value))
+  return column
@@ -0,0 +1,130 @@
+#!/usr/bin/python2.7
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the columnar module."""
+
+import array
+import os
+import sys
+import unittest
+
+# The superProxy modules are imported from the src directory.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, os.pardir))
+from controllers.transform import columnar
+
+
+class ColumnarReportTest(unittest.TestCase):
+
+  COLUMN_HEADERS = [
+      {'name': 'ga:city', 'columnType': 'DIMENSION', 'dataType': 'STRING'},
+      {'name': 'ga:visits', 'columnType': 'METRIC', 'dataType': 'INTEGER'},
+      {'name': 'ga:bounceRate', 'columnType': 'METRIC', 'dataType': 'PERCENT'},
+      {'name': 'ga:revenue', 'columnType': 'METRIC', 'dataType': 'CURRENCY'}]
+
+  ROWS = [[u'Z\xfcrich', u'3', u'25.5', u'10.25'],
+          [u'Berlin', u'12', u'50.0', u'0.0'],
+          [u'Z\xfcrich', u'7', u'0.0', u'3.5']]
+
+  def BuildReport(self, rows=None):
+    if rows is None:
+      rows = self.ROWS
+    return columnar.ColumnarReport.FromContent(
+        {'columnHeaders': self.COLUMN_HEADERS, 'rows': rows})
+
+  def testTypes(self):
+    report = self.BuildReport()
+    (cities, visits, bounce_rates, revenues) = report.columns
+    self.assertEqual([u'Z\xfcrich', u'Berlin', u'Z\xfcrich'], cities)
+    self.assertTrue(all(isinstance(city, unicode) for city in cities))
+    self.assertEqual(array.array('l', [3, 12, 7]), visits)
+    # Unknown data types are kept as unicode strings.
+    self.assertEqual([u'25.5', u'50.0', u'0.0'], bounce_rates)
+    self.assertEqual(array.array('d', [10.25, 0.0, 3.5]), revenues)
+    self.assertEqual(['ga:city', 'ga:visits', 'ga:bounceRate', 'ga:revenue'],
+                     report.names)
+    self.assertEqual(3, report.row_count)
+    # Metrics kept as strings still compare as numbers.
+    self.assertEqual([False, True, True, True],
+                     [report.IsNumeric(index) for index in range(4)])
+    self.assertEqual(array.array('d', [25.5, 50.0, 0.0]),
+                     report.GetComparableColumn(2))
+    self.assertTrue(report.GetComparableColumn(1) is visits)
+    self.assertTrue(report.GetComparableColumn(0) is cities)
+
+  def testNoColumnHeaders(self):
+    self.assertEqual(None, columnar.ColumnarReport.FromContent(None))
+    self.assertEqual(None, columnar.ColumnarReport.FromContent({'rows': []}))
+
+  def testNoRows(self):
+    report = columnar.ColumnarReport.FromContent(
+        {'columnHeaders': self.COLUMN_HEADERS})
+    self.assertEqual(0, report.row_count)
+    self.assertEqual([], list(report.Rows()))
+
+  def testInvalidValue(self):
+    self.assertRaises(ValueError, self.BuildReport,
+                      [[u'Berlin', u'many', u'0.0', u'0.0']])
+
+  def testOverflow(self):
+    large = 2 ** 70
+    report = self.BuildReport([[u'Berlin', unicode(large), u'0.0', u'0.0'],
+                               [u'Bonn', u'1', u'0.0', u'0.0']])
+    # Integers larger than a C long fall back to a list of Python longs.
+    self.assertEqual([large, 1], report.columns[1])
+    self.assertFalse(isinstance(report.columns[1], array.array))
+    self.assertEqual([large], list(report.Take([0]).columns[1]))
+
+  def testInterning(self):
+    report = self.BuildReport()
+    cities = report.columns[0]
+    self.assertTrue(cities[0] is cities[2])
+    self.assertFalse(cities[0] is cities[1])
+
+  def testRows(self):
+    self.assertEqual([(u'Z\xfcrich', 3, u'25.5', 10.25),
+                      (u'Berlin', 12, u'50.0', 0.0),
+                      (u'Z\xfcrich', 7, u'0.0', 3.5)],
+                     list(self.BuildReport().Rows()))
+
+  def testTake(self):
+    report = self.BuildReport().Take([2, 0])
+    self.assertEqual(2, report.row_count)
+    self.assertEqual([(u'Z\xfcrich', 7, u'0.0', 3.5),
+                      (u'Z\xfcrich', 3, u'25.5', 10.25)],
+                     list(report.Rows()))
+    # Numeric columns stay in arrays of the same type.
+    self.assertEqual('l', report.columns[1].typecode)
+    self.assertEqual('d', report.columns[3].typecode)
+    self.assertEqual([], list(self.BuildReport().Take([]).Rows()))
+
+  def testSelect(self):
+    report = self.BuildReport().Select([1, 0])
+    self.assertEqual(['ga:visits', 'ga:city'], report.names)
+    self.assertEqual(3, report.row_count)
+    self.assertEqual([(3, u'Z\xfcrich'), (12, u'Berlin'), (7, u'Z\xfcrich')],
+                     list(report.Rows()))
+    self.assertTrue(report.IsNumeric(0))
+
+  def testGetConverter(self):
+    self.assertEqual(int, columnar.GetConverter('INTEGER'))
+    self.assertEqual(unicode, columnar.GetConverter('PERCENT'))
+    convert_to = columnar.GetConverter('PERCENT', {'INTEGER': int})
+    self.assertEqual('Z\xc3\xbcrich', convert_to(u'Z\xfcrich'))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,194 @@
+#!/usr/bin/python2.7
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Encodes Core Reporting API responses as Data Table JSON.
+
+  The output is byte for byte the output of gviz_api.DataTable.ToJSon and
+  ToJSonResponse for the same schema and rows. Instead of building a dict for
+  each row and coercing and encoding each cell as an object, the rows are
+  encoded directly from the typed columns of a ColumnarReport. The values of
+  a column all have the type of the column and each distinct string is only
+  encoded once. The cols and the envelope are still written by gviz_api from
+  a table without rows, since they only depend on the schema.
+
+  ToJSon: Returns a Data Table JSON string for a ColumnarReport.
+  ToJSonResponse: Returns a Data Table JSON response for a ColumnarReport.
+"""
+
+import itertools
+import json
+
+from libs.gviz_api import gviz_api
+
+# The rows of the JSON output of a Data Table without rows.
+EMPTY_ROWS = '"rows":[]'
+
+# How a cell without a value is encoded.
+NULL_CELL = 'null'
+
+
+def ToJSon(table_schema, report, columns_order=None):
+  """Returns a string that can be used in a JS DataTable constructor.
+
+  Args:
+    table_schema: A dict that contains column header and data type information
+                  for a Data Table, as returned by GetDataTableSchema.
+    report: The ColumnarReport with the rows of the Data Table.
+    columns_order: Optional. A list of all column IDs in the order in which
+                   you want them in the output table.
+
+  Returns:
+    The same string as gviz_api.DataTable.ToJSon.
+
+  Raises:
+    DataTableException: A value does not match the type of its column.
+  """
+  data_table = gviz_api.DataTable(table_schema)
+  return _AddRows(data_table, data_table.ToJSon(columns_order),
+                  report, columns_order)
+
+
+def ToJSonResponse(table_schema, report, columns_order=None, req_id=0):
+  """Returns a JSON response that can be returned as-is to a client.
+
+  Args:
+    table_schema: A dict that contains column header and data type information
+                  for a Data Table, as returned by GetDataTableSchema.
+    report: The ColumnarReport with the rows of the Data Table.
+    columns_order: Optional. A list of all column IDs in the order in which
+                   you want them in the output table.
+    req_id: Optional. The response id, as retrieved by the request.
+
+  Returns:
+    The same string as gviz_api.DataTable.ToJSonResponse.
+
+  Raises:
+    DataTableException: A value does not match the type of its column.
+  """
+  data_table = gviz_api.DataTable(table_schema)
+  return _AddRows(data_table,
+                  data_table.ToJSonResponse(columns_order, req_id=req_id),
+                  report, columns_order)
+
+
+def _AddRows(data_table, empty_output, report, columns_order):
+  """Inserts the encoded rows of a report into the output of an empty table.
+
+  The rows key is always followed by the rows, and a quote in a JSON string is
+  always escaped, so the first match is the rows of the table.
+
+  Args:
+    data_table: The gviz_api.DataTable without rows that wrote the output.
+    empty_output: The UTF-8 JSON output of the Data Table without rows.
+    report: The ColumnarReport with the rows of the Data Table.
+    columns_order: The column IDs in output order or None for the order of
+                   the Data Table columns.
+
+  Returns:
+    The UTF-8 JSON output with the rows of the report.
+  """
+  rows = _EncodeRows(data_table.columns, report, columns_order)
+  return empty_output.replace(EMPTY_ROWS, '"rows":[%s]' % rows, 1)
+
+
+def _EncodeRows(columns, report, columns_order):
+  """Returns the comma separated UTF-8 JSON row objects of a report."""
+  if columns_order is None:
+    columns_order = [column['id'] for column in columns]
+  column_types = dict((column['id'], column['type']) for column in columns)
+
+  # Rows are dicts keyed by name for gviz_api, so the last column with a name
+  # holds its value and a column missing from the report has no values.
+  index_by_name = dict((name, index)
+                       for index, name in enumerate(report.names))
+
+  encoded_columns = []
+  for column_id in columns_order:
+    index = index_by_name.get(column_id)
+    if index is None:
+      encoded_columns.append(itertools.repeat(NULL_CELL, report.row_count))
+    else:
+      encode_cells = _CELL_ENCODERS.get(column_types[column_id])
+      if not encode_cells:
+        raise gviz_api.DataTableException(
+            'Unsupported type %s' % column_types[column_id])
+      encoded_columns.append(encode_cells(report.columns[index]))
+
+  rows = u','.join(u'{"c":[%s]}' % u','.join(cells)
+                   for cells in itertools.izip(*encoded_columns))
+  return rows.encode('UTF-8')
+
+
+def _EncodeNumberCells(values):
+  """Returns the encoded cells of a number column."""
+  if getattr(values, 'typecode', None) == 'l':
+    return ['{"v":%d}' % value for value in values]
+  return [_EncodeNumberCell(value) for value in values]
+
+
+def _EncodeNumberCell(value):
+  """Returns the encoded cell of a number, as json encodes it."""
+  if value is None:
+    return NULL_CELL
+  if isinstance(value, bool):
+    return '{"v":%s}' % json.dumps(value)
+  if isinstance(value, float):
+    if value != value or value in (float('inf'), float('-inf')):
+      return '{"v":%s}' % json.dumps(value)
+    return '{"v":%r}' % value
+  if isinstance(value, (int, long)):
+    return '{"v":%d}' % value
+  raise gviz_api.DataTableException(
+      'Wrong type %s when expected number' % type(value))
+
+
+def _EncodeStringCells(values):
+  """Returns the encoded cells of a string column.
+
+  Each distinct value is encoded once.
+  """
+  encoded = {}
+  cells = []
+  for value in values:
+    cell = encoded.get(value)
+    if cell is None:
+      cell = _EncodeStringCell(value)
+      encoded[value] = cell
+    cells.append(cell)
+  return cells
+
+
+def _EncodeStringCell(value):
+  """Returns the encoded cell of a string, as gviz_api would encode it."""
+  if value is None:
+    return NULL_CELL
+  if not isinstance(value, unicode):
+    value = str(value).decode('utf-8')
+  return u'{"v":%s}' % json.encoder.encode_basestring(value)
+
+
+def _EncodeBooleanCells(values):
+  """Returns the encoded cells of a boolean column."""
+  return [NULL_CELL if value is None else
+          '{"v":%s}' % ('true' if value else 'false') for value in values]
+
+
+# Maps the JavaScript type of a column to the function that encodes its cells.
+_CELL_ENCODERS = {
+    'number': _EncodeNumberCells,
+    'string': _EncodeStringCells,
+    'boolean': _EncodeBooleanCells
+}
@@ -0,0 +1,493 @@
+#!/usr/bin/python2.7
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Views of a Core Reporting API response requested on the public endpoint.
+
+  A view filters, reorders, pages and selects the columns of a stored
+  response before it is transformed to the requested format. Rows are
+  filtered and sorted by the typed values of a ColumnarReport, so metrics
+  compare as numbers. Filters are parsed when the view is requested and
+  compiled to one predicate per column when it is applied.
+
+  ReportView: The parameters of a view and how to apply them to a response.
+  ViewError: Raised for view parameters that can't be applied.
+  ParseColumns: Parses a columns parameter.
+  ParseFilters: Parses a filter parameter.
+  ParseSort: Parses a sort parameter.
+"""
+
+import hashlib
+import json
+import operator
+import re
+
+# The filter operators, longest first so that '>=' isn't parsed as '>'.
+FILTER_OPERATORS = ('==', '!=', '>=', '<=', '=~', '!~', '=@', '!@', '>', '<')
+
+# Filter operators that compare values, by the function that compares them.
+COMPARISON_OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '>': operator.gt,
+    '<': operator.lt,
+    '>=': operator.ge,
+    '<=': operator.le
+}
+
+# Filter operators that only apply to dimensions.
+DIMENSION_OPERATORS = ('=~', '!~', '=@', '!@')
+
+# Characters with a special meaning in regular expressions. Regular expression
+# filters only support literal text anchored with '^' or '$' since filters are
+# applied on the public endpoint and a pattern like '(a+)+$' can backtrack
+# for hours.
+REGEX_SPECIAL_CHARACTERS = frozenset('.^$*+?{}[]()|')
+
+# Splits a filter expression into a column name, an operator and an operand.
+FILTER_EXPRESSION = re.compile(r'^([^=!<>]+)(%s)(.*)$' % '|'.join(
+    re.escape(filter_operator) for filter_operator in FILTER_OPERATORS))
+
+
+class ViewError(ValueError):
+  """Exception for view parameters that can't be applied to a response."""
+  pass
+
+
+class ReportView(object):
+  """The parameters of a view of a Core Reporting API response."""
+
+  def __init__(self, sort=(), columns=(), filters=(), start=1, limit=None):
+    """Initialize the view.
+
+    Args:
+      sort: A tuple of (column name, descending) tuples, from the most to the
+            least significant column to sort by.
+      columns: A tuple of the names of the columns to return, in order. All
+               columns are returned if empty.
+      filters: A tuple of OR groups that a row must all match, as returned
+               by ParseFilters.
+      start: The 1-based index of the first row to return.
+      limit: The maximum number of rows to return or None for all rows.
+    """
+    self.sort = tuple(sort)
+    self.columns = tuple(columns)
+    self.filters = tuple(filters)
+    self.start = start
+    self.limit = limit
+
+  @classmethod
+  def FromRequest(cls, sort=None, columns=None, filters=None, start=None,
+                  limit=None):
+    """Returns the view requested with public endpoint parameters.
+
+    Args:
+      sort: The sort parameter of the request, if any.
+      columns: The columns parameter of the request, if any.
+      filters: The filter parameter of the request, if any.
+      start: The start parameter of the request, if any.
+      limit: The limit parameter of the request, if any.
+
+    Returns:
+      A ReportView or None if no view parameter was given.
+
+    Raises:
+      ViewError: A parameter is invalid.
+    """
+    if not (sort or columns or filters or start or limit):
+      return None
+    return cls(sort=ParseSort(sort) if sort else (),
+               columns=ParseColumns(columns) if columns else (),
+               filters=ParseFilters(filters) if filters else (),
+               start=_ParsePositiveInteger('start', start) if start else 1,
+               limit=_ParsePositiveInteger('limit', limit) if limit else None)
+
+  @property
+  def key(self):
+    """Returns a short key that identifies the parameters of the view.
+
+    The key is built from the parsed parameters. The order of the filter
+    expressions doesn't change which rows match so they are sorted, and
+    repeated expressions are removed, first.
+    """
+    filters = sorted(set(tuple(sorted(set(or_group)))
+                         for or_group in self.filters))
+    parameters = json.dumps({
+        'sort': self.sort,
+        'columns': self.columns,
+        'filters': filters,
+        'start': self.start,
+        'limit': self.limit
+    }, sort_keys=True)
+    return hashlib.md5(parameters).hexdigest()
+
+  def GetVariantKey(self, variant):
+    """Returns the key of a response variant with the view applied.
+
+    Args:
+      variant: The variant key of the format and content encoding.
+
+    Returns:
+      A string. e.g. 'csv.gzip.view-0123456789abcdef0123456789abcdef'.
+    """
+    return '%s.view-%s' % (variant, self.key)
+
+  def Apply(self, content, report):
+    """Applies the view to a response.
+
+    Args:
+      content: A dict representing the Core Reporting API JSON response.
+      report: The ColumnarReport of the response.
+
+    Returns:
+      A tuple of the content and the ColumnarReport with the view applied.
+      The given content and report are not modified.
+
+    Raises:
+      ViewError: The view can't be applied to the response.
+    """
+    if not report:
+      return (content, report)
+
+    # Filters and sorts may use columns that aren't selected, so columns are
+    # selected last.
+    column_indexes = [_GetColumnIndex(report, name) for name in self.columns]
+    indexes = None
+    content = dict(content)
+
+    if self.filters:
+      indexes = self._Filter(report)
+      content['totalResults'] = len(indexes)
+
+    if self.sort:
+      if indexes is None:
+        indexes = range(report.row_count)
+      # Stable sorts from the least significant column keep the order of the
+      # more significant columns for equal values.
+      for name, descending in reversed(self.sort):
+        column = _GetComparableColumn(report, _GetColumnIndex(report, name))
+        indexes.sort(key=column.__getitem__, reverse=descending)
+
+    if self.start > 1 or self.limit is not None:
+      if indexes is None:
+        indexes = range(report.row_count)
+      end = None if self.limit is None else self.start - 1 + self.limit
+      indexes = indexes[self.start - 1:end]
+
+    rows = content.get('rows') or []
+    if indexes is not None:
+      rows = [rows[index] for index in indexes]
+      report = report.Take(indexes)
+
+    if column_indexes:
+      content['columnHeaders'] = [content['columnHeaders'][index]
+                                  for index in column_indexes]
+      rows = [[row[index] for index in column_indexes] for row in rows]
+      report = report.Select(column_indexes)
+
+    content['rows'] = rows
+    return (content, report)
+
+  def _Filter(self, report):
+    """Returns the indexes of the rows of a report that match the filters.
+
+    Args:
+      report: The ColumnarReport to filter.
+
+    Returns:
+      A list of row indexes in ascending order.
+
+    Raises:
+      ViewError: A filter can't be applied to the report.
+    """
+    # Each expression is compiled and evaluated once per row into a column
+    # of matches. Rows match if they match an expression of every OR group.
+    groups = []
+    for or_group in self.filters:
+      matches = [_CompileFilter(report, *expression)
+                 for expression in or_group]
+      if len(matches) == 1:
+        groups.append(matches[0])
+      else:
+        groups.append([any(row) for row in zip(*matches)])
+    return [index for index, row in enumerate(zip(*groups)) if all(row)]
+
+
+def ParseColumns(columns):
+  """Parses a columns parameter.
+
+  Args:
+    columns: A comma separated list of column names. e.g.
+             'ga:browser,ga:visits'
+
+  Returns:
+    A tuple of column names.
+
+  Raises:
+    ViewError: The parameter has an empty or repeated column name.
+  """
+  names = tuple(name.strip() for name in columns.split(','))
+  if not all(names) or len(set(names)) != len(names):
+    raise ViewError('Invalid columns parameter: %s' % columns)
+  return names
+
+
+def ParseFilters(filters):
+  """Parses a filter parameter.
+
+  The parameter uses the syntax of the Core Reporting API filters parameter:
+  expressions of a column name, an operator and an operand, combined with
+  ',' for OR and ';' for AND. OR is evaluated before AND. A backslash escapes
+  a ',', ';' or backslash in an operand. e.g.
+  'ga:browser=~^Fire,ga:browser==Chrome;ga:visits>10'
+
+  Args:
+    filters: The filter parameter to parse.
+
+  Returns:
+    A tuple of OR groups that a row must all match. Each OR group is a tuple
+    of (column name, operator, operand) tuples.
+
+  Raises:
+    ViewError: An expression is invalid.
+  """
+  and_groups = []
+  for and_group in _SplitUnescaped(filters, ';'):
+    or_group = []
+    for expression in _SplitUnescaped(and_group, ','):
+      match = FILTER_EXPRESSION.match(expression)
+      if not match or not match.group(1).strip():
+        raise ViewError('Invalid filter expression: %s' % expression)
+      (name, filter_operator, operand) = match.groups()
+      operand = re.sub(r'\\([\\,;])', r'\1', operand)
+      or_group.append((name.strip(), filter_operator, operand))
+    and_groups.append(tuple(or_group))
+  return tuple(and_groups)
+
+
+def ParseSort(sort):
+  """Parses a sort parameter.
+
+  The parameter uses the syntax of the Core Reporting API sort parameter: a
+  comma separated list of column names, each preceded by a minus sign to sort
+  it in descending order. e.g. '-ga:visits,ga:browser'
+
+  Args:
+    sort: The sort parameter to parse.
+
+  Returns:
+    A tuple of (column name, descending) tuples.
+
+  Raises:
+    ViewError: The parameter has an empty column name.
+  """
+  sort_keys = []
+  for name in sort.split(','):
+    name = name.strip()
+    descending = name.startswith('-')
+    if descending:
+      name = name[1:]
+    if not name:
+      raise ViewError('Invalid sort parameter: %s' % sort)
+    sort_keys.append((name, descending))
+  return tuple(sort_keys)
+
+
+def _GetColumnIndex(report, name):
+  """Returns the index of a column in a report.
+
+  Args:
+    report: The ColumnarReport to find the column in.
+    name: The name of the column.
+
+  Returns:
+    The index of the column.
+
+  Raises:
+    ViewError: The report has no column with the name.
+  """
+  try:
+    return report.names.index(name)
+  except ValueError:
+    raise ViewError('Unknown column: %s' % name)
+
+
+def _GetComparableColumn(report, index):
+  """Returns the values of a column of a report in the type they compare as.
+
+  Args:
+    report: The ColumnarReport with the column.
+    index: The index of the column.
+
+  Returns:
+    The values of the column, numbers for metrics.
+
+  Raises:
+    ViewError: A value of a metric isn't a number.
+  """
+  try:
+    return report.GetComparableColumn(index)
+  except ValueError, e:
+    raise ViewError('Invalid number in %s: %s' % (report.names[index], e))
+
+
+def _CompileFilter(report, name, filter_operator, operand):
+  """Evaluates a filter expression for each row of a report.
+
+  The expression is compiled to a predicate once, and evaluated once for each
+  distinct value of a dimension. Every metric compares as a number.
+
+  Args:
+    report: The ColumnarReport to evaluate the expression on.
+    name: The name of the column to filter.
+    filter_operator: The operator of the expression.
+    operand: The operand of the expression.
+
+  Returns:
+    A list with whether each row matches the expression.
+
+  Raises:
+    ViewError: The expression can't be applied to the column.
+  """
+  index = _GetColumnIndex(report, name)
+  numeric = report.IsNumeric(index)
+  column = _GetComparableColumn(report, index)
+
+  if filter_operator in DIMENSION_OPERATORS:
+    if numeric:
+      raise ViewError('Operator %s does not apply to metric %s' % (
+          filter_operator, name))
+    if filter_operator in ('=~', '!~'):
+      predicate = _CompilePattern(operand)
+    else:
+      predicate = lambda value: operand in value
+    if filter_operator.startswith('!'):
+      positive = predicate
+      predicate = lambda value: not positive(value)
+  else:
+    if numeric:
+      try:
+        operand = float(operand)
+      except ValueError:
+        raise ViewError('Invalid number for %s: %s' % (name, operand))
+    compare = COMPARISON_OPERATORS[filter_operator]
+    predicate = lambda value: compare(value, operand)
+
+  if numeric:
+    return map(predicate, column)
+
+  results = {}
+  matches = []
+  for value in column:
+    result = results.get(value)
+    if result is None:
+      result = results[value] = predicate(value)
+    matches.append(result)
+  return matches
+
+
+def _CompilePattern(pattern):
+  """Compiles a regular expression filter operand to a predicate.
+
+  Only literal text is supported, optionally anchored with '^' at the start
+  and '$' at the end. A backslash escapes a special character. e.g. '^Fire',
+  'fox$' or '^www\\.google\\.com$'
+
+  Args:
+    pattern: The regular expression to compile.
+
+  Returns:
+    A function that returns whether a value matches the pattern.
+
+  Raises:
+    ViewError: The pattern isn't supported.
+  """
+  start = pattern.startswith('^')
+  end = False
+  literal = []
+  characters = iter(enumerate(pattern[1:] if start else pattern,
+                              1 if start else 0))
+  for index, character in characters:
+    if character == '\\':
+      (_, character) = next(characters, (None, None))
+      if character is None or character.isalnum():
+        raise ViewError('Unsupported regular expression: %s' % pattern)
+      literal.append(character)
+    elif character == '$' and index == len(pattern) - 1:
+      end = True
+    elif character in REGEX_SPECIAL_CHARACTERS:
+      raise ViewError('Unsupported regular expression: %s' % pattern)
+    else:
+      literal.append(character)
+  literal = ''.join(literal)
+
+  if start and end:
+    return lambda value: value == literal
+  if start:
+    return lambda value: value.startswith(literal)
+  if end:
+    return lambda value: value.endswith(literal)
+  return lambda value: literal in value
+
+
+def _ParsePositiveInteger(name, value):
+  """Parses a positive integer parameter.
+
+  Args:
+    name: The name of the parameter.
+    value: The value of the parameter.
+
+  Returns:
+    The value as an int.
+
+  Raises:
+    ViewError: The value isn't a positive integer.
+  """
+  try:
+    number = int(value)
+  except ValueError:
+    raise ViewError('Invalid %s parameter: %s' % (name, value))
+  if number < 1:
+    raise ViewError('Invalid %s parameter: %s' % (name, value))
+  return number
+
+
+def _SplitUnescaped(value, separator):
+  """Splits a string on a separator that isn't escaped with a backslash.
+
+  Args:
+    value: The string to split.
+    separator: The separator character.
+
+  Returns:
+    A list of the parts of the string, still escaped.
+  """
+  parts = []
+  current = []
+  escaped = False
+  for character in value:
+    if escaped:
+      current.append(character)
+      escaped = False
+    elif character == '\\':
+      current.append(character)
+      escaped = True
+    elif character == separator:
+      parts.append(''.join(current))
+      current = []
+    else:
+      current.append(character)
+  parts.append(''.join(current))
+  return parts
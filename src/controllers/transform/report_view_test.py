@@ -0,0 +1,259 @@
+#!/usr/bin/python2.7
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the report_view module."""
+
+import os
+import sys
+import unittest
+
+# The superProxy modules are imported from the src directory.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, os.pardir))
+from controllers.transform import columnar
+from controllers.transform import report_view
+
+
+class ReportViewTest(unittest.TestCase):
+
+  COLUMN_HEADERS = [
+      {'name': 'ga:city', 'columnType': 'DIMENSION', 'dataType': 'STRING'},
+      {'name': 'ga:visits', 'columnType': 'METRIC', 'dataType': 'INTEGER'}]
+
+  METRIC_COLUMN_HEADERS = [
+      {'name': 'ga:city', 'columnType': 'DIMENSION', 'dataType': 'STRING'},
+      {'name': 'ga:bounceRate', 'columnType': 'METRIC', 'dataType': 'PERCENT'},
+      {'name': 'ga:avgTimeOnSite', 'columnType': 'METRIC', 'dataType': 'TIME'}]
+
+  def BuildContent(self, rows):
+    return {'columnHeaders': self.COLUMN_HEADERS, 'rows': rows,
+            'totalResults': len(rows)}
+
+  def ApplyView(self, content, **parameters):
+    view = report_view.ReportView.FromRequest(**parameters)
+    report = columnar.ColumnarReport.FromContent(content)
+    return view.Apply(content, report)
+
+  def testParseSort(self):
+    self.assertEqual(((u'ga:visits', True), (u'ga:city', False)),
+                     report_view.ParseSort(u'-ga:visits, ga:city'))
+    self.assertRaises(report_view.ViewError, report_view.ParseSort, u'a,,b')
+    self.assertRaises(report_view.ViewError, report_view.ParseSort, u'-')
+
+  def testSort(self):
+    content = self.BuildContent([[u'Berlin', u'5'], [u'Aachen', u'12'],
+                                 [u'Bonn', u'5']])
+    (view_content, report) = self.ApplyView(content,
+                                            sort=u'-ga:visits,-ga:city')
+    self.assertEqual([[u'Aachen', u'12'], [u'Bonn', u'5'], [u'Berlin', u'5']],
+                     view_content['rows'])
+    self.assertEqual([(u'Aachen', 12), (u'Bonn', 5), (u'Berlin', 5)],
+                     list(report.Rows()))
+    # The stored content isn't modified.
+    self.assertEqual([u'Berlin', u'5'], content['rows'][0])
+
+  def testSortPercent(self):
+    content = {
+        'columnHeaders': self.METRIC_COLUMN_HEADERS,
+        'rows': [[u'Berlin', u'9.5', u'75.0'], [u'Aachen', u'50.2', u'3.25'],
+                 [u'Bonn', u'100.0', u'12.5']]}
+    # PERCENT metrics sort as numbers, not as strings.
+    (view_content, report) = self.ApplyView(content, sort=u'-ga:bounceRate')
+    self.assertEqual([u'Bonn', u'Aachen', u'Berlin'],
+                     [row[0] for row in view_content['rows']])
+    self.assertEqual([(u'Bonn', u'100.0', u'12.5'),
+                      (u'Aachen', u'50.2', u'3.25'),
+                      (u'Berlin', u'9.5', u'75.0')],
+                     list(report.Rows()))
+    (view_content, _) = self.ApplyView(content, sort=u'ga:avgTimeOnSite')
+    self.assertEqual([u'Aachen', u'Bonn', u'Berlin'],
+                     [row[0] for row in view_content['rows']])
+
+  def testSortNonAscii(self):
+    content = self.BuildContent([[u'Z\xfcrich', u'3'], [u'\xc9vry', u'5'],
+                                 [u'Berlin', u'5'], [u'\u6771\u4eac', u'1']])
+    (view_content, report) = self.ApplyView(content,
+                                            sort=u'-ga:visits,ga:city')
+    expected = [[u'Berlin', u'5'], [u'\xc9vry', u'5'], [u'Z\xfcrich', u'3'],
+                [u'\u6771\u4eac', u'1']]
+    self.assertEqual(expected, view_content['rows'])
+    self.assertEqual([(city, int(visits)) for city, visits in expected],
+                     list(report.Rows()))
+
+  def testSortUnknownColumn(self):
+    content = self.BuildContent([[u'Berlin', u'5']])
+    self.assertRaises(report_view.ViewError, self.ApplyView, content,
+                      sort=u'ga:country')
+
+  def testKey(self):
+    view = report_view.ReportView.FromRequest(sort=u'-ga:visits')
+    self.assertEqual(view.key,
+                     report_view.ReportView.FromRequest(sort=u'-ga:visits').key)
+    self.assertNotEqual(
+        view.key, report_view.ReportView.FromRequest(sort=u'ga:visits').key)
+    self.assertEqual('csv.view-%s' % view.key, view.GetVariantKey('csv'))
+    self.assertEqual(None, report_view.ReportView.FromRequest())
+
+  def testKeyIsCanonical(self):
+    view = report_view.ReportView.FromRequest(
+        filters=u'ga:visits>1;ga:city==Bonn,ga:city==Berlin')
+    for filters in (u'ga:city==Berlin,ga:city==Bonn;ga:visits>1',
+                    u' ga:visits>1;ga:city==Bonn,ga:city==Berlin;ga:visits>1',
+                    u'ga:visits>1;ga:city==Bonn,ga:city==Berlin,ga:city==Bonn'):
+      self.assertEqual(
+          view.key, report_view.ReportView.FromRequest(filters=filters).key)
+    self.assertNotEqual(
+        view.key, report_view.ReportView.FromRequest(
+            filters=u'ga:visits>1,ga:city==Bonn;ga:city==Berlin').key)
+
+  def testParseFilters(self):
+    self.assertEqual(
+        (((u'ga:city', u'=~', u'^B'), (u'ga:city', u'==', u'Aachen')),
+         ((u'ga:visits', u'>', u'10'),)),
+        report_view.ParseFilters(u'ga:city=~^B,ga:city==Aachen;ga:visits>10'))
+    self.assertEqual(
+        (((u'ga:city', u'==', u'a,b;c\\'),),),
+        report_view.ParseFilters(u'ga:city==a\\,b\\;c\\\\'))
+    for invalid in (u'ga:city', u'==Berlin', u'ga:city==Berlin;', u'a,,b'):
+      self.assertRaises(report_view.ViewError, report_view.ParseFilters,
+                        invalid)
+
+  def testParseFilterOperators(self):
+    for filter_operator in report_view.FILTER_OPERATORS:
+      self.assertEqual(
+          (((u'ga:visits', filter_operator, u'5'),),),
+          report_view.ParseFilters(u'ga:visits%s5' % filter_operator))
+    # The longest operator is matched first and the rest is the operand.
+    self.assertEqual((((u'ga:city', u'==', u'=a'),),),
+                     report_view.ParseFilters(u'ga:city===a'))
+
+  def testFilterPrecedence(self):
+    content = self.BuildContent([[u'Berlin', u'5'], [u'Aachen', u'12'],
+                                 [u'Bonn', u'1']])
+    # OR is evaluated before AND.
+    (view_content, _) = self.ApplyView(
+        content, filters=u'ga:city==Bonn,ga:city==Berlin;ga:visits>2')
+    self.assertEqual([[u'Berlin', u'5']], view_content['rows'])
+    self.assertEqual(1, view_content['totalResults'])
+
+  def testNumericFilters(self):
+    content = self.BuildContent([[u'Berlin', u'5'], [u'Aachen', u'12'],
+                                 [u'Bonn', u'10']])
+    expected = {
+        u'ga:visits==10': [u'Bonn'],
+        u'ga:visits!=10': [u'Berlin', u'Aachen'],
+        # Metrics compare as numbers, not as strings.
+        u'ga:visits>9': [u'Aachen', u'Bonn'],
+        u'ga:visits<10': [u'Berlin'],
+        u'ga:visits>=10': [u'Aachen', u'Bonn'],
+        u'ga:visits<=5.5': [u'Berlin']
+    }
+    for filters, cities in expected.items():
+      (view_content, _) = self.ApplyView(content, filters=filters)
+      self.assertEqual(cities, [row[0] for row in view_content['rows']],
+                       filters)
+    for filters in (u'ga:visits>many', u'ga:visits=@1', u'ga:country==DE'):
+      self.assertRaises(report_view.ViewError, self.ApplyView, content,
+                        filters=filters)
+
+  def testPercentAndTimeFilters(self):
+    content = {
+        'columnHeaders': self.METRIC_COLUMN_HEADERS,
+        'rows': [[u'Berlin', u'9.5', u'75.0'], [u'Aachen', u'50.2', u'3.25'],
+                 [u'Bonn', u'100.0', u'12.5']]}
+    expected = {
+        # PERCENT and TIME metrics compare as numbers, not as strings.
+        u'ga:bounceRate>20': [u'Aachen', u'Bonn'],
+        u'ga:bounceRate<20': [u'Berlin'],
+        u'ga:bounceRate==100': [u'Bonn'],
+        u'ga:avgTimeOnSite>4': [u'Berlin', u'Bonn'],
+        u'ga:avgTimeOnSite<12.5': [u'Aachen'],
+        u'ga:avgTimeOnSite==75': [u'Berlin']
+    }
+    for filters, cities in expected.items():
+      (view_content, _) = self.ApplyView(content, filters=filters)
+      self.assertEqual(cities, [row[0] for row in view_content['rows']],
+                       filters)
+    for filters in (u'ga:bounceRate=~^9', u'ga:avgTimeOnSite=@5'):
+      self.assertRaises(report_view.ViewError, self.ApplyView, content,
+                        filters=filters)
+
+  def testDimensionFilters(self):
+    content = self.BuildContent([[u'Berlin', u'5'], [u'Z\xfcrich', u'12'],
+                                 [u'Bonn', u'10']])
+    expected = {
+        u'ga:city==Bonn': [u'Bonn'],
+        u'ga:city!=Bonn': [u'Berlin', u'Z\xfcrich'],
+        u'ga:city=~^B': [u'Berlin', u'Bonn'],
+        u'ga:city=~n$': [u'Berlin', u'Bonn'],
+        u'ga:city=~^Bonn$': [u'Bonn'],
+        u'ga:city=~^B\\.': [],
+        u'ga:city!~^B': [u'Z\xfcrich'],
+        u'ga:city=~\xfc': [u'Z\xfcrich'],
+        u'ga:city=@on': [u'Bonn'],
+        u'ga:city!@on': [u'Berlin', u'Z\xfcrich'],
+        # Dimensions compare as strings.
+        u'ga:city>Bonn': [u'Z\xfcrich']
+    }
+    for filters, cities in expected.items():
+      (view_content, _) = self.ApplyView(content, filters=filters)
+      self.assertEqual(cities, [row[0] for row in view_content['rows']],
+                       filters)
+    # Regular expressions are limited to anchored literal text.
+    for filters in (u'ga:city=~(', u'ga:city=~(a+)+$', u'ga:city=~^B.*n$',
+                    u'ga:city=~B|Z', u'ga:city=~\\w', u'ga:city=~B\\'):
+      self.assertRaises(report_view.ViewError, self.ApplyView, content,
+                        filters=filters)
+
+  def testPaging(self):
+    rows = [[u'City %d' % index, unicode(index)] for index in range(5)]
+    content = self.BuildContent(rows)
+    expected = [
+        ({'start': u'1', 'limit': u'2'}, rows[0:2]),
+        ({'start': u'4'}, rows[3:]),
+        ({'start': u'4', 'limit': u'10'}, rows[3:]),
+        ({'start': u'6'}, []),
+        ({'limit': u'1', 'sort': u'-ga:visits'}, [rows[4]])
+    ]
+    for parameters, expected_rows in expected:
+      (view_content, report) = self.ApplyView(content, **parameters)
+      self.assertEqual(expected_rows, view_content['rows'])
+      self.assertEqual(len(expected_rows), report.row_count)
+      # Paging doesn't change the number of results of the query.
+      self.assertEqual(5, view_content['totalResults'])
+    for parameters in ({'start': u'0'}, {'limit': u'-1'}, {'limit': u'x'}):
+      self.assertRaises(report_view.ViewError,
+                        report_view.ReportView.FromRequest, **parameters)
+
+  def testColumns(self):
+    content = self.BuildContent([[u'Berlin', u'5'], [u'Aachen', u'12']])
+    (view_content, report) = self.ApplyView(
+        content, columns=u'ga:visits', sort=u'ga:city')
+    self.assertEqual([self.COLUMN_HEADERS[1]], view_content['columnHeaders'])
+    self.assertEqual([[u'12'], [u'5']], view_content['rows'])
+    self.assertEqual([(12,), (5,)], list(report.Rows()))
+    (view_content, _) = self.ApplyView(content, columns=u'ga:visits,ga:city')
+    self.assertEqual([[u'5', u'Berlin'], [u'12', u'Aachen']],
+                     view_content['rows'])
+    self.assertRaises(report_view.ViewError, self.ApplyView, content,
+                      columns=u'ga:country')
+    for columns in (u'ga:city,,ga:visits', u'ga:city,ga:city'):
+      self.assertRaises(report_view.ViewError,
+                        report_view.ReportView.FromRequest, columns=columns)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -21,6 +21,8 @@
   For example: CSV, TSV, Data Table, etc.
 
   GetTransform: Returns a transform for the requested format.
+  IsPrerendered: Checks if a transform can use pre-rendered content.
+  UsesColumnarReport: Checks if a transform renders from a ColumnarReport.
   TransformJson: Transform and render a Core Reporting API response as JSON.
   TransformCsv: Transform and render a Core Reporting API response as CSV.
   TransformDataTableString: Transform and render a Core Reporting API response
@@ -31,6 +33,7 @@
   RemoveKeys: Removes key/value pairs from a JSON response.
   GetDataTableSchema: Get a Data Table schema from Core Reporting API Response.
   GetDataTableRows: Get Data Table rows from Core Reporting API Response.
+  GetDataTableRowsFromReport: Get Data Table rows from a ColumnarReport.
   GetDataTable: Returns a Data Table using the Gviz library
   GetColumnOrder: Converts API Response column headers to columns for Gviz.
 """
@@ -38,22 +41,20 @@
 __author__ = 'pete.frisella@gmail.com (Pete Frisella)'
 
 import cStringIO
+import itertools
+import json
 import urllib
 
+from controllers.transform import columnar
+from controllers.transform import data_table_encoder
 from libs.csv_writer import csv_writer
 from libs.gviz_api import gviz_api
 
 # The label to use for unknown data types.
-UNKNOWN_LABEL = 'UNKNOWN'
+UNKNOWN_LABEL = columnar.UNKNOWN_LABEL
 
 # Maps the types used in a Core Reporting API response to Python types.
-BUILTIN_DATA_TYPES = {
-    'STRING': str,
-    'INTEGER': int,
-    'FLOAT': float,
-    'CURRENCY': float,
-    UNKNOWN_LABEL: str
-}
+BUILTIN_DATA_TYPES = columnar.BUILTIN_DATA_TYPES
 
 # Maps the types used in a Core Reporting API response to JavaScript types.
 JS_DATA_TYPES = {
@@ -104,33 +105,71 @@ def GetTransform(response_format='json', tqx=None):
   return transform
 
 
+def IsPrerendered(transform):
+  """Returns True if a transform can use content rendered ahead of time.
+
+  Responses are rendered in every supported format, using the default settings
+  of each transform, when they are refreshed. A transform whose output depends
+  on the request, such as a Data Table Response for a specific reqId, has to
+  transform the content at request time instead.
+
+  Args:
+    transform: The transform instance to check.
+
+  Returns:
+    A boolean indicating if the pre-rendered content for the format of the
+    transform can be used.
+  """
+  return str(getattr(transform, 'req_id', 0)) == '0'
+
+
+def UsesColumnarReport(transform):
+  """Returns True if a transform renders from a ColumnarReport.
+
+  These transforms have a TransformReport method that takes the typed columns
+  of a response, so the conversion can be shared between transforms.
+
+  Args:
+    transform: The transform instance to check.
+
+  Returns:
+    A boolean indicating if the transform has a TransformReport method.
+  """
+  return hasattr(transform, 'TransformReport')
+
+
 class TransformJson(object):
   """A transform to render a Core Reporting API response as JSON."""
 
   def Transform(self, content):
     """Transforms a Core Reporting API Response to JSON.
 
-    Although this method simply returns the original argument it is needed to
-    maintain a consistent interface for all transforms.
+    The response is serialized once so the JSON string can be cached and
+    output as is.
 
     Args:
       content: A dict representing the Core Reporting API JSON response to
                transform.
 
     Returns:
-      A dict, the original Core Reporting API Response.
+      None if no content is provided or a JSON string of the Core Reporting
+      API Response.
     """
-    return content
+    if content is None:
+      return None
+    return json.dumps(content)
 
-  def Render(self, webapp, content, status):
+  def Render(self, webapp, content, status, content_encoding=None):
     """Renders a Core Reporting API response in JSON.
 
     Args:
       webapp: The webapp2 object to use to render the response.
-      content: A dict representing the JSON content to render.
+      content: A JSON string or a dict representing the JSON content to
+               render.
       status: An integer representing the HTTP status code to send.
+      content_encoding: The encoding of compressed content, if any.
     """
-    webapp.RenderJson(content, status)
+    webapp.RenderJson(content, status, content_encoding)
 
 
 class TransformCsv(object):
@@ -176,15 +215,37 @@ class TransformCsv(object):
 
     return csv_output
 
-  def Render(self, webapp, content, status):
+  def Stream(self, content):
+    """Transforms the columns and rows from the API JSON response to CSV chunks.
+
+    Unlike Transform, no intermediate copy of the whole CSV document is built.
+    The rows are checked before the generator is returned so an invalid
+    response raises an error before any output is written.
+
+    Args:
+      content: A dict representing the Core Reporting API JSON response to
+               transform.
+
+    Returns:
+      A generator of strings that together make up a CSV formatted response
+      with a header.
+
+    Raises:
+      TypeError: A column name or a cell of the response is not a string.
+    """
+    return csv_writer.GetCsvChunkPrinter().StreamHeadersAndRows(content)
+
+  def Render(self, webapp, content, status, content_encoding=None):
     """Renders a Core Reporting API response as CSV.
 
     Args:
       webapp: The webapp2 object to use to render the response.
-      content: A dict representing the JSON content to render.
+      content: The CSV content to render. Either a string or an iterable of
+               strings when the content is streamed.
       status: An integer representing the HTTP status code to send.
+      content_encoding: The encoding of compressed content, if any.
     """
-    webapp.RenderCsv(content, status)
+    webapp.RenderCsv(content, status, content_encoding)
 
 
 class TransformDataTableString(object):
@@ -214,28 +275,34 @@ class TransformDataTableString(object):
     """
     if not content:
       return None
+    return self.TransformReport(columnar.ColumnarReport.FromContent(content))
 
-    column_headers = content.get('columnHeaders')
-    rows = content.get('rows')
-    if column_headers and rows:
-      data_table_schema = GetDataTableSchema(content)
-      data_table_rows = GetDataTableRows(content)
+  def TransformReport(self, report):
+    """Transforms the typed columns of a response to a DataTable JSON String.
 
-      data_table_output = GetDataTable(data_table_schema, data_table_rows)
+    Args:
+      report: The ColumnarReport of the Core Reporting API response.
 
-      if data_table_output:
-        return data_table_output.ToJSon()
+    Returns:
+      An empty string if a Data Table isn't supported for the report or a
+      Data Table as a JSON String.
+    """
+    if report and report.row_count:
+      data_table_schema = GetDataTableSchema(
+          {'columnHeaders': report.column_headers})
+      return data_table_encoder.ToJSon(data_table_schema, report)
     return ''
 
-  def Render(self, webapp, content, status):
+  def Render(self, webapp, content, status, content_encoding=None):
     """Renders a Core Reporting API response as a Data Table String.
 
     Args:
       webapp: The webapp2 object to use to render the response.
       content: A dict representing the JSON content to render.
       status: An integer representing the HTTP status code to send.
+      content_encoding: The encoding of compressed content, if any.
     """
-    webapp.RenderText(content, status)
+    webapp.RenderText(content, status, content_encoding)
 
 
 class TransformDataTableResponse(object):
@@ -254,6 +321,17 @@ class TransformDataTableResponse(object):
       tqx = urllib.unquote(tqx)
     self.tqx = tqx
 
+    self.req_id = 0
+    # If tqx exists then handle at a minimum the reqId parameter
+    if self.tqx:
+      tqx_pairs = {}
+      try:
+        tqx_pairs = dict(pair.split(':') for pair in self.tqx.split(';'))
+      except ValueError:
+        # if the parse fails then just continue and use the empty dict
+        pass
+      self.req_id = tqx_pairs.get('reqId', 0)
+
   def Transform(self, content):
     """Transforms a Core Reporting API response to a DataTable JSON Response.
 
@@ -279,41 +357,37 @@ class TransformDataTableResponse(object):
     """
     if not content:
       return None
+    return self.TransformReport(columnar.ColumnarReport.FromContent(content))
+
+  def TransformReport(self, report):
+    """Transforms the typed columns of a response to a DataTable Response.
+
+    Args:
+      report: The ColumnarReport of the Core Reporting API response.
 
-    column_headers = content.get('columnHeaders')
-    rows = content.get('rows')
-    if column_headers and rows:
-      data_table_schema = GetDataTableSchema(content)
-      data_table_rows = GetDataTableRows(content)
-      data_table_output = GetDataTable(data_table_schema, data_table_rows)
-
-      column_order = GetColumnOrder(column_headers)
-
-      if data_table_output:
-        req_id = 0
-        # If tqx exists then handle at a minimum the reqId parameter
-        if self.tqx:
-          tqx_pairs = {}
-          try:
-            tqx_pairs = dict(pair.split(':') for pair in self.tqx.split(';'))
-          except ValueError:
-            # if the parse fails then just continue and use the empty dict
-            pass
-          req_id = tqx_pairs.get('reqId', 0)
-
-        return data_table_output.ToJSonResponse(
-            columns_order=column_order, req_id=req_id)
+    Returns:
+      An empty string if a Data Table isn't supported for the report or a
+      Data Table Response as JSON.
+    """
+    if report and report.row_count:
+      data_table_schema = GetDataTableSchema(
+          {'columnHeaders': report.column_headers})
+      column_order = GetColumnOrder(report.column_headers)
+      return data_table_encoder.ToJSonResponse(
+          data_table_schema, report, columns_order=column_order,
+          req_id=self.req_id)
     return ''
 
-  def Render(self, webapp, content, status):
+  def Render(self, webapp, content, status, content_encoding=None):
     """Renders a Core Reporting API response as a Data Table Response.
 
     Args:
       webapp: The webapp2 object to use to render the response.
       content: A dict representing the JSON content to render.
       status: An integer representing the HTTP status code to send.
+      content_encoding: The encoding of compressed content, if any.
     """
-    webapp.RenderText(content, status)
+    webapp.RenderText(content, status, content_encoding)
 
 
 class TransformTsv(object):
@@ -365,15 +439,38 @@ class TransformTsv(object):
 
     return tsv_output
 
-  def Render(self, webapp, content, status):
+  def Stream(self, content):
+    """Transforms the columns and rows from the API JSON response to TSV chunks.
+
+    Each chunk is encoded to UTF-16 incrementally as it is output so no UTF-8
+    copy of the whole TSV document is built. The rows are checked before the
+    generator is returned so an invalid response raises an error before any
+    output is written.
+
+    Args:
+      content: A dict representing the Core Reporting API JSON response to
+               transform.
+
+    Returns:
+      A generator of UTF-16 encoded strings that together make up an Excel TSV
+      formatted response with a header.
+
+    Raises:
+      TypeError: A column name or a cell of the response is not a string.
+    """
+    return csv_writer.GetTsvChunkPrinter().StreamHeadersAndRows(content)
+
+  def Render(self, webapp, content, status, content_encoding=None):
     """Renders a Core Reporting API response as Excel TSV.
 
     Args:
       webapp: The webapp2 object to use to render the response.
-      content: A dict representing the JSON content to render.
+      content: The TSV content to render. Either a string or an iterable of
+               strings when the content is streamed.
       status: An integer representing the HTTP status code to send.
+      content_encoding: The encoding of compressed content, if any.
     """
-    webapp.RenderTsv(content, status)
+    webapp.RenderTsv(content, status, content_encoding)
 
 
 def RemoveKeys(content, keys_to_remove=PRIVATE_PROPERTIES):
@@ -482,7 +579,7 @@ def GetDataTableRows(content, data_types=None):
     data_types: A dict that maps the expected data types in the content to
                 the equivalent Python types. e.g.:
                 {
-                    'STRING': str,
+                    'STRING': unicode,
                     'INTEGER': int,
                     'FLOAT': float
                 }
@@ -492,31 +589,24 @@ def GetDataTableRows(content, data_types=None):
     Table. Returns None if there are no column headers in the Core Reporting
     API response.
   """
-  if not content:
+  report = columnar.ColumnarReport.FromContent(content, data_types)
+  if not report:
     return None
+  return GetDataTableRowsFromReport(report)
 
-  if data_types is None:
-    data_types = BUILTIN_DATA_TYPES
 
-  column_headers = content.get('columnHeaders')
-  data_table = None
+def GetDataTableRowsFromReport(report):
+  """Builds and returns Data Table rows from the typed columns of a response.
 
-  if column_headers:
-    data_table = []
-    for data in content.get('rows', []):
-      data_row = {}
-      for index, data in enumerate(data):
-        data_type = column_headers[index].get('dataType')
-        convert_to = data_types.get(data_type, data_types.get(UNKNOWN_LABEL))
-        if convert_to:
-          data_row_value = convert_to(data)
-        else:
-          data_row_value = data.encode('UTF-8')
-        data_row.update({
-            column_headers[index].get('name', UNKNOWN_LABEL): data_row_value
-        })
-      data_table.append(data_row)
-  return data_table
+  Args:
+    report: The ColumnarReport of a Core Reporting API response.
+
+  Returns:
+    A list where each item is a dict representing one row of data in a Data
+    Table.
+  """
+  names = report.names
+  return [dict(itertools.izip(names, row)) for row in report.Rows()]
 
 
 def GetDataTable(table_schema, table_rows):
@@ -528,12 +618,15 @@ def GetDataTable(table_schema, table_rows):
   Data Source Python Library:
   https://developers.google.com/chart/interactive/docs/dev/gviz_api_lib
 
+  The table is built in trusted mode, which skips the type checks of each
+  value, so the rows must already have the Python type of their column.
+
   Args:
     table_schema: A dict that contains column header and data type information
-                  for a Data Table.
+                  for a Data Table, as returned by GetDataTableSchema.
     table_rows: A list where each item in the list is a dict representing one
-                row of data in a Data Table. It should match the schema defined
-                by the provided table_schema argument.
+                row of data in a Data Table, as returned by GetDataTableRows
+                with the same data types as the schema.
 
   Returns:
     A gviz_api.DataTable object or None if Data Table isn't supported for
@@ -542,7 +635,7 @@ def GetDataTable(table_schema, table_rows):
   if not table_schema or not table_rows:
     return None
 
-  data_table_output = gviz_api.DataTable(table_schema)
+  data_table_output = gviz_api.DataTable(table_schema, trusted=True)
   data_table_output.LoadData(table_rows)
 
   return data_table_output
@@ -0,0 +1,91 @@
+#!/usr/bin/python2.7
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compact records of API Queries for the response caches.
+
+  Serving a cached response only needs a few fields of the API Query. Instead
+  of pickling the whole entity, these fields are packed into a short versioned
+  string that memcache stores as is.
+
+  ApiQueryRecord: The fields of an API Query needed to serve a response.
+"""
+
+import struct
+
+
+class ApiQueryRecord(object):
+  """The fields of an API Query needed to serve a cached response.
+
+  The record has the same attribute names as the API Query entity for these
+  fields so either can be used to serve a response.
+  """
+  __slots__ = ('refresh_interval', 'is_active', 'in_queue')
+
+  # Increment the version when the packed format changes. Records with a
+  # different version are treated as missing from the cache.
+  VERSION = 1
+
+  # Version, refresh interval and a bit field of the boolean fields.
+  _PACKED_FORMAT = struct.Struct('!BIB')
+  _IS_ACTIVE = 1
+  _IN_QUEUE = 2
+
+  def __init__(self, refresh_interval, is_active, in_queue):
+    """Initialize the record.
+
+    Args:
+      refresh_interval: How often, in seconds, the API Query is refreshed.
+      is_active: Whether the public endpoint of the API Query is enabled.
+      in_queue: Whether a refresh of the API Query is in the task queue.
+    """
+    self.refresh_interval = refresh_interval
+    self.is_active = is_active
+    self.in_queue = in_queue
+
+  @classmethod
+  def FromApiQuery(cls, api_query):
+    """Returns a record for an API Query entity."""
+    return cls(api_query.refresh_interval, api_query.is_active,
+               api_query.in_queue)
+
+  @classmethod
+  def FromString(cls, value):
+    """Returns the record packed in a string.
+
+    Args:
+      value: The string returned by ToString.
+
+    Returns:
+      The record or None if the value isn't a record of the current version.
+    """
+    if (not isinstance(value, str) or
+        len(value) != cls._PACKED_FORMAT.size):
+      return None
+
+    (version, refresh_interval, flags) = cls._PACKED_FORMAT.unpack(value)
+    if version != cls.VERSION:
+      return None
+    return cls(refresh_interval, bool(flags & cls._IS_ACTIVE),
+               bool(flags & cls._IN_QUEUE))
+
+  def ToString(self):
+    """Returns the record packed in a string."""
+    flags = 0
+    if self.is_active:
+      flags |= self._IS_ACTIVE
+    if self.in_queue:
+      flags |= self._IN_QUEUE
+    return self._PACKED_FORMAT.pack(self.VERSION, self.refresh_interval, flags)
@@ -0,0 +1,74 @@
+#!/usr/bin/python2.7
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark for the API Query cache record.
+
+Compares the cost, per cache hit, of unpickling an API Query entity, which is
+what memcache used to store, with unpacking an API Query record. Run from the
+src directory with the App Engine SDK on the Python path:
+
+  python -m controllers.util.cache_record_benchmark
+"""
+
+import cPickle
+import os
+import timeit
+
+os.environ.setdefault('APPLICATION_ID', 'benchmark')
+
+from controllers.util import cache_record
+from models import db_models
+
+ITERATIONS = 100000
+
+
+def BuildApiQuery():
+  """Returns an API Query entity like the ones created by users."""
+  user = db_models.GaSuperProxyUser(key_name='benchmark',
+                                    email='user@example.com')
+  return db_models.ApiQuery(
+      key_name='benchmark',
+      user=user,
+      name='Top pages for the last 30 days',
+      request=('https://www.googleapis.com/analytics/v3/data/ga?ids=ga:1234'
+               '&metrics=ga:pageviews,ga:uniquePageviews&dimensions=ga:pagePath'
+               '&sort=-ga:pageviews&start-date={30daysago}&end-date={today}'
+               '&max-results=50'),
+      refresh_interval=3600,
+      is_active=True,
+      is_scheduled=True)
+
+
+def Main():
+  api_query = BuildApiQuery()
+  pickled = cPickle.dumps(api_query, cPickle.HIGHEST_PROTOCOL)
+  packed = cache_record.ApiQueryRecord.FromApiQuery(api_query).ToString()
+
+  entity_time = timeit.timeit(lambda: cPickle.loads(pickled),
+                              number=ITERATIONS)
+  record_time = timeit.timeit(
+      lambda: cache_record.ApiQueryRecord.FromString(packed),
+      number=ITERATIONS)
+
+  print 'Cached size: entity %d bytes, record %d bytes' % (len(pickled),
+                                                          len(packed))
+  print 'Per hit: entity %.2f us, record %.2f us (%.1fx faster)' % (
+      entity_time / ITERATIONS * 1e6, record_time / ITERATIONS * 1e6,
+      entity_time / record_time)
+
+
+if __name__ == '__main__':
+  Main()
@@ -0,0 +1,135 @@
+#!/usr/bin/python2.7
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Utility functions to store content larger than a single value allows.
+
+  Memcache values and datastore entities are limited to 1 MB. Larger content
+  is split into chunks that are stored under their own keys, and a manifest
+  with the number of chunks and the hash of the content is stored in place of
+  the content. The hash is part of the chunk keys so a reader never combines
+  chunks of different content, and content is only returned if every chunk
+  is found.
+
+  ChunkManifest: Describes content stored in chunks.
+  ResolveMemcacheValues: Replaces manifests read from memcache with content.
+  SplitContent: Splits content into chunks.
+  SplitMemcacheValues: Replaces large values to write to memcache by chunks.
+"""
+
+import hashlib
+
+from controllers.util import co
+
+from google.appengine.api import memcache
+
+
+class ChunkManifest(object):
+  """Describes content stored in chunks in memcache."""
+  __slots__ = ('content_hash', 'chunk_count')
+
+  def __init__(self, content_hash, chunk_count):
+    """Initialize the manifest.
+
+    Args:
+      content_hash: The MD5 hex digest of the content.
+      chunk_count: The number of chunks of the content.
+    """
+    self.content_hash = content_hash
+    self.chunk_count = chunk_count
+
+  def __getstate__(self):
+    return (self.content_hash, self.chunk_count)
+
+  def __setstate__(self, state):
+    (self.content_hash, self.chunk_count) = state
+
+  def ChunkKeys(self, key):
+    """Returns the memcache keys of the chunks of the content of a key."""
+    return ['%s.%s.%d' % (key, self.content_hash, index)
+            for index in range(self.chunk_count)]
+
+
+def SplitContent(content, chunk_size=co.MAX_CHUNK_SIZE):
+  """Splits content into chunks.
+
+  Args:
+    content: The string to split.
+    chunk_size: The maximum number of bytes of each chunk.
+
+  Returns:
+    A list of strings that make up the content in order.
+  """
+  return [content[start:start + chunk_size]
+          for start in range(0, len(content), chunk_size)]
+
+
+def SplitMemcacheValues(mapping, chunk_size=co.MAX_CHUNK_SIZE):
+  """Replaces the large values of a mapping to write to memcache by chunks.
+
+  Args:
+    mapping: A dict of memcache keys to values, as given to set_multi.
+    chunk_size: The maximum number of bytes of a value.
+
+  Returns:
+    A dict where each string value larger than the chunk size is replaced by
+    a ChunkManifest and the chunks of the value are added under their keys.
+  """
+  split_mapping = {}
+  for key, value in mapping.items():
+    if isinstance(value, str) and len(value) > chunk_size:
+      chunks = SplitContent(value, chunk_size)
+      manifest = ChunkManifest(hashlib.md5(value).hexdigest(), len(chunks))
+      split_mapping.update(zip(manifest.ChunkKeys(key), chunks))
+      value = manifest
+    split_mapping[key] = value
+  return split_mapping
+
+
+def ResolveMemcacheValues(values, key_prefix=''):
+  """Replaces the manifests of values read from memcache with their content.
+
+  The chunks of all the manifests are read with one get_multi. Values that
+  are missing a chunk, or whose chunks don't match the hash of the manifest,
+  are removed as if they weren't in memcache.
+
+  Args:
+    values: The dict returned by get_multi. It is updated in place.
+    key_prefix: The key prefix given to get_multi.
+
+  Returns:
+    The updated dict of values.
+  """
+  manifests = dict((key, value) for key, value in values.items()
+                   if isinstance(value, ChunkManifest))
+  if not manifests:
+    return values
+
+  chunk_keys = []
+  for key, manifest in manifests.items():
+    chunk_keys.extend(manifest.ChunkKeys(key))
+  chunks = memcache.get_multi(chunk_keys, key_prefix=key_prefix)
+
+  for key, manifest in manifests.items():
+    parts = [chunks.get(chunk_key) for chunk_key in manifest.ChunkKeys(key)]
+    content = None
+    if None not in parts:
+      content = ''.join(parts)
+    if (content is not None and
+        hashlib.md5(content).hexdigest() == manifest.content_hash):
+      values[key] = content
+    else:
+      del values[key]
+  return values
@@ -55,6 +55,17 @@ SUPPORTED_FORMATS = {
     }
 }
 
+# Compressed variants of each format are rendered when a response is refreshed
+# and served to clients that accept the encoding. 'gzip' and 'deflate' are
+# supported.
+COMPRESSED_ENCODINGS = ['gzip']
+
+# Responses with at least this many rows are streamed in chunks when they are
+# requested as CSV or TSV instead of being rendered in memory as a whole. They
+# aren't rendered ahead of time in these formats. The python27 runtime buffers
+# the response body until the request is done, so streaming only avoids the
+# intermediate copies of the rendered document, not holding the output itself.
+STREAM_MIN_ROWS = 10000
 
 # Log API Response Errors
 # It's not recommended to set this to False.
@@ -68,10 +79,80 @@ QUERY_ERROR_LIMIT = 10
 # query's refresh interval.
 ABANDONED_INTERVAL_MULTIPLE = 2
 
+# Scheduling: The maximum age, in seconds, of a stored response that can be
+# served for an abandoned query. The stored response is served right away,
+# marked as stale, and the query is refreshed in the background. An older
+# response is refreshed before it is served.
+MAX_STALE_RESPONSE_AGE = 604800  # 7 days
+STALE_RESPONSE_WARNING = '110 - "Response is Stale"'
+
 # Scheduling: Used to randomize start times for scheduled tasks to prevent
 # multiple queries from all starting at the same time.
 MAX_RANDOM_COUNTDOWN = 60  # seconds
 
+# Leases: Only one request or task at a time refreshes the response of a query
+# or rebuilds its cached response. The others don't wait for the result and
+# serve the response that is stored instead. A lease expires after the lease
+# time, in seconds, in case its holder fails. A released lease is kept for the
+# released lease time so it can be acquired again with a compare-and-set.
+REFRESH_LEASE_TIME = 70  # The API request deadline and some extra time.
+REBUILD_LEASE_TIME = 10
+RELEASED_LEASE_TIME = 60
+
+# Caching: The maximum number of responses each instance keeps in memory for
+# the public endpoint. Cached responses expire after the query's refresh
+# interval or as soon as the query is refreshed.
+RESPONSE_CACHE_MAX_ENTRIES = 200
+
+# Caching: The number of seconds a response cached in an instance is served
+# before checking, with a memcache request, that the query wasn't refreshed.
+# Other instances can serve the previous response for up to this long after a
+# refresh. 0 checks on every request.
+RESPONSE_CACHE_GENERATION_CHECK_INTERVAL = 5
+
+# Caching: The maximum number of views of each query that are cached, until the
+# query is refreshed or its refresh interval passes. Each page of a view with a
+# start or a limit parameter counts as a view.
+MAX_CACHED_VIEWS = 20
+
+# Batch requests: The maximum number of query ids in a single request to the
+# batch endpoint.
+MAX_BATCH_QUERIES = 50
+
+# Request Counts: Buffer request count increments in memcache and flush them
+# to the datastore periodically (see cron.yaml) instead of writing them on
+# each request. Buffered increments are lost if they are evicted from memcache
+# before they are flushed, so at most one flush interval of counts can be lost.
+BUFFER_REQUEST_COUNTS = True
+COUNTER_FLUSH_INTERVAL = 60  # seconds, keep in sync with cron.yaml
+COUNTER_FLUSH_BATCH_SIZE = 100
+
+# Request Timestamps: The minimum number of seconds between datastore writes of
+# the last request time of a query. The exact time is kept in memcache. The
+# stored time is only used to find abandoned queries, which is measured in
+# multiples of the refresh interval, so it doesn't need to be exact. It is
+# written at least every half refresh interval of the query. The latest stored
+# time of each query is rolled up with the request count flush.
+REQUEST_TIMESTAMP_GRANULARITY = 60
+
+# Query Stats: The number of seconds request counts and times read from the
+# datastore for the admin and owner pages are cached in memcache.
+STATS_CACHE_TIME = 60
+
+# Shard Scaling: The request counters and timestamps of queries are scaled to
+# the number of shards their write contention needs periodically (see
+# cron.yaml). Writes and collisions are counted from one scaling to the next.
+SHARD_SCALING_BATCH_SIZE = 100
+
+# Large Responses: The maximum number of bytes stored in a single memcache
+# value or datastore entity. Larger responses are split into chunks of this
+# size, leaving room below the 1 MB limits for keys and other properties.
+MAX_CHUNK_SIZE = 900 * 1024
+
+# Migrations: The number of entities each migration task checks before it
+# continues in a new task.
+MIGRATION_BATCH_SIZE = 100
+
 # API Query Limitations (CreateForm)
 MAX_NAME_LENGTH = 115   # characters
 MAX_URL_LENGTH = 2000   # characters
@@ -82,17 +163,27 @@ MAX_INTERVAL = 2505600  # seconds
 REQUEST_COUNTER_KEY_TEMPLATE = 'request-count-{}'
 REQUEST_TIMESTAMP_KEY_TEMPLATE = 'last-request-{}'
 
+# Lease Key Names
+LEASE_KEY_TEMPLATE = 'lease-{}'
+REFRESH_LEASE_NAME_TEMPLATE = 'refresh-{}'
+REBUILD_LEASE_NAME_TEMPLATE = 'rebuild-{}-{}'
+
 # General Error Messages
 ERROR_INACTIVE_QUERY = 'inactiveQuery'
 ERROR_INVALID_REQUEST = 'invalidRequest'
 ERROR_INVALID_QUERY_ID = 'invalidQueryId'
+ERROR_INVALID_BATCH = 'invalidBatch'
+ERROR_INVALID_VIEW = 'invalidView'
 
 ERROR_MESSAGES = {
     ERROR_INACTIVE_QUERY: ('The query is not yet available. Wait and try again '
                            'later.'),
     ERROR_INVALID_REQUEST: ('The query id is invalid or the API Query is '
                             'disabled.'),
-    ERROR_INVALID_QUERY_ID: 'Invalid query id.'
+    ERROR_INVALID_QUERY_ID: 'Invalid query id.',
+    ERROR_INVALID_BATCH: ('A batch request needs between 1 and %d query ids.'
+                          % MAX_BATCH_QUERIES),
+    ERROR_INVALID_VIEW: 'The view parameters can\'t be applied to the query.'
 }
 
 DEFAULT_ERROR_MESSAGE = {
@@ -106,6 +197,10 @@ LINKS = {
     # Admin links
     'admin_users': '/admin/proxy/users',
     'admin_runtask': '/admin/proxy/runtask',
+    'admin_cache_stats': '/admin/proxy/cachestats',
+    'admin_flush_counters': '/admin/proxy/flushcounters',
+    'admin_scale_shards': '/admin/proxy/scaleshards',
+    'admin_migrate_responses': '/admin/proxy/migrateresponses',
 
     # Owner links
     'owner_default': r'/admin.*',
@@ -125,6 +220,7 @@ LINKS = {
     'public_default': r'/.*',
     'public_index': '/',
     'public_query': '/query',
+    'public_query_batch': '/query/batch',
 
     # Static directories
     'css': '/static/gasuperproxy/css/',
@@ -0,0 +1,121 @@
+#!/usr/bin/python2.7
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Utility functions to compress rendered API Query responses.
+
+  Rendered responses are stored uncompressed and, for each encoding in
+  COMPRESSED_ENCODINGS, compressed. Each of these variants is stored under a
+  variant key made of the format and the encoding. e.g. 'csv' and 'csv.gzip'.
+
+  Compress: Compresses rendered content using a content encoding.
+  GetAcceptedEncoding: Returns the preferred encoding from Accept-Encoding.
+  GetVariantKey: Returns the key for a format and encoding.
+  GetVariantKeys: Returns the keys for all formats and encodings.
+"""
+
+import cStringIO
+import gzip
+import zlib
+
+from controllers.util import co
+
+
+def Compress(content, encoding):
+  """Compresses rendered content.
+
+  Args:
+    content: A string with the rendered content to compress.
+    encoding: The content encoding to use. Either 'gzip' or 'deflate'.
+
+  Returns:
+    A string with the compressed content.
+
+  Raises:
+    ValueError: The encoding isn't supported.
+  """
+  if encoding == 'gzip':
+    output = cStringIO.StringIO()
+    # A fixed mtime keeps the output the same for the same content.
+    gzip_file = gzip.GzipFile(fileobj=output, mode='wb', mtime=0)
+    gzip_file.write(content)
+    gzip_file.close()
+    return output.getvalue()
+  elif encoding == 'deflate':
+    return zlib.compress(content)
+  raise ValueError('Unsupported content encoding: %s' % encoding)
+
+
+def GetAcceptedEncoding(accept_encoding):
+  """Returns the preferred compressed encoding accepted by a client.
+
+  Args:
+    accept_encoding: The value of the Accept-Encoding request header.
+                     e.g. 'gzip;q=1.0, deflate;q=0.5, identity'
+
+  Returns:
+    The encoding from COMPRESSED_ENCODINGS with the highest quality value
+    accepted by the client or None if none of them are accepted.
+  """
+  if not accept_encoding:
+    return None
+
+  qualities = {}
+  for coding in accept_encoding.split(','):
+    params = coding.strip().split(';')
+    name = params[0].strip().lower()
+    quality = 1.0
+    for param in params[1:]:
+      key, _, value = param.strip().partition('=')
+      if key.strip() == 'q':
+        try:
+          quality = float(value)
+        except ValueError:
+          quality = 0.0
+    qualities[name] = quality
+
+  accepted_encoding = None
+  accepted_quality = 0.0
+  for encoding in co.COMPRESSED_ENCODINGS:
+    quality = qualities.get(encoding, qualities.get('*', 0.0))
+    if quality > accepted_quality:
+      accepted_encoding = encoding
+      accepted_quality = quality
+  return accepted_encoding
+
+
+def GetVariantKey(response_format, encoding=None):
+  """Returns the key used to store a rendered response variant.
+
+  Args:
+    response_format: The format of the response.
+    encoding: The content encoding of the response or None if uncompressed.
+
+  Returns:
+    A string. e.g. 'csv' or 'csv.gzip'.
+  """
+  if encoding:
+    return '%s.%s' % (response_format, encoding)
+  return response_format
+
+
+def GetVariantKeys():
+  """Returns the keys for every supported format and encoding."""
+  keys = []
+  for response_format in co.SUPPORTED_FORMATS:
+    keys.append(GetVariantKey(response_format))
+    for encoding in co.COMPRESSED_ENCODINGS:
+      keys.append(GetVariantKey(response_format, encoding))
+  return keys
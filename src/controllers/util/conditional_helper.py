@@ -0,0 +1,142 @@
+#!/usr/bin/python2.7
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Utility functions to handle conditional requests for API Query responses.
+
+  Validators are built from the generation of an API Query response, which is
+  computed once each time the response is refreshed. The generation is a dict
+  containing the modified date and the content hash of the response.
+
+  FormatHttpDate: Formats a UTC datetime as an HTTP date.
+  GetETag: Returns the ETag of a response variant.
+  GetValidatorHeaders: Returns the validator headers for a response variant.
+  IsNotModified: Checks if the client already has the current response.
+  ParseHttpDate: Parses an HTTP date into a UTC datetime.
+"""
+
+import calendar
+from datetime import datetime
+from email import utils
+
+
+def FormatHttpDate(date_to_format):
+  """Formats a UTC datetime as an HTTP date.
+
+  Args:
+    date_to_format: datetime The UTC date to format.
+
+  Returns:
+    A string representing the date. e.g. 'Mon, 19 Aug 2013 16:05:00 GMT'.
+  """
+  return utils.formatdate(calendar.timegm(date_to_format.utctimetuple()),
+                          usegmt=True)
+
+
+def GetETag(generation, variant):
+  """Returns a strong ETag for a variant of an API Query response.
+
+  Args:
+    generation: A dict representing the generation of the API Query response.
+    variant: A string that identifies the representation of the response.
+             e.g. the format.
+
+  Returns:
+    A quoted ETag string or None if the generation has no content hash.
+  """
+  if generation and generation.get('content_hash'):
+    return '"%s-%s"' % (generation.get('content_hash'), variant)
+  return None
+
+
+def GetValidatorHeaders(generation, variant):
+  """Returns the validator headers for a variant of an API Query response.
+
+  Clients are asked to revalidate every time so that they keep receiving new
+  responses as soon as the API Query is refreshed.
+
+  Args:
+    generation: A dict representing the generation of the API Query response.
+    variant: A string that identifies the representation of the response.
+
+  Returns:
+    A dict of HTTP headers. Empty if there is no generation.
+  """
+  headers = {}
+  if generation:
+    etag = GetETag(generation, variant)
+    if etag:
+      headers['ETag'] = etag
+    if generation.get('modified'):
+      headers['Last-Modified'] = FormatHttpDate(generation.get('modified'))
+    headers['Cache-Control'] = 'no-cache'
+  return headers
+
+
+def IsNotModified(generation, variant, if_none_match=None,
+                  if_modified_since=None):
+  """Checks if the client already has the current API Query response.
+
+  If-Modified-Since is only used when the request has no If-None-Match header.
+
+  Args:
+    generation: A dict representing the generation of the API Query response.
+    variant: A string that identifies the representation of the response.
+    if_none_match: The value of the If-None-Match request header.
+    if_modified_since: The value of the If-Modified-Since request header.
+
+  Returns:
+    True if a 304 (Not Modified) response can be sent, False otherwise.
+  """
+  if not generation:
+    return False
+
+  if if_none_match:
+    etag = GetETag(generation, variant)
+    if not etag:
+      return False
+    for tag in if_none_match.split(','):
+      tag = tag.strip()
+      if tag.startswith('W/'):
+        tag = tag[2:]
+      if tag in ('*', etag):
+        return True
+    return False
+
+  if if_modified_since and generation.get('modified'):
+    since = ParseHttpDate(if_modified_since)
+    if since:
+      # HTTP dates don't include fractions of a second.
+      modified = generation.get('modified').replace(microsecond=0)
+      return modified <= since
+  return False
+
+
+def ParseHttpDate(http_date):
+  """Parses an HTTP date.
+
+  Args:
+    http_date: The string to parse. e.g. 'Mon, 19 Aug 2013 16:05:00 GMT'.
+
+  Returns:
+    A datetime in UTC or None if the date is invalid.
+  """
+  parsed_date = utils.parsedate_tz(http_date)
+  if not parsed_date:
+    return None
+  try:
+    return datetime.utcfromtimestamp(utils.mktime_tz(parsed_date))
+  except (ValueError, OverflowError):
+    return None
@@ -0,0 +1,79 @@
+#!/usr/bin/python2.7
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Utility functions for short leases shared by all instances.
+
+  A lease makes sure that only one request or task at a time does expensive
+  work, like refreshing an API Query response. The others don't wait for the
+  result and use what is available instead. Leases are kept in memcache and
+  expire after a number of seconds so a lease is never held forever if its
+  holder fails.
+
+  AcquireLease: Attempts to acquire a lease.
+  ReleaseLease: Releases a lease that was acquired.
+"""
+
+import uuid
+
+from controllers.util import co
+
+from google.appengine.api import memcache
+
+# The value of a lease that was released. memcache can't delete a value with a
+# compare-and-set so a released lease is overwritten with this value instead.
+RELEASED_LEASE = ''
+
+
+def AcquireLease(name, lease_time):
+  """Attempts to acquire a lease.
+
+  Args:
+    name: The name of the lease. e.g. 'refresh-QUERY_ID'.
+    lease_time: The number of seconds until the lease expires.
+
+  Returns:
+    A token that identifies the holder of the lease, to be used to release it,
+    or None if the lease is held by someone else.
+  """
+  token = uuid.uuid4().hex
+  lease_key = co.LEASE_KEY_TEMPLATE.format(name)
+  if memcache.add(lease_key, token, time=lease_time):
+    return token
+
+  client = memcache.Client()
+  if (client.gets(lease_key) == RELEASED_LEASE
+      and client.cas(lease_key, token, time=lease_time)):
+    return token
+  return None
+
+
+def ReleaseLease(name, token):
+  """Releases a lease.
+
+  The lease is released with a compare-and-set so a lease that expired and
+  was acquired by someone else in the meantime is left alone.
+
+  Args:
+    name: The name of the lease.
+    token: The token returned when the lease was acquired.
+  """
+  if not token:
+    return
+
+  lease_key = co.LEASE_KEY_TEMPLATE.format(name)
+  client = memcache.Client()
+  if client.gets(lease_key) == token:
+    client.cas(lease_key, RELEASED_LEASE, time=co.RELEASED_LEASE_TIME)
@@ -18,7 +18,10 @@
 
   FormatTimedelta: Converts a time delta to nicely formatted string.
   GetApiQueryLastRequest: Get timestamp of last request for an API Query.
+  GetApiQueryErrorCount: Get the number of errors of an API Query.
+  GetApiQueryErrorCounts: Get the number of errors of many API Queries.
   GetApiQueryRequestCount: Get request count of API Query.
+  GetApiQueryStats: Get the request and response stats of many API Queries.
   GetLastRequestTimedelta: Get the time since last request for query.
   GetModifiedTimedelta: Get the time since last refresh of API Query.
   IsApiQueryAbandoned: Checks if an API Query is abandoned.
@@ -34,6 +37,8 @@ from controllers.util import request_counter_shard
 from controllers.util import request_timestamp_shard
 
 from google.appengine.api import memcache
+from google.appengine.ext import db
+from google.appengine.ext import ndb
 
 
 def FormatTimedelta(time_delta):
@@ -73,14 +78,56 @@ def GetApiQueryLastRequest(query_id):
   """
   if query_id:
     request_timestamp_key = co.REQUEST_TIMESTAMP_KEY_TEMPLATE.format(query_id)
-    request_timestamp = memcache.get(request_timestamp_key)
-    if not request_timestamp:
-      request_timestamp = request_timestamp_shard.GetTimestamp(
-          request_timestamp_key)
-    return request_timestamp
+    return request_timestamp_shard.GetTimestamp(
+        request_timestamp_key, repair=bool(co.REQUEST_TIMESTAMP_GRANULARITY))
   return None
 
 
+def GetApiQueryErrorCount(api_query):
+  """Returns the number of errors saved for an API Query.
+
+  Args:
+    api_query: The API Query from which to retrieve the error count.
+
+  Returns:
+    An integer representing the number of errors saved for the API Query.
+    API Queries saved before errors were counted have their errors counted
+    up to the error limit.
+  """
+  return GetApiQueryErrorCounts([api_query])[0]
+
+
+def GetApiQueryErrorCounts(api_queries):
+  """Returns the number of errors saved for several API Queries at once.
+
+  The error counts are read in one datastore call. The errors of API Queries
+  saved before errors were counted are counted with queries that run in
+  parallel.
+
+  Args:
+    api_queries: A list of API Queries.
+
+  Returns:
+    A list of the number of errors of each API Query, in the same order.
+  """
+  error_counts = db.get([api_query.error_count_key
+                         for api_query in api_queries])
+  # Queries start fetching their first batch when they are run.
+  legacy_errors = dict(
+      (index, api_queries[index].api_query_errors.run(
+          keys_only=True, limit=co.QUERY_ERROR_LIMIT,
+          batch_size=co.QUERY_ERROR_LIMIT))
+      for index, error_count in enumerate(error_counts) if error_count is None)
+
+  counts = []
+  for index, error_count in enumerate(error_counts):
+    if error_count is None:
+      counts.append(len(list(legacy_errors[index])))
+    else:
+      counts.append(error_count.count)
+  return counts
+
+
 def GetApiQueryRequestCount(query_id):
   """Returns the request count for an API Query.
 
@@ -92,10 +139,116 @@ def GetApiQueryRequestCount(query_id):
     requested using the external public endpoint.
   """
   request_counter_key = co.REQUEST_COUNTER_KEY_TEMPLATE.format(query_id)
-  request_count = memcache.get(request_counter_key)
-  if not request_count:
-    request_count = request_counter_shard.GetCount(request_counter_key)
-  return request_count
+  return request_counter_shard.GetCount(
+      request_counter_key, repair=co.BUFFER_REQUEST_COUNTS)
+
+
+def GetApiQueryStats(api_queries):
+  """Returns the request and response stats of several API Queries at once.
+
+  The stats are read from memcache in one call. Request counts and times that
+  aren't in memcache are read from their maintained totals in one datastore
+  call and only fall back to reading their shards, all at once, if there is
+  no up to date total. Response times that aren't in memcache are read from
+  the responses in one more datastore call.
+
+  Args:
+    api_queries: A list of API Queries.
+
+  Returns:
+    A dict of each query id to a dict with the request count, the last
+    request time, the modified time of the response and the error count.
+  """
+  query_ids = [str(api_query.key()) for api_query in api_queries]
+  counter_names = dict(
+      (query_id, co.REQUEST_COUNTER_KEY_TEMPLATE.format(query_id))
+      for query_id in query_ids)
+  timestamp_names = dict(
+      (query_id, co.REQUEST_TIMESTAMP_KEY_TEMPLATE.format(query_id))
+      for query_id in query_ids)
+
+  memcache_keys = []
+  for query_id in query_ids:
+    memcache_keys.extend([
+        counter_names[query_id],
+        request_counter_shard.BUFFER_KEY_TEMPLATE.format(
+            counter_names[query_id]),
+        timestamp_names[query_id],
+        '%sgeneration' % query_id])
+  cached = memcache.get_multi(memcache_keys)
+
+  # Read the maintained totals of the counts and times missing from memcache.
+  counter_misses = [counter_names[query_id] for query_id in query_ids
+                    if counter_names[query_id] not in cached]
+  timestamp_misses = [timestamp_names[query_id] for query_id in query_ids
+                      if timestamp_names[query_id] not in cached]
+  datastore_keys = []
+  for name in counter_misses:
+    datastore_keys.extend([
+        ndb.Key(request_counter_shard.GeneralCounterShardConfig, name),
+        ndb.Key(request_counter_shard.GeneralCounterTotal, name)])
+  for name in timestamp_misses:
+    datastore_keys.extend([
+        ndb.Key(request_timestamp_shard.GeneralTimestampShardConfig, name),
+        ndb.Key(request_timestamp_shard.GeneralTimestampLatest, name)])
+  entities = iter(ndb.get_multi(datastore_keys))
+
+  to_cache = {}
+  counter_repairs = []
+  timestamp_repairs = []
+  for name in counter_misses:
+    (config, counter_total) = (next(entities), next(entities))
+    if config and config.has_total and counter_total:
+      to_cache[name] = counter_total.count
+    else:
+      counter_repairs.append(name)
+  for name in timestamp_misses:
+    (config, latest) = (next(entities), next(entities))
+    if config and config.has_latest and latest:
+      to_cache[name] = latest.timestamp
+    else:
+      timestamp_repairs.append(name)
+
+  # Counts and times saved before their totals were maintained are read from
+  # their shards.
+  if counter_repairs:
+    to_cache.update(request_counter_shard.GetShardTotals(
+        counter_repairs, repair=co.BUFFER_REQUEST_COUNTS))
+  if timestamp_repairs:
+    to_cache.update(request_timestamp_shard.GetShardTimestamps(
+        timestamp_repairs, repair=bool(co.REQUEST_TIMESTAMP_GRANULARITY)))
+  if to_cache:
+    memcache.add_multi(to_cache, time=co.STATS_CACHE_TIME)
+    cached.update(to_cache)
+
+  # Read the responses of the queries whose generation isn't in memcache.
+  response_misses = [api_query for api_query, query_id
+                     in zip(api_queries, query_ids)
+                     if not cached.get('%sgeneration' % query_id)]
+  responses = db.get([api_query.response_key
+                      for api_query in response_misses])
+  response_modified = dict(
+      (str(api_query.key()), response.modified)
+      for api_query, response in zip(response_misses, responses) if response)
+
+  error_counts = GetApiQueryErrorCounts(api_queries)
+
+  stats = {}
+  for api_query, query_id, error_count in zip(api_queries, query_ids,
+                                              error_counts):
+    counter_name = counter_names[query_id]
+    request_count = cached[counter_name] + int(cached.get(
+        request_counter_shard.BUFFER_KEY_TEMPLATE.format(counter_name)) or 0)
+
+    generation = cached.get('%sgeneration' % query_id)
+    stats[query_id] = {
+        'request_count': request_count,
+        'last_request': cached.get(timestamp_names[query_id]),
+        'response_modified': (generation.get('modified') if generation
+                              else response_modified.get(query_id)),
+        'error_count': error_count
+    }
+  return stats
 
 
 def GetLastRequestTimedelta(api_query, from_time=None):
@@ -136,7 +289,7 @@ def GetModifiedTimedelta(api_query, from_time=None):
   if not from_time:
     from_time = datetime.utcnow()
 
-  api_query_response = api_query.api_query_responses.get()
+  api_query_response = db.get(api_query.response_key)
   if api_query_response:
     time_delta = from_time - api_query_response.modified
     return FormatTimedelta(time_delta)
@@ -192,7 +345,7 @@ def IsApiQueryAbandoned(api_query):
 
   # Case 3: Check if there is a saved API Query Response.
   else:
-    api_query_response = api_query.api_query_responses.get()
+    api_query_response = db.get(api_query.response_key)
     if api_query_response:
       return True
 
@@ -201,5 +354,4 @@ def IsApiQueryAbandoned(api_query):
 
 def IsErrorLimitReached(api_query):
   """Returns a boolean to indicate if the API Query reached the error limit."""
-  return (api_query.api_query_errors.count(
-      limit=co.QUERY_ERROR_LIMIT) == co.QUERY_ERROR_LIMIT)
+  return GetApiQueryErrorCount(api_query) >= co.QUERY_ERROR_LIMIT
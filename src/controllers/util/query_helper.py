@@ -20,22 +20,46 @@
   BuildApiQuery: Creates an API Query for the user.
   DeleteApiQuery: Deletes an API Query and related entities.
   DeleteApiQueryErrors: Deletes API Query Errors.
+  DeleteApiQueryFromCache: Removes an API Query and responses from the caches.
   DeleteApiQueryResponses: Deletes API Query saved Responses.
   ExecuteApiQueryTask: Runs a task from the task queue.
   FetchApiQueryResponse: Makes a request to an API.
+  FlushApiQueryCounters: Writes buffered request counts to the datastore.
   GetApiQuery: Retrieves an API Query from the datastore.
+  GetApiQueries: Retrieves several API Queries from the datastore at once.
   GetApiQueryResponseFromDb: Returns the response content from the datastore..
+  GetApiQueryResponseFromCache: Retrieves an API query from the instance cache.
+  GetApiQueryResponseGeneration: Returns the generation of a query response.
   GetApiQueryResponseFromMemcache: Retrieves an API query from memcache.
+  GetApiQueryViewFromCache: Retrieves a response with a view from the caches.
+  GetPublicEndpointBatchJson: Serializes batch responses to a JSON envelope.
+  GetPublicEndpointBatchResponse: Returns public responses for many queries.
   GetPublicEndpointResponse: Returns public response for an API Query request.
+  GetReportView: Returns the view requested for a public response.
+  GetRequestTimestampGranularity: Returns how often a request time is saved.
+  GetViewError: Returns the error content for a view that can't be applied.
+  GetViewVariantKey: Returns the cache key of a response variant with a view.
   InsertApiQueryError: Saves an API Query Error response.
+  IsStreamedResponse: Checks if a response is streamed instead of rendered.
   ListApiQueries: Returns a list of API Queries.
+  MigrateApiQueryResponses: Moves saved responses under their API Query.
   RefreshApiQueryResponse: Fetched and saves an updated response for a query
+  RenderApiQueryResponse: Renders a response in every supported format.
+  RevalidateApiQueryResponse: Returns a stored response, refreshing if needed.
+  RollUpApiQueryTimestamps: Saves the latest request times of API Queries.
   SaveApiQuery: Saves an API Query for a user.
   SaveApiQueryResponse: Saves an API Query response for an API Query.
+  ScaleApiQueryShards: Scales request counter and timestamp shards.
   ScheduleAndSaveApiQuery: Saves and API Query and schedules it.
+  SetApiQueryViewInCache: Caches a response with a view.
   SetPublicEndpointStatus: Enables/Disables the public endpoint.
+  TrackApiQueryRequests: Starts updating the request counts and times.
   UpdateApiQueryCounter: Increments the request counter for an API Query.
+  UpdateApiQueryCounters: Increments the request counters for API Queries.
+  UpdateApiQueryCountersAsync: Starts incrementing request counters.
   UpdateApiQueryTimestamp: Updates the last request time for an API Query.
+  UpdateApiQueryTimestamps: Updates the last request time for API Queries.
+  UpdateApiQueryTimestampsAsync: Starts updating the last request times.
   ValidateApiQuery: Validates form input for creating an API Query.
 """
 
@@ -44,17 +68,28 @@ __author__ = 'pete.frisella@gmail.com (Pete Frisella)'
 import copy
 from datetime import datetime
 from datetime import timedelta
+import hashlib
 import json
+import logging
 import re
 import urllib
 
+from controllers.transform import columnar
+from controllers.transform import report_view
 from controllers.transform import transformers
 from controllers.util import analytics_auth_helper
+from controllers.util import cache_record
+from controllers.util import chunk_store
 from controllers.util import co
+from controllers.util import compression_helper
+from controllers.util import conditional_helper
 from controllers.util import date_helper
 from controllers.util import errors
+from controllers.util import lease_helper
+from controllers.util import models_helper
 from controllers.util import request_counter_shard
 from controllers.util import request_timestamp_shard
+from controllers.util import response_cache
 from controllers.util import schedule_helper
 from controllers.util import users_helper
 
@@ -64,6 +99,7 @@ from google.appengine.api import memcache
 from google.appengine.api import urlfetch
 from google.appengine.api import users
 from google.appengine.ext import db
+from google.appengine.ext import ndb
 
 
 def ResolveDates(fn):
@@ -170,11 +206,11 @@ def DeleteApiQuery(api_query):
   """
   if api_query:
     query_id = str(api_query.key())
-    DeleteApiQueryErrors(api_query)
+    # The error count is deleted with the API Query, not reset.
+    db.delete(api_query.api_query_errors)
     DeleteApiQueryResponses(api_query)
-    api_query.delete()
-    memcache.delete_multi(['api_query'] + co.SUPPORTED_FORMATS.keys(),
-                          key_prefix=query_id)
+    db.delete([api_query.error_count_key, api_query])
+    DeleteApiQueryFromCache(query_id)
 
     request_counter_key = co.REQUEST_COUNTER_KEY_TEMPLATE.format(query_id)
     request_counter_shard.DeleteCounter(request_counter_key)
@@ -186,11 +222,32 @@ def DeleteApiQuery(api_query):
 def DeleteApiQueryErrors(api_query):
   """Deletes API Query Errors.
 
+  The error count is only reset if the API Query has errors.
+
   Args:
     api_query: The API Query to delete errors for.
   """
-  if api_query and api_query.api_query_errors:
+  if api_query and api_query.api_query_errors.get(keys_only=True):
     db.delete(api_query.api_query_errors)
+    db_models.ApiQueryErrorCount(
+        key_name=db_models.ApiQueryErrorCount.KEY_NAME,
+        parent=api_query, count=0).put()
+
+
+def DeleteApiQueryFromCache(query_id):
+  """Removes an API Query and its responses from memcache and this instance.
+
+  Removing the generation makes other instances stop using their cached
+  responses for the API Query.
+
+  Args:
+    query_id: The ID of the API Query to remove.
+  """
+  memcache.delete_multi(
+      ['api_query', 'generation', 'view-count'] +
+      compression_helper.GetVariantKeys(),
+      key_prefix=query_id)
+  response_cache.Delete(query_id)
 
 
 def DeleteApiQueryResponses(api_query):
@@ -199,15 +256,21 @@ def DeleteApiQueryResponses(api_query):
   Args:
     api_query: The API Query for which to delete the response.
   """
-  if api_query and api_query.api_query_responses:
-    db.delete(api_query.api_query_responses)
+  if api_query:
+    keys = [api_query.response_key]
+    keys.extend(db_models.ApiQueryRenderedResponse.AllKeys(api_query))
+    db_response = db.get(api_query.response_key)
+    if db_response:
+      keys.extend(db_response.ChunkKeys())
+    db.delete(keys)
 
 
 def ExecuteApiQueryTask(api_query):
   """Executes a refresh of an API Query from the task queue.
 
     Attempts to fetch and update an API Query and will also log any errors.
-    Schedules the API Query for next execution.
+    Schedules the API Query for next execution. If the response is already
+    being refreshed by a request then the API Query is only rescheduled.
 
   Args:
     api_query: The API Query to refresh.
@@ -220,48 +283,130 @@ def ExecuteApiQueryTask(api_query):
     query_id = str(api_query.key())
     api_query.in_queue = False
 
-    api_response_content = FetchApiQueryResponse(api_query)
+    lease_name = co.REFRESH_LEASE_NAME_TEMPLATE.format(query_id)
+    lease = lease_helper.AcquireLease(lease_name, co.REFRESH_LEASE_TIME)
+    if not lease:
+      # A request is already refreshing the response so don't fetch it again.
+      SaveApiQuery(api_query)
+      schedule_helper.ScheduleApiQuery(api_query)
+      return False
 
-    if not api_response_content or api_response_content.get('error'):
-      InsertApiQueryError(api_query, api_response_content)
+    try:
+      return _ExecuteApiQueryTask(api_query)
+    finally:
+      lease_helper.ReleaseLease(lease_name, lease)
+  return False
 
-      if api_query.is_error_limit_reached:
-        api_query.is_scheduled = False
 
-      SaveApiQuery(api_query)
+def _ExecuteApiQueryTask(api_query):
+  """Refreshes an API Query from the task queue while holding its lease.
 
-      # Since it failed, execute the query again unless the refresh interval of
-      # query is less than the random countdown, then schedule it normally.
-      if api_query.refresh_interval < co.MAX_RANDOM_COUNTDOWN:
-        schedule_helper.ScheduleApiQuery(api_query)  # Run at normal interval.
-      else:
-        schedule_helper.ScheduleApiQuery(api_query, randomize=True, countdown=0)
-      return False
+  Args:
+    api_query: The API Query to refresh.
+
+  Returns:
+    A boolean. True if the API refresh was a success and False if an error
+    was logged.
+  """
+  query_id = str(api_query.key())
+  api_response_content = FetchApiQueryResponse(api_query)
+
+  if not api_response_content or api_response_content.get('error'):
+    InsertApiQueryError(api_query, api_response_content)
 
+    if api_query.is_error_limit_reached:
+      api_query.is_scheduled = False
+
+    SaveApiQuery(api_query)
+
+    # Since it failed, execute the query again unless the refresh interval of
+    # query is less than the random countdown, then schedule it normally.
+    if api_query.refresh_interval < co.MAX_RANDOM_COUNTDOWN:
+      schedule_helper.ScheduleApiQuery(api_query)  # Run at normal interval.
     else:
-      SaveApiQueryResponse(api_query, api_response_content)
+      schedule_helper.ScheduleApiQuery(api_query, randomize=True, countdown=0)
+    return False
 
-      # Check that public  endpoint wasn't disabled after task added to queue.
-      if api_query.is_active:
-        memcache.set_multi({'api_query': api_query,
-                            co.DEFAULT_FORMAT: api_response_content},
-                           key_prefix=query_id,
-                           time=api_query.refresh_interval)
-        # Delete the transformed content in memcache since it will be updated
-        # at the next request.
-        delete_keys = set(co.SUPPORTED_FORMATS) - set([co.DEFAULT_FORMAT])
+  else:
+    (query_response, rendered_content) = SaveApiQueryResponse(
+        api_query, api_response_content)
+
+    # Check that public  endpoint wasn't disabled after task added to queue.
+    if api_query.is_active:
+      memcache_keys = {
+          'api_query': cache_record.ApiQueryRecord.FromApiQuery(
+              api_query).ToString(),
+          'generation': query_response.generation
+      }
+      memcache_keys.update(rendered_content)
+      memcache.set_multi(chunk_store.SplitMemcacheValues(memcache_keys),
+                         key_prefix=query_id,
+                         time=api_query.refresh_interval)
+      # Delete the content in memcache of any format that failed to render
+      # since it will be transformed at the next request.
+      delete_keys = (set(compression_helper.GetVariantKeys()) -
+                     set(rendered_content))
+      if delete_keys:
         memcache.delete_multi(list(delete_keys), key_prefix=query_id)
+      response_cache.Delete(query_id)
 
-        SaveApiQuery(api_query)
-        schedule_helper.ScheduleApiQuery(api_query)
-        return True
-
-      # Save the query state just in case the user disabled it
-      # while it was in the task queue.
       SaveApiQuery(api_query)
+      schedule_helper.ScheduleApiQuery(api_query)
+      return True
+
+    # Save the query state just in case the user disabled it
+    # while it was in the task queue.
+    SaveApiQuery(api_query)
   return False
 
 
+def FlushApiQueryCounters():
+  """Writes the buffered request counts of API Queries to the datastore.
+
+  Only the request counters that were incremented since the last flush are
+  flushed, without reading every API Query.
+
+  Returns:
+    The flush status entity of the request counters.
+  """
+  return request_counter_shard.FlushIncrements(
+      batch_size=co.COUNTER_FLUSH_BATCH_SIZE)
+
+
+def RollUpApiQueryTimestamps():
+  """Saves the latest request times of API Queries to the datastore.
+
+  Only the request timestamps that were written since the last roll up are
+  read, without reading every API Query.
+
+  Returns:
+    The number of request timestamps that were rolled up.
+  """
+  return request_timestamp_shard.RollUpLatest(
+      batch_size=co.COUNTER_FLUSH_BATCH_SIZE)
+
+
+def ScaleApiQueryShards():
+  """Scales the request counter and timestamp shards of all API Queries.
+
+  Returns:
+    A dict with the request counters and the request timestamps whose number
+    of shards changed, each a dict of the name to the new number of shards.
+  """
+  query_ids = [str(key) for key in
+               db_models.ApiQuery.all(keys_only=True).run(batch_size=1000)]
+  request_counter_keys = [co.REQUEST_COUNTER_KEY_TEMPLATE.format(query_id)
+                          for query_id in query_ids]
+  request_timestamp_keys = [co.REQUEST_TIMESTAMP_KEY_TEMPLATE.format(query_id)
+                            for query_id in query_ids]
+  return {
+      'request_counters': request_counter_shard.ScaleShards(
+          request_counter_keys, batch_size=co.SHARD_SCALING_BATCH_SIZE),
+      'request_timestamps': request_timestamp_shard.ScaleShards(
+          request_timestamp_keys, batch_size=co.SHARD_SCALING_BATCH_SIZE)
+  }
+
+
 @ResolveDates
 @analytics_auth_helper.AuthorizeApiQuery
 def FetchApiQueryResponse(api_query):
@@ -289,29 +434,73 @@ def GetApiQuery(query_id):
     return None
 
 
-def GetApiQueryResponseFromDb(api_query):
+def GetApiQueries(query_ids):
+  """Retrieves several API Query entities with one datastore request.
+
+  Args:
+    query_ids: A list of the ids of the entities.
+
+  Returns:
+    A list with the API Query entity for each id, in the same order. The
+    entry is None if the id is invalid or the API Query doesn't exist.
+  """
+  keys = []
+  for query_id in query_ids:
+    try:
+      key = db.Key(query_id)
+      if key.kind() == db_models.ApiQuery.kind():
+        keys.append(key)
+        continue
+    except db.BadKeyError:
+      pass
+    keys.append(None)
+
+  valid_keys = [key for key in keys if key]
+  entities = dict(zip(valid_keys, db.get(valid_keys))) if valid_keys else {}
+  return [entities.get(key) if key else None for key in keys]
+
+
+def GetApiQueryResponseFromDb(api_query, requested_format=co.DEFAULT_FORMAT):
   """Attempts to return an API Query response from the datastore.
 
   Args:
     api_query: The API Query for which the response is being requested.
+    requested_format: The variant key of the format type requested for the
+                      response. The response rendered in this format is
+                      included when available.
 
   Returns:
     A dict with the HTTP status code and content for a public response.
-    e.g. Valid Response: {'status': 200, 'content': A_JSON_RESPONSE}
+    e.g. Valid Response: {'status': 200, 'content': A_JSON_RESPONSE,
+                          'rendered_content': A_CSV_RESPONSE,
+                          'generation': A_GENERATION}
     e.g. Error: {'status': 400, 'content': {'error': 'badRequest',
                                             'code': 400,
                                             'message': This is a bad request'}}
   """
   status = 400
   content = co.DEFAULT_ERROR_MESSAGE
+  rendered_content = None
+  generation = None
 
   if api_query and api_query.is_active:
     try:
-      query_response = api_query.api_query_responses.get()
+      (query_response, query_content) = (
+          db_models.ApiQueryResponse.GetWithContent(api_query.response_key))
 
-      if query_response:
+      if query_content is not None:
         status = 200
-        content = query_response.content
+        content = query_content
+        generation = query_response.generation
+
+        if requested_format != co.DEFAULT_FORMAT:
+          rendered_response = (
+              db_models.ApiQueryRenderedResponse.get_by_key_name(
+                  requested_format, parent=api_query))
+          # Only use a rendered response from the same refresh.
+          if (rendered_response and
+              rendered_response.modified == query_response.modified):
+            rendered_content = rendered_response.content
       else:
         status = 400
         content = {
@@ -327,140 +516,661 @@ def GetApiQueryResponseFromDb(api_query):
 
   response = {
       'status': status,
-      'content': content
+      'content': content,
+      'rendered_content': rendered_content,
+      'generation': generation
   }
 
   return response
 
 
+def GetApiQueryResponseFromCache(query_id, requested_format):
+  """Attempts to return an API Query response from the instance cache.
+
+  A cached response is only returned if the generation of the response in
+  memcache shows that the API Query hasn't been refreshed since. The
+  generation is checked at most once every
+  RESPONSE_CACHE_GENERATION_CHECK_INTERVAL seconds for each cached response.
+
+  Args:
+    query_id: The query id of the API Query to retrieve from the cache.
+    requested_format: The variant key of the format requested for the response.
+
+  Returns:
+    A dict contatining the API Query and the response in the requested format.
+    None if there was no current response in the cache.
+  """
+  return response_cache.Get(
+      query_id, requested_format,
+      lambda: GetApiQueryResponseGeneration(query_id))
+
+
+def GetApiQueryResponseGeneration(query_id):
+  """Returns the generation of the latest API Query response from memcache.
+
+  The generation identifies a refresh of the response. It contains the
+  modified date and content hash of the response.
+
+  Args:
+    query_id: The query id of the API Query.
+
+  Returns:
+    A dict with the modified date and content hash of the response or None if
+    the generation isn't in memcache.
+  """
+  return memcache.get('%sgeneration' % query_id)
+
+
 def GetApiQueryResponseFromMemcache(query_id, requested_format):
   """Attempts to return an API Query response from memcache.
 
   Args:
     query_id: The query id of the API Query to retrieve from memcache.
-    requested_format: The format type requested for the response.
+    requested_format: The variant key of the format requested for the response.
 
   Returns:
-    A dict contatining the API Query, the response in the default format
-    and requested format if available. None if there was no query found.
+    A dict contatining the API Query record, the generation of the response
+    and the response in the requested format if available. None if there was
+    no query found.
   """
-  query_in_memcache = memcache.get_multi(
-      ['api_query', co.DEFAULT_FORMAT, requested_format],
+  query_in_memcache = chunk_store.ResolveMemcacheValues(
+      memcache.get_multi(['api_query', 'generation', requested_format],
+                         key_prefix=query_id),
       key_prefix=query_id)
 
   if query_in_memcache:
     query = {
-        'api_query': query_in_memcache.get('api_query'),
-        'content': query_in_memcache.get(co.DEFAULT_FORMAT),
-        'transformed_content': query_in_memcache.get(requested_format)
+        'api_query': cache_record.ApiQueryRecord.FromString(
+            query_in_memcache.get('api_query')),
+        'generation': query_in_memcache.get('generation'),
+        'content': query_in_memcache.get(requested_format)
     }
     return query
   return None
 
 
+def GetApiQueryViewFromCache(query_id, view_variant):
+  """Attempts to return a response with a view from the caches.
+
+  The instance cache is checked first and then memcache. A response with a
+  view is only returned if it has the current generation of the API Query
+  response.
+
+  Args:
+    query_id: The query id of the API Query.
+    view_variant: The variant key of the format, content encoding and view.
+
+  Returns:
+    A dict containing the generation, the content and the refresh interval of
+    the response or None if there was no current response in the caches.
+  """
+  cached_view = response_cache.Get(
+      query_id, view_variant,
+      lambda: GetApiQueryResponseGeneration(query_id))
+  if cached_view:
+    return cached_view
+
+  metadata_key = '%s.metadata' % view_variant
+  in_memcache = chunk_store.ResolveMemcacheValues(
+      memcache.get_multi(['generation', view_variant, metadata_key],
+                         key_prefix=query_id),
+      key_prefix=query_id)
+  generation = in_memcache.get('generation')
+  metadata = in_memcache.get(metadata_key)
+  if (generation is None or in_memcache.get(view_variant) is None
+      or not metadata or metadata.get('generation') != generation):
+    return None
+
+  cached_view = {
+      'generation': generation,
+      'content': in_memcache.get(view_variant),
+      'refresh_interval': metadata.get('refresh_interval')
+  }
+  response_cache.Set(query_id, view_variant, cached_view, generation,
+                     metadata.get('refresh_interval'))
+  return cached_view
+
+
+def GetPublicEndpointBatchResponse(query_ids, requested_format=None):
+  """Returns the public responses for a batch of API Queries.
+
+  All the API Queries are looked up in memcache with a single request and the
+  ones that aren't in memcache are retrieved from the datastore with a single
+  request. The request counters and timestamps of the API Queries that had a
+  response are then updated together.
+
+  Args:
+    query_ids: A list of the query ids to retrieve responses for.
+    requested_format: The format type requested for the responses.
+
+  Returns:
+    A list with a dict for each distinct query id, in the order requested,
+    containing the query id, HTTP status code and response content. Stale
+    responses of abandoned API Queries are marked with 'stale': True. The
+    content of successful responses is in the rendered form of the format,
+    i.e. a serialized JSON string for JSON and UTF-16 encoded for TSV.
+    e.g. [{'id': 'abc', 'status': 200, 'content': A_CSV_RESPONSE},
+          {'id': 'def', 'status': 400, 'content': {'error': 'invalidQueryId',
+                                                   'code': 400,
+                                                   'message': 'Invalid...'}}]
+  """
+  if not requested_format or requested_format not in co.SUPPORTED_FORMATS:
+    requested_format = co.DEFAULT_FORMAT
+  transform = transformers.GetTransform(requested_format)
+
+  unique_ids = []
+  for query_id in query_ids:
+    if query_id not in unique_ids:
+      unique_ids.append(query_id)
+
+  memcache_keys = []
+  for query_id in unique_ids:
+    memcache_keys.extend(['%sapi_query' % query_id,
+                          '%s%s' % (query_id, requested_format)])
+  in_memcache = chunk_store.ResolveMemcacheValues(
+      memcache.get_multi(memcache_keys))
+
+  responses = {}
+  refresh_intervals = {}
+  missing_ids = []
+  for query_id in unique_ids:
+    content = in_memcache.get('%s%s' % (query_id, requested_format))
+    api_query_record = cache_record.ApiQueryRecord.FromString(
+        in_memcache.get('%sapi_query' % query_id))
+    if api_query_record and content is not None:
+      responses[query_id] = {'status': 200, 'content': content}
+      refresh_intervals[query_id] = api_query_record.refresh_interval
+    else:
+      missing_ids.append(query_id)
+
+  # Memcache only accepts one expiration time per request so the responses to
+  # cache are grouped by refresh interval.
+  cache_by_interval = {}
+  for query_id, api_query in zip(missing_ids, GetApiQueries(missing_ids)):
+    response = RevalidateApiQueryResponse(api_query, requested_format)
+    content = response.get('content')
+    status = response.get('status')
+
+    if status == 200:
+      # Stale responses aren't cached since the cache doesn't keep them
+      # marked as stale.
+      cache_response = not response.get('stale')
+      transformed_content = response.get('rendered_content')
+      if transformed_content is None:
+        if co.ANONYMIZE_RESPONSES:
+          content = transformers.RemoveKeys(content)
+        try:
+          transformed_content = transform.Transform(content)
+        except (KeyError, TypeError, AttributeError):
+          # If the transformation fails then return the original content.
+          transformed_content = content
+          cache_response = False
+      content = transformed_content
+
+      if cache_response:
+        cache_by_interval.setdefault(api_query.refresh_interval, {}).update({
+            '%sapi_query' % query_id: cache_record.ApiQueryRecord.FromApiQuery(
+                api_query).ToString(),
+            '%sgeneration' % query_id: response.get('generation'),
+            '%s%s' % (query_id, requested_format): content
+        })
+
+      if not api_query.in_queue:
+        schedule_helper.ScheduleApiQuery(api_query)
+      refresh_intervals[query_id] = api_query.refresh_interval
+
+    responses[query_id] = {'status': status, 'content': content}
+    if response.get('stale'):
+      responses[query_id]['stale'] = True
+
+  for refresh_interval, memcache_keys in cache_by_interval.items():
+    memcache.add_multi(chunk_store.SplitMemcacheValues(memcache_keys),
+                       time=refresh_interval)
+
+  successful_ids = [query_id for query_id in unique_ids
+                    if responses[query_id].get('status') == 200]
+  if successful_ids:
+    TrackApiQueryRequests(successful_ids, refresh_intervals)
+
+  batch_response = []
+  for query_id in unique_ids:
+    batch_response.append({
+        'id': query_id,
+        'status': responses[query_id].get('status'),
+        'content': responses[query_id].get('content')
+    })
+    if responses[query_id].get('stale'):
+      batch_response[-1]['stale'] = True
+  return batch_response
+
+
+def GetPublicEndpointBatchJson(batch_response, requested_format=None):
+  """Serializes the responses of a batch request to a JSON envelope.
+
+  JSON content is cached as a serialized string so it is spliced into the
+  envelope as it is instead of being parsed and serialized again. TSV
+  content, which is UTF-16 encoded for Excel, is decoded to be embedded as a
+  string.
+
+  Args:
+    batch_response: The list of responses returned by
+                    GetPublicEndpointBatchResponse.
+    requested_format: The format type requested for the responses.
+
+  Returns:
+    A string of serialized JSON. e.g.
+    '{"format": "json", "responses": [{"id": "abc", "status": 200, ...}]}'
+  """
+  content_format = requested_format
+  if not content_format or content_format not in co.SUPPORTED_FORMATS:
+    content_format = co.DEFAULT_FORMAT
+
+  responses_json = []
+  for response in batch_response:
+    content = response.get('content')
+    content_json = None
+    if isinstance(content, str) and response.get('status') == 200:
+      if content_format == co.DEFAULT_FORMAT:
+        content_json = content
+      elif content_format == 'tsv':
+        content = content.decode('UTF-16')
+    if content_json is None:
+      content_json = json.dumps(content)
+
+    members = ['"id": %s' % json.dumps(response.get('id')),
+               '"status": %s' % json.dumps(response.get('status')),
+               '"content": %s' % content_json]
+    if response.get('stale'):
+      members.append('"stale": true')
+    responses_json.append('{%s}' % ', '.join(members))
+
+  return '{"format": %s, "responses": [%s]}' % (json.dumps(requested_format),
+                                                ', '.join(responses_json))
+
+
 def GetPublicEndpointResponse(
-    query_id=None, requested_format=None, transform=None):
+    query_id=None, requested_format=None, transform=None,
+    if_none_match=None, if_modified_since=None, accepted_encoding=None,
+    view=None):
   """Returns the public response for an external user request.
 
   This handles all the steps required to get the latest successful API
   response for an API Query.
-    1) Check Memcache, if found skip to #4.
-    2) If not in memcache, check if the stored response is abandoned and needs
-       to be refreshed.
-    3) Retrieve response from datastore.
-    4) Perform any transforms and return the formatted response to the user.
+    1) For a conditional request, check if the client has the latest response.
+    2) Check the instance cache and Memcache, if found skip to #5. Only the
+       request that holds the rebuild lease caches the response again.
+    3) If not in memcache, retrieve response from datastore.
+    4) If the query is abandoned, serve the stored response marked as stale
+       and refresh it in the background, or refresh it first if it is too old.
+    5) Perform any transforms and return the formatted response to the user.
+
+  Responses are rendered in every format and compressed when they are
+  refreshed, so a transform only runs here if the requested format could not
+  be rendered ahead of time. A view, such as a sort order, is applied to the
+  content in the default format before the transform, and the result is
+  cached for the format, content encoding and view.
 
   Args:
     query_id: The query id to retrieve the response for.
     requested_format: The format type requested for the response.
     transform: The transform instance to use to transform the content to the
                requested format, if required.
+    if_none_match: The If-None-Match header of the request, if any.
+    if_modified_since: The If-Modified-Since header of the request, if any.
+    accepted_encoding: The compressed content encoding accepted by the client
+                       or None to return uncompressed content.
+    view: The ReportView to apply to the response or None for the whole
+          response.
 
   Returns:
-    A tuple contatining the response content, and status code to
-    render. e.g. (CONTENT, 200)
+    A tuple contatining the response content, status code and a dict of
+    headers to render. e.g. (CONTENT, 200, {'ETag': '"abc-json"'})
+    The content is None if the status code is 304 (Not Modified). If the
+    content is compressed the headers include its Content-Encoding. A stale
+    response includes a Warning header.
   """
+  response_content = None
   transformed_response_content = None
   schedule_query = False
+  cache_response = False
+  stale = False
+  view_error = None
 
   if not requested_format or requested_format not in co.SUPPORTED_FORMATS:
     requested_format = co.DEFAULT_FORMAT
 
-  response = GetApiQueryResponseFromMemcache(query_id, requested_format)
-
-  # 1. Check Memcache
-  if response and response.get('api_query') and response.get('content'):
-    api_query = response.get('api_query')
-    response_content = response.get('content')
-    transformed_response_content = response.get('transformed_content')
-    response_status = 200
+  # A transform that depends on the request can't use the pre-rendered
+  # content so it has to start from the content in the default format.
+  # Only content rendered ahead of time, or with a view, is served
+  # compressed. A view with a transform that depends on the request is
+  # applied for every request. Other views, including pages of the response,
+  # are cached up to MAX_CACHED_VIEWS per API Query.
+  prerendered = transformers.IsPrerendered(transform)
+  cache_view = bool(view) and prerendered
+  if prerendered:
+    content_encoding = accepted_encoding
+    cached_format = compression_helper.GetVariantKey(
+        requested_format, content_encoding)
   else:
-    api_query = GetApiQuery(query_id)
-
-    # 2. Check if this is an abandoned query
-    if (api_query is not None and api_query.is_active
-        and not api_query.is_error_limit_reached
-        and api_query.is_abandoned):
-      RefreshApiQueryResponse(api_query)
-
-    # 3. Retrieve response from datastore
-    response = GetApiQueryResponseFromDb(api_query)
-    response_content = response.get('content')
-    response_status = response.get('status')
-
-    # Flag to schedule query later on if there is a successful response.
-    if api_query:
-      schedule_query = not api_query.in_queue
-
-  # 4. Return the formatted response.
-  if response_status == 200:
-    UpdateApiQueryCounter(query_id)
-    UpdateApiQueryTimestamp(query_id)
-
-    if co.ANONYMIZE_RESPONSES:
-      response_content = transformers.RemoveKeys(response_content)
-
-    if not transformed_response_content:
-      try:
-        transformed_response_content = transform.Transform(response_content)
-      except (KeyError, TypeError, AttributeError):
-        # If the transformation fails then return the original content.
-        transformed_response_content = response_content
-
-    memcache_keys = {
-        'api_query': api_query,
-        co.DEFAULT_FORMAT: response_content,
-        requested_format: transformed_response_content
-    }
+    content_encoding = None
+    cached_format = co.DEFAULT_FORMAT
+  if view:
+    prerendered = False
+    cached_format = co.DEFAULT_FORMAT
+  variant = GetViewVariantKey(requested_format, content_encoding, view)
+
+  # 1. Check if the client has the latest response
+  if if_none_match or if_modified_since:
+    generation = GetApiQueryResponseGeneration(query_id)
+    if conditional_helper.IsNotModified(
+        generation, variant, if_none_match, if_modified_since):
+      TrackApiQueryRequests([query_id])
+      return (None, 304, conditional_helper.GetValidatorHeaders(
+          generation, variant))
+
+  # A view that was already applied is served from the cache.
+  if cache_view:
+    cached_view = GetApiQueryViewFromCache(query_id, variant)
+    if cached_view:
+      TrackApiQueryRequests(
+          [query_id], {query_id: cached_view.get('refresh_interval')})
+      headers = conditional_helper.GetValidatorHeaders(
+          cached_view.get('generation'), variant)
+      if content_encoding:
+        headers['Content-Encoding'] = content_encoding
+      return (cached_view.get('content'), 200, headers)
+
+  # 2. Check the instance cache and then Memcache
+  rebuild_lease_name = co.REBUILD_LEASE_NAME_TEMPLATE.format(query_id,
+                                                             cached_format)
+  rebuild_lease = None
+  try:
+    response = GetApiQueryResponseFromCache(query_id, cached_format)
+    if not response:
+      response = GetApiQueryResponseFromMemcache(query_id, cached_format)
+      if not (response and response.get('api_query')
+              and response.get('content') is not None):
+        # Only one request at a time rebuilds the cached response. The others
+        # read the response from the datastore without caching it.
+        rebuild_lease = lease_helper.AcquireLease(rebuild_lease_name,
+                                                  co.REBUILD_LEASE_TIME)
+
+      if (response and response.get('api_query')
+          and response.get('content') is not None):
+        response_cache.Set(query_id, cached_format, response,
+                           response.get('generation'),
+                           response.get('api_query').refresh_interval)
+
+    if (response and response.get('api_query')
+        and response.get('content') is not None):
+      api_query = response.get('api_query')
+      if prerendered:
+        transformed_response_content = response.get('content')
+      else:
+        response_content = response.get('content')
+      response_status = 200
+      generation = response.get('generation')
+    else:
+      api_query = GetApiQuery(query_id)
+
+      # 3 & 4. Retrieve response from datastore and check if it's abandoned.
+      response = RevalidateApiQueryResponse(api_query, cached_format)
+      response_content = response.get('content')
+      transformed_response_content = response.get('rendered_content')
+      response_status = response.get('status')
+      generation = response.get('generation')
+      stale = response.get('stale')
+
+      # Flag to schedule query later on if there is a successful response.
+      # Stale responses aren't cached since the cache doesn't keep them
+      # marked as stale.
+      if api_query:
+        schedule_query = not api_query.in_queue
+        cache_response = bool(rebuild_lease) and not stale
+        cache_view = cache_view and not stale
+
+    # 5. Return the formatted response.
+    if response_status == 200:
+      TrackApiQueryRequests([query_id],
+                            {query_id: api_query.refresh_interval})
+
+      if conditional_helper.IsNotModified(
+          generation, variant, if_none_match, if_modified_since):
+        transformed_response_content = None
+        response_status = 304
+      elif transformed_response_content is None:
+        # Content in the default format is cached as a JSON string. It is
+        # decoded once and kept with the cached response, like its typed
+        # columns, so views and transforms don't decode it on every request.
+        decoded_content = response.get('decoded_content')
+        if decoded_content is None:
+          if isinstance(response_content, basestring):
+            response_content = json.loads(response_content)
+          if co.ANONYMIZE_RESPONSES:
+            response_content = transformers.RemoveKeys(response_content)
+          response['decoded_content'] = response_content
+        else:
+          response_content = decoded_content
+
+        view_content = response_content
+        try:
+          report = None
+          if view or transformers.UsesColumnarReport(transform):
+            # The typed columns are kept with the cached response so they are
+            # only built once per refresh on each instance.
+            report = response.get('report')
+            if report is None:
+              report = columnar.ColumnarReport.FromContent(response_content)
+              response['report'] = report
+          if view:
+            (view_content, report) = view.Apply(response_content, report)
+
+          if IsStreamedResponse(transform, view_content):
+            # Streamed content is written as it is transformed so it can't be
+            # compressed or cached.
+            transformed_response_content = transform.Stream(view_content)
+            content_encoding = None
+            variant = GetViewVariantKey(requested_format, None, view)
+            cache_response = False
+            cache_view = False
+          else:
+            if transformers.UsesColumnarReport(transform):
+              transformed_response_content = transform.TransformReport(report)
+            else:
+              transformed_response_content = transform.Transform(view_content)
+            if content_encoding:
+              transformed_response_content = compression_helper.Compress(
+                  transformed_response_content, content_encoding)
+        except report_view.ViewError, e:
+          view_error = GetViewError(e)
+          cache_view = False
+        except (KeyError, TypeError, AttributeError, ValueError), e:
+          if view:
+            # The whole content is never returned for a view that failed.
+            logging.warning('Unable to apply view to query %s: %s', query_id, e)
+            view_error = GetViewError(e)
+            cache_view = False
+          else:
+            # If the transformation fails then return the original content.
+            transformed_response_content = response_content
+            content_encoding = None
+            variant = requested_format
+            cache_response = False
+
+        if cache_view:
+          SetApiQueryViewInCache(query_id, variant,
+                                 transformed_response_content, generation,
+                                 api_query.refresh_interval)
+
+      if cache_response and response_status == 200:
+        if prerendered:
+          cached_content = transformed_response_content
+        else:
+          cached_content = json.dumps(response_content)
+
+        api_query_record = cache_record.ApiQueryRecord.FromApiQuery(api_query)
+        memcache_keys = {
+            'api_query': api_query_record.ToString(),
+            'generation': generation,
+            cached_format: cached_content
+        }
+        memcache.add_multi(chunk_store.SplitMemcacheValues(memcache_keys),
+                           key_prefix=query_id,
+                           time=api_query.refresh_interval)
 
-    memcache.add_multi(memcache_keys,
-                       key_prefix=query_id,
-                       time=api_query.refresh_interval)
+        response_cache.Set(query_id, cached_format, {
+            'api_query': api_query_record,
+            'generation': generation,
+            'content': cached_content,
+            'decoded_content': response.get('decoded_content'),
+            'report': response.get('report')
+        }, generation, api_query.refresh_interval)
 
-    # Attempt to schedule query if required.
-    if schedule_query:
-      schedule_helper.ScheduleApiQuery(api_query)
+      # Attempt to schedule query if required.
+      if schedule_query:
+        schedule_helper.ScheduleApiQuery(api_query)
 
-    response_content = transformed_response_content
-  else:
-    raise errors.GaSuperProxyHttpError(response_content, response_status)
+      response_content = transformed_response_content
+      headers = conditional_helper.GetValidatorHeaders(generation, variant)
+      if content_encoding and response_status == 200:
+        headers['Content-Encoding'] = content_encoding
+      if stale:
+        headers['Warning'] = co.STALE_RESPONSE_WARNING
+    else:
+      raise errors.GaSuperProxyHttpError(response_content, response_status)
+
+    if view_error:
+      raise errors.GaSuperProxyHttpError(view_error, 400)
+
+    return (response_content, response_status, headers)
+  finally:
+    lease_helper.ReleaseLease(rebuild_lease_name, rebuild_lease)
+
+
+def GetRequestTimestampGranularity(refresh_interval=None):
+  """Returns the minimum number of seconds between writes of a request time.
+
+  A query is abandoned after ABANDONED_INTERVAL_MULTIPLE refresh intervals
+  without a request, so the stored request time can't lag behind by more than
+  half a refresh interval.
+
+  Args:
+    refresh_interval: The refresh interval of the API Query or None if it
+                      isn't known, in which case the minimum interval is used.
+
+  Returns:
+    The granularity, in seconds, of the request time of the API Query.
+  """
+  if not refresh_interval:
+    refresh_interval = co.MIN_INTERVAL
+  return min(co.REQUEST_TIMESTAMP_GRANULARITY, refresh_interval // 2)
+
+
+def GetReportView(sort=None, columns=None, filters=None, start=None,
+                  limit=None):
+  """Returns the view requested for a public response.
+
+  Args:
+    sort: The sort parameter of the request, if any.
+    columns: The columns parameter of the request, if any.
+    filters: The filter parameter of the request, if any.
+    start: The start parameter of the request, if any.
+    limit: The limit parameter of the request, if any.
+
+  Returns:
+    A ReportView or None if the whole response was requested.
+
+  Raises:
+    GaSuperProxyHttpError: A view parameter is invalid.
+  """
+  try:
+    return report_view.ReportView.FromRequest(
+        sort=sort, columns=columns, filters=filters, start=start, limit=limit)
+  except report_view.ViewError, e:
+    raise errors.GaSuperProxyHttpError(GetViewError(e), 400)
+
+
+def GetViewError(error):
+  """Returns the error content for a view that can't be applied.
+
+  Args:
+    error: The exception raised while parsing or applying the view.
+
+  Returns:
+    A dict with the error, HTTP status code and message of the response.
+  """
+  return {
+      'error': co.ERROR_INVALID_VIEW,
+      'code': 400,
+      'message': '%s %s' % (co.ERROR_MESSAGES[co.ERROR_INVALID_VIEW], error)
+  }
+
+
+def GetViewVariantKey(requested_format, content_encoding=None, view=None):
+  """Returns the key of a response variant, including its view.
+
+  Args:
+    requested_format: The format of the response.
+    content_encoding: The content encoding of the response or None if
+                      uncompressed.
+    view: The ReportView applied to the response or None.
 
-  return (response_content, response_status)
+  Returns:
+    A string. e.g. 'csv.gzip' or 'csv.gzip.view-0123456789abcdef...'.
+  """
+  variant = compression_helper.GetVariantKey(requested_format,
+                                             content_encoding)
+  if view:
+    variant = view.GetVariantKey(variant)
+  return variant
 
 
 def InsertApiQueryError(api_query, error):
   """Stores an API Error Response entity for an API Query.
 
+  The error count of the API Query is updated in the same transaction. The
+  count is its own entity so the API Query itself isn't written.
+
   Args:
     api_query: The API Query for which the error occurred.
     error: The error that occurred.
   """
   if co.LOG_ERRORS:
-    error = db_models.ApiErrorResponse(
-        api_query=api_query,
-        content=error,
-        timestamp=datetime.utcnow())
-    error.put()
+    timestamp = datetime.utcnow()
+    # API Queries saved before errors were counted start from their errors.
+    initial_count = models_helper.GetApiQueryErrorCount(api_query)
+
+    def InsertError():
+      error_count = db.get(api_query.error_count_key)
+      if error_count is None:
+        error_count = db_models.ApiQueryErrorCount(
+            key_name=db_models.ApiQueryErrorCount.KEY_NAME,
+            parent=api_query, count=initial_count)
+      error_count.count += 1
+      error_count.last_error = timestamp
+      error_response = db_models.ApiErrorResponse(
+          api_query=api_query,
+          content=error,
+          timestamp=timestamp)
+      db.put([error_count, error_response])
+
+    db.run_in_transaction_options(
+        db.create_transaction_options(xg=True), InsertError)
+
+
+def IsStreamedResponse(transform, content):
+  """Checks if a response should be streamed instead of rendered in memory.
+
+  Args:
+    transform: The transform for the format of the response.
+    content: A dict representing the API response.
+
+  Returns:
+    True if the transform supports streaming and the response has at least
+    STREAM_MIN_ROWS rows, False otherwise.
+  """
+  return (hasattr(transform, 'Stream') and isinstance(content, dict)
+          and len(content.get('rows') or []) >= co.STREAM_MIN_ROWS)
 
 
 def ListApiQueries(user=None, limit=1000):
@@ -487,22 +1197,187 @@ def ListApiQueries(user=None, limit=1000):
   return None
 
 
+def MigrateApiQueryResponses(cursor=None,
+                             batch_size=co.MIGRATION_BATCH_SIZE):
+  """Moves API Query Responses saved without a parent under their API Query.
+
+  Each response is moved in a transaction. A response that was saved under
+  the API Query in the meantime is kept if it is newer. Responses of API
+  Queries that were deleted are deleted instead of moved.
+
+  Args:
+    cursor: The cursor returned by the previous batch, None to start.
+    batch_size: The number of responses to check.
+
+  Returns:
+    A tuple of the number of responses moved and the cursor for the next
+    batch, which is None when every response was checked.
+  """
+  db_query = db_models.ApiQueryResponse.all()
+  if cursor:
+    db_query.with_cursor(cursor)
+  responses = db_query.fetch(batch_size)
+  legacy_responses = [response for response in responses
+                      if response.key().parent() is None]
+  api_query_property = db_models.ApiQueryResponse.api_query
+
+  def MoveResponse(legacy_response):
+    api_query_key = api_query_property.get_value_for_datastore(
+        legacy_response)
+    response_key = db.Key.from_path(
+        db_models.ApiQueryResponse.kind(), db_models.ApiQueryResponse.KEY_NAME,
+        parent=api_query_key)
+    (api_query, response) = db.get([api_query_key, response_key])
+    if not api_query:
+      legacy_response.delete()
+      return
+
+    if not response or response.modified < legacy_response.modified:
+      db_models.ApiQueryResponse(
+          key_name=db_models.ApiQueryResponse.KEY_NAME,
+          parent=api_query_key,
+          api_query=api_query_key,
+          content=legacy_response.content,
+          modified=legacy_response.modified,
+          content_hash=legacy_response.content_hash).put()
+    legacy_response.delete()
+
+  options = db.create_transaction_options(xg=True)
+  for legacy_response in legacy_responses:
+    db.run_in_transaction_options(options, MoveResponse, legacy_response)
+
+  next_cursor = None
+  if len(responses) == batch_size:
+    next_cursor = db_query.cursor()
+  return (len(legacy_responses), next_cursor)
+
+
 def RefreshApiQueryResponse(api_query):
   """Executes the API request and refreshes the response for an API Query.
 
+  If the response is already being refreshed by another request or task then
+  this returns right away instead of making the same API request or waiting
+  for the other refresh to finish.
+
   Args:
     api_query: The API Query to refresh the respone for.
+
+  Returns:
+    A boolean. True if the response was refreshed, or the refresh failed, and
+    False if the response is being refreshed by someone else.
   """
   if api_query:
-    api_response = FetchApiQueryResponse(api_query)
-    if not api_response or api_response.get('error'):
-      InsertApiQueryError(api_query, api_response)
+    query_id = str(api_query.key())
+    lease_name = co.REFRESH_LEASE_NAME_TEMPLATE.format(query_id)
+    lease = lease_helper.AcquireLease(lease_name, co.REFRESH_LEASE_TIME)
+    if not lease:
+      return False
+
+    try:
+      api_response = FetchApiQueryResponse(api_query)
+      if not api_response or api_response.get('error'):
+        InsertApiQueryError(api_query, api_response)
+      else:
+        SaveApiQueryResponse(api_query, api_response)
+
+        # Clear memcache since this query response has changed.
+        DeleteApiQueryFromCache(query_id)
+    finally:
+      lease_helper.ReleaseLease(lease_name, lease)
+    return True
+  return False
+
+
+def RevalidateApiQueryResponse(api_query, requested_format=co.DEFAULT_FORMAT):
+  """Returns the stored response of an API Query, refreshing it if abandoned.
+
+  Abandoned API Queries are no longer refreshed on schedule so their stored
+  response may be out of date. API Queries that aren't scheduled keep their
+  stored response. If the stored response is younger than
+  MAX_STALE_RESPONSE_AGE it is returned right away, marked as stale, and a
+  refresh is added to the task queue. Otherwise the response is refreshed
+  before it is returned.
+
+  Args:
+    api_query: The API Query for which the response is being requested.
+    requested_format: The variant key of the format type requested for the
+                      response.
+
+  Returns:
+    A dict with the same values as GetApiQueryResponseFromDb and a stale value
+    that is True if the response is being refreshed in the background.
+  """
+  response = GetApiQueryResponseFromDb(api_query, requested_format)
+  response['stale'] = False
+
+  if (api_query is not None and api_query.is_active
+      and api_query.is_scheduled and not api_query.is_error_limit_reached
+      and api_query.is_abandoned):
+    generation = response.get('generation')
+    if (response.get('status') == 200 and generation
+        and generation.get('modified') and
+        (datetime.utcnow() - generation.get('modified')).total_seconds() <=
+        co.MAX_STALE_RESPONSE_AGE):
+      schedule_helper.ScheduleAbandonedApiQuery(api_query)
+      response['stale'] = True
+    elif RefreshApiQueryResponse(api_query):
+      response = GetApiQueryResponseFromDb(api_query, requested_format)
+      response['stale'] = False
     else:
-      SaveApiQueryResponse(api_query, api_response)
+      # Another request is refreshing the response so the stored response, if
+      # any, is served as it is.
+      response['stale'] = response.get('status') == 200
+
+  return response
+
+
+def RenderApiQueryResponse(content):
+  """Renders an API Query response in every supported format.
+
+  This runs once each time a response is refreshed so that public requests
+  don't have to transform the response. The typed columns of the response are
+  built once and shared by the transforms that render from them.
 
-      # Clear memcache since this query response has changed.
-      memcache.delete_multi(['api_query'] + co.SUPPORTED_FORMATS.keys(),
-                            key_prefix=str(api_query.key()))
+  Args:
+    content: A dict representing the API response to render.
+
+  Returns:
+    A dict that maps the variant key of each supported format and content
+    encoding to the rendered response content. e.g. {'csv': CSV_CONTENT,
+    'csv.gzip': GZIP_CSV_CONTENT}. Formats that failed to render are not
+    included.
+  """
+  if co.ANONYMIZE_RESPONSES:
+    content = transformers.RemoveKeys(copy.deepcopy(content))
+
+  report = None
+  rendered_content = {}
+  for response_format in co.SUPPORTED_FORMATS:
+    transform = transformers.GetTransform(response_format)
+    if IsStreamedResponse(transform, content):
+      # Large responses are streamed from the content at request time.
+      continue
+
+    try:
+      if transformers.UsesColumnarReport(transform):
+        if report is None:
+          report = columnar.ColumnarReport.FromContent(content)
+        rendered = transform.TransformReport(report)
+      else:
+        rendered = transform.Transform(content)
+    except (KeyError, TypeError, AttributeError, ValueError), e:
+      logging.warning('Unable to render response as %s: %s',
+                      response_format, e)
+      continue
+
+    if rendered is not None:
+      rendered_content[response_format] = rendered
+      for encoding in co.COMPRESSED_ENCODINGS:
+        variant_key = compression_helper.GetVariantKey(response_format,
+                                                       encoding)
+        rendered_content[variant_key] = compression_helper.Compress(
+            rendered, encoding)
+  return rendered_content
 
 
 def SaveApiQuery(api_query, **kwargs):
@@ -535,21 +1410,68 @@ def SaveApiQuery(api_query, **kwargs):
 def SaveApiQueryResponse(api_query, content):
   """Updates or creates a new API Query Response for an API Query.
 
+  The response is also rendered in every supported format and saved alongside
+  the API Query Response. Content too large for one entity is saved in chunks
+  and rendered responses too large for one entity aren't saved.
+
   Args:
     api_query: The API Query for which the response will be added to
     content: The content of the API respone to add to the API Query.
+
+  Returns:
+    A tuple containing the saved API Query Response and a dict that maps the
+    variant key of each format and content encoding to the rendered response
+    content.
   """
-  db_response = api_query.api_query_responses.get()
   modified = datetime.utcnow()
-
-  if db_response:
-    db_response.content = content
-    db_response.modified = modified
+  serialized_content = json.dumps(content, sort_keys=True)
+  content_hash = hashlib.md5(serialized_content).hexdigest()
+  previous_response = db.get(api_query.response_key)
+
+  # The response has a fixed key so it replaces any previous response.
+  db_response = db_models.ApiQueryResponse(
+      key_name=db_models.ApiQueryResponse.KEY_NAME,
+      parent=api_query,
+      api_query=api_query,
+      modified=modified,
+      content_hash=content_hash)
+  entities = [db_response]
+
+  # Compression never makes content larger than its JSON by much, so only
+  # large JSON needs to be compressed to check its stored size.
+  stored_content = None
+  if len(serialized_content) > co.MAX_CHUNK_SIZE:
+    stored_content = db_models.CompressedJsonQueryProperty.Dumps(content)
+  if stored_content and len(stored_content) > co.MAX_CHUNK_SIZE:
+    chunks = chunk_store.SplitContent(stored_content)
+    db_response.chunk_count = len(chunks)
+    for chunk_key, chunk in zip(db_response.ChunkKeys(), chunks):
+      entities.append(db_models.ApiQueryResponseChunk(
+          key=chunk_key, content=db.Blob(chunk)))
   else:
-    db_response = db_models.ApiQueryResponse(api_query=api_query,
-                                             content=content,
-                                             modified=modified)
-  db_response.put()
+    db_response.content = content
+
+  rendered_content = RenderApiQueryResponse(content)
+
+  # The default format is the API Query Response content itself.
+  for variant_key, rendered in rendered_content.items():
+    if (variant_key != co.DEFAULT_FORMAT and
+        len(rendered) <= co.MAX_CHUNK_SIZE):
+      entities.append(db_models.ApiQueryRenderedResponse(
+          parent=api_query,
+          key_name=variant_key,
+          content=db.Blob(rendered),
+          modified=modified))
+  db.put(entities)
+
+  # Delete the chunks of the previous response once they are replaced.
+  if previous_response:
+    stale_keys = set(previous_response.ChunkKeys()) - set(
+        db_response.ChunkKeys())
+    if stale_keys:
+      db.delete(list(stale_keys))
+
+  return (db_response, rendered_content)
 
 
 def ScheduleAndSaveApiQuery(api_query, **kwargs):
@@ -574,6 +1496,47 @@ def ScheduleAndSaveApiQuery(api_query, **kwargs):
   return None
 
 
+def SetApiQueryViewInCache(query_id, view_variant, content, generation,
+                           refresh_interval):
+  """Caches a response with a view in memcache and the instance cache.
+
+  At most MAX_CACHED_VIEWS views of an API Query are cached until it is
+  refreshed or its refresh interval passes, so requests with arbitrary view
+  parameters can't fill the caches.
+
+  Args:
+    query_id: The query id of the API Query.
+    view_variant: The variant key of the format, content encoding and view.
+    content: The response content with the view applied.
+    generation: The generation of the API Query response the view was applied
+                to.
+    refresh_interval: The number of seconds to cache the response for.
+
+  Returns:
+    True if the response was cached and False if the API Query already has
+    the maximum number of cached views.
+  """
+  view_count_key = '%sview-count' % query_id
+  memcache.add(view_count_key, 0, time=refresh_interval)
+  view_count = memcache.incr(view_count_key)
+  if view_count is None or view_count > co.MAX_CACHED_VIEWS:
+    return False
+
+  memcache.set_multi(chunk_store.SplitMemcacheValues({
+      view_variant: content,
+      '%s.metadata' % view_variant: {
+          'generation': generation,
+          'refresh_interval': refresh_interval
+      }
+  }), key_prefix=query_id, time=refresh_interval)
+  response_cache.Set(query_id, view_variant, {
+      'generation': generation,
+      'content': content,
+      'refresh_interval': refresh_interval
+  }, generation, refresh_interval)
+  return True
+
+
 def SetPublicEndpointStatus(api_query, status=None):
   """Change the public endpoint status of an API Query.
 
@@ -596,24 +1559,98 @@ def SetPublicEndpointStatus(api_query, status=None):
 
     try:
       api_query.put()
-      memcache.delete_multi(['api_query'] + co.SUPPORTED_FORMATS.keys(),
-                            key_prefix=str(api_query.key()))
+      DeleteApiQueryFromCache(str(api_query.key()))
       return True
     except db.TransactionFailedError:
       return False
   return False
 
 
+def TrackApiQueryRequests(query_ids, refresh_intervals=None):
+  """Starts updating the request counters and timestamps of API Queries.
+
+  The counter and timestamp updates are started together so their RPCs run
+  at the same time, and while the response is rendered. They are not waited
+  for here: BaseHandler.dispatch finishes them after the response is
+  written.
+
+  Args:
+    query_ids: A list of the ids of the API Queries that were requested.
+    refresh_intervals: A dict of the query ids to the refresh intervals of
+                       the API Queries, if they are known.
+
+  Returns:
+    A list of the ndb.Futures of the updates.
+  """
+  return [UpdateApiQueryCountersAsync(query_ids),
+          UpdateApiQueryTimestampsAsync(query_ids, refresh_intervals)]
+
+
 def UpdateApiQueryCounter(query_id):
   """Increment the request counter for the API Query."""
-  request_counter_key = co.REQUEST_COUNTER_KEY_TEMPLATE.format(query_id)
-  request_counter_shard.Increment(request_counter_key)
+  UpdateApiQueryCounters([query_id])
+
+
+def UpdateApiQueryCounters(query_ids):
+  """Increment the request counters for several API Queries at once."""
+  UpdateApiQueryCountersAsync(query_ids).get_result()
+
+
+def UpdateApiQueryCountersAsync(query_ids):
+  """Starts incrementing the request counters for several API Queries.
+
+  The increments are buffered in memcache if BUFFER_REQUEST_COUNTS is set.
+
+  Args:
+    query_ids: A list of the ids of the API Queries.
+
+  Returns:
+    An ndb.Future that is done when the counters are incremented.
+  """
+  request_counter_keys = [co.REQUEST_COUNTER_KEY_TEMPLATE.format(query_id)
+                          for query_id in query_ids]
+  if co.BUFFER_REQUEST_COUNTS:
+    return request_counter_shard.BufferIncrementMultiAsync(
+        request_counter_keys)
+  return request_counter_shard.IncrementMultiAsync(request_counter_keys)
 
 
 def UpdateApiQueryTimestamp(query_id):
   """Update the last request timestamp for an API Query."""
-  request_timestamp_key = co.REQUEST_TIMESTAMP_KEY_TEMPLATE.format(query_id)
-  request_timestamp_shard.Refresh(request_timestamp_key)
+  UpdateApiQueryTimestamps([query_id])
+
+
+def UpdateApiQueryTimestamps(query_ids):
+  """Update the last request timestamps for several API Queries at once."""
+  UpdateApiQueryTimestampsAsync(query_ids).get_result()
+
+
+@ndb.tasklet
+def UpdateApiQueryTimestampsAsync(query_ids, refresh_intervals=None):
+  """Starts updating the last request timestamps for several API Queries.
+
+  The timestamps are written to the datastore at most once every
+  GetRequestTimestampGranularity seconds for each API Query.
+
+  Args:
+    query_ids: A list of the ids of the API Queries.
+    refresh_intervals: A dict of the query ids to the refresh intervals of
+                       the API Queries, if they are known.
+
+  Returns:
+    An ndb.Future that is done when the timestamps are updated.
+  """
+  refresh_intervals = refresh_intervals or {}
+  names_by_granularity = {}
+  for query_id in query_ids:
+    granularity = GetRequestTimestampGranularity(
+        refresh_intervals.get(query_id))
+    names_by_granularity.setdefault(granularity, []).append(
+        co.REQUEST_TIMESTAMP_KEY_TEMPLATE.format(query_id))
+
+  yield [request_timestamp_shard.RefreshMultiAsync(names,
+                                                   granularity=granularity)
+         for granularity, names in names_by_granularity.items()]
 
 
 def ValidateApiQuery(request_input):
@@ -18,23 +18,58 @@
 
   Sharding is used to keep track of the number of requests for an API Query.
 
+  Increments can also be buffered in memcache and periodically flushed to the
+  shards in batches, which takes the datastore write out of each request.
+  Buffered increments that haven't been flushed are included in the count but
+  are lost if they are evicted from memcache before the next flush. The names
+  of the counters with buffered increments are kept in a set in memcache so a
+  flush only reads the buffers of those counters.
+
+  The flush also maintains the total of each counter in a single entity so the
+  count can be read without reading every shard. The shards are only read to
+  repair a missing total, or when the counter is also incremented directly.
+
+  Counters start with one shard. ScaleShards adds shards to counters whose
+  writes collide and merges the shards of counters that are mostly idle.
+
   Based on code from:
   https://developers.google.com/appengine/articles/sharding_counters
 """
 
 __author__ = 'pete.frisella@gmail.com (Pete Frisella)'
 
+from datetime import datetime
+import logging
 import random
 
+from controllers.util import shard_helper
+
 from google.appengine.api import memcache
 from google.appengine.ext import ndb
 
 SHARD_KEY_TEMPLATE = 'shard-{}-{:d}'
 
+# Memcache key of the increments buffered for a counter.
+BUFFER_KEY_TEMPLATE = 'buffer-{}'
+
+# Memcache key of the set of names of counters with buffered increments, and
+# of the marker that a counter is in the set.
+DIRTY_SET_KEY = 'dirty-counters'
+DIRTY_KEY_TEMPLATE = 'dirty-{}'
+
+# The ID of the entity that tracks flushes of buffered increments.
+FLUSH_STATUS_ID = 'flush-status'
+
 
 class GeneralCounterShardConfig(ndb.Model):
-  """Tracks the number of shards for each named counter."""
-  num_shards = ndb.IntegerProperty(default=20)
+  """Tracks the number of shards for each named counter.
+
+  has_total is set while the GeneralCounterTotal of the counter is kept up to
+  date by FlushIncrements. It is cleared when the counter is incremented
+  directly since direct increments don't update the total.
+  """
+  num_shards = ndb.IntegerProperty(default=shard_helper.MIN_SHARDS)
+  has_total = ndb.BooleanProperty(default=False)
 
   @classmethod
   def AllKeys(cls, name):
@@ -59,25 +94,230 @@ class GeneralCounterShard(ndb.Model):
   count = ndb.IntegerProperty(default=0)
 
 
-def GetCount(name):
+class GeneralCounterTotal(ndb.Model):
+  """The total count of all the shards of a named counter."""
+  count = ndb.IntegerProperty(default=0)
+
+
+class GeneralCounterFlushStatus(ndb.Model):
+  """Tracks the last flush of buffered increments to the shards."""
+  last_flush = ndb.DateTimeProperty()
+  flushed_counters = ndb.IntegerProperty(default=0)
+  flushed_increments = ndb.IntegerProperty(default=0)
+
+
+def BufferIncrementMulti(names):
+  """Buffer increments for several sharded counters in memcache.
+
+  The increments are added to the shards by the next FlushIncrements.
+
+  Args:
+    names: A list of counter names.
+  """
+  BufferIncrementMultiAsync(names).get_result()
+
+
+@ndb.tasklet
+def BufferIncrementMultiAsync(names):
+  """Asynchronously buffer increments for several sharded counters.
+
+  The counters are marked as dirty so the next FlushIncrements flushes them.
+
+  Args:
+    names: A list of counter names.
+
+  Returns:
+    An ndb.Future that is done when the increments are buffered.
+  """
+  context = ndb.get_context()
+  increments = [context.memcache_incr(BUFFER_KEY_TEMPLATE.format(name),
+                                      initial_value=0)
+                for name in names]
+  yield increments + [
+      shard_helper.MarkDirtyAsync(DIRTY_SET_KEY, DIRTY_KEY_TEMPLATE, names)]
+
+
+def FlushIncrements(names=None, batch_size=100):
+  """Adds the buffered increments of sharded counters to their shards.
+
+  The increments are taken out of the buffer before they are written so
+  increments buffered in the meantime are left for the next flush. Increments
+  that aren't written, whatever the error, are put back in the buffer and
+  their counters are marked as dirty again. The total of each counter is
+  updated in the same transaction as its shard, or repaired from the shards
+  if the counter doesn't have a total yet.
+
+  Args:
+    names: A list of the names of counters that may have buffered increments,
+           or None to flush the counters that are marked as dirty.
+    batch_size: The number of counters to flush at a time.
+
+  Returns:
+    The flush status entity.
+  """
+  if names is None:
+    names = shard_helper.TakeDirtyNames(DIRTY_SET_KEY, DIRTY_KEY_TEMPLATE)
+
+  flushed_counters = 0
+  flushed_increments = 0
+  done = 0
+  try:
+    for start in range(0, len(names), batch_size):
+      flushed = _FlushBatch(names[start:start + batch_size])
+      flushed_counters += len(flushed)
+      flushed_increments += sum(flushed.values())
+      done = start + batch_size
+  finally:
+    if done < len(names):
+      # The counters that weren't flushed because of an error are flushed
+      # again next time.
+      shard_helper.AddDirtyNamesAsync(
+          DIRTY_SET_KEY, DIRTY_KEY_TEMPLATE, names[done:]).get_result()
+
+  status = GeneralCounterFlushStatus(id=FLUSH_STATUS_ID,
+                                     last_flush=datetime.utcnow(),
+                                     flushed_counters=flushed_counters,
+                                     flushed_increments=flushed_increments)
+  status.put()
+  return status
+
+
+def _FlushBatch(names):
+  """Adds the buffered increments of a batch of counters to their shards.
+
+  Args:
+    names: A list of counter names.
+
+  Returns:
+    A dict of the name of each counter that was flushed to its increments.
+  """
+  buffered = memcache.get_multi(
+      [BUFFER_KEY_TEMPLATE.format(name) for name in names])
+
+  deltas = {}
+  for name in names:
+    delta = int(buffered.get(BUFFER_KEY_TEMPLATE.format(name)) or 0)
+    if delta > 0:
+      deltas[name] = delta
+  if not deltas:
+    return {}
+
+  memcache.offset_multi(dict(
+      (BUFFER_KEY_TEMPLATE.format(name), -delta)
+      for name, delta in deltas.items()))
+
+  # The increments are out of the buffer so they are put back unless they are
+  # known to be written, even if an unexpected error ends the flush.
+  flushed = {}
+  increment_futures = {}
+  try:
+    for name, delta in deltas.items():
+      increment_futures[name] = _FlushAsync(name, delta)
+
+    for name, future in increment_futures.items():
+      try:
+        future.get_result()
+      except Exception, e:
+        logging.warning('Unable to flush counter %s: %s', name, e)
+      else:
+        flushed[name] = deltas[name]
+  finally:
+    for name, future in increment_futures.items():
+      if (name not in flushed and future.done()
+          and future.get_exception() is None):
+        flushed[name] = deltas[name]
+    failed = dict((name, delta) for name, delta in deltas.items()
+                  if name not in flushed)
+    if failed:
+      memcache.offset_multi(dict(
+          (BUFFER_KEY_TEMPLATE.format(name), delta)
+          for name, delta in failed.items()), initial_value=0)
+      shard_helper.AddDirtyNamesAsync(
+          DIRTY_SET_KEY, DIRTY_KEY_TEMPLATE, failed.keys()).get_result()
+
+  # Memcache offset does nothing if the name is not a key in memcache
+  if flushed:
+    memcache.offset_multi(flushed)
+  return flushed
+
+
+@ndb.tasklet
+def _FlushAsync(name, delta):
+  """Adds buffered increments to a shard and the total of a counter.
+
+  Args:
+    name: The name of the counter.
+    delta: The number of buffered increments.
+  """
+  yield GeneralCounterShardConfig.get_or_insert_async(name)
+  has_total = yield _IncrementAsync(name, delta, buffered=True)
+  if not has_total:
+    yield _RepairTotalAsync(name)
+
+
+def GetCount(name, repair=False):
   """Retrieve the value for a given sharded counter.
 
   Args:
     name: The name of the counter.
+    repair: Whether to save the total of the shards when the counter doesn't
+            have an up to date total. Only set this for counters that are
+            incremented with buffered increments.
 
   Returns:
     Integer; the cumulative count of all sharded counters for the given
-    counter name.
+    counter name, including increments that are buffered.
   """
-  total = memcache.get(name)
+  buffer_key = BUFFER_KEY_TEMPLATE.format(name)
+  cached = memcache.get_multi([name, buffer_key])
+  total = cached.get(name)
   if total is None:
-    total = 0
-    all_keys = GeneralCounterShardConfig.AllKeys(name)
-    for counter in ndb.get_multi(all_keys):
-      if counter is not None:
-        total += counter.count
+    (config, counter_total) = ndb.get_multi(
+        [ndb.Key(GeneralCounterShardConfig, name),
+         ndb.Key(GeneralCounterTotal, name)])
+    if config and config.has_total and counter_total:
+      total = counter_total.count
+    elif repair:
+      total = _RepairTotalAsync(name).get_result()
+    else:
+      total = _SumShards(GeneralCounterShardConfig.AllKeys(name))
     memcache.add(name, total, 60)
-  return total
+  return total + int(cached.get(buffer_key) or 0)
+
+
+def GetShardTotals(names, repair=False):
+  """Retrieve the totals of the shards of several counters at once.
+
+  This reads the counts of counters that don't have an up to date total. The
+  shards of all the counters are read in one datastore call, or repaired in
+  parallel.
+
+  Args:
+    names: A list of counter names.
+    repair: Whether to save the total of the shards of each counter as its
+            maintained total. Only set this for counters that are incremented
+            with buffered increments.
+
+  Returns:
+    A dict of each counter name to the total of its shards, not including
+    increments that are buffered.
+  """
+  if repair:
+    repair_futures = [(name, _RepairTotalAsync(name)) for name in names]
+    return dict((name, future.get_result()) for name, future in repair_futures)
+
+  configs = ndb.get_multi([ndb.Key(GeneralCounterShardConfig, name)
+                           for name in names])
+  shard_keys = [_ShardKeys(name, config.num_shards) if config else []
+                for name, config in zip(names, configs)]
+  shards = iter(ndb.get_multi([key for keys in shard_keys for key in keys]))
+  return dict((name, _SumShards([next(shards) for _ in keys]))
+              for name, keys in zip(names, shard_keys))
+
+
+def GetFlushStatus():
+  """Returns the flush status entity or None if there hasn't been a flush."""
+  return GeneralCounterFlushStatus.get_by_id(FLUSH_STATUS_ID)
 
 
 def Increment(name):
@@ -86,29 +326,226 @@ def Increment(name):
   Args:
     name: The name of the counter.
   """
-  config = GeneralCounterShardConfig.get_or_insert(name)
-  _Increment(name, config.num_shards)
+  IncrementMulti([name])
 
 
-@ndb.transactional
-def _Increment(name, num_shards):
-  """Transactional helper to increment the value for a given sharded counter.
+def IncrementMulti(names):
+  """Increment the values for several sharded counters.
 
-  Also takes a number of shards to determine which shard will be used.
+  Args:
+    names: A list of counter names.
+  """
+  IncrementMultiAsync(names).get_result()
+
+
+@ndb.tasklet
+def IncrementMultiAsync(names):
+  """Asynchronously increment the values for several sharded counters.
+
+  The shard transactions for all the counters run in parallel.
+
+  Args:
+    names: A list of counter names.
+
+  Returns:
+    An ndb.Future that is done when all the counters are incremented.
+  """
+  yield [GeneralCounterShardConfig.get_or_insert_async(name)
+         for name in names]
+  yield [_IncrementAsync(name) for name in names]
+  # Memcache incr does nothing if the name is not a key in memcache
+  context = ndb.get_context()
+  yield [context.memcache_incr(name) for name in names]
+
+
+def _IncrementAsync(name, delta=1, buffered=False):
+  """Helper to increment the value for a given sharded counter.
+
+  The config of the counter must exist. A random shard is incremented in a
+  transaction, which is attempted again on another shard after a collision.
 
   Args:
     name: The name of the counter.
-    num_shards: How many shards to use.
+    delta: The amount to increment the counter by.
+    buffered: Whether the increments are buffered increments being flushed,
+              which also increment the total of the counter. Direct
+              increments mark the total as out of date.
+
+  Returns:
+    An ndb.Future with whether the counter has an up to date total.
+  """
+  return shard_helper.RunTransactionAsync(
+      name, lambda: _IncrementShardAsync(name, delta, buffered))
+
+
+@ndb.tasklet
+def _IncrementShardAsync(name, delta, buffered):
+  """Increments a random shard of a counter within a transaction.
+
+  The config is read in the transaction so that the shard is one that exists
+  after a concurrent change to the number of shards.
+
+  Args:
+    name: The name of the counter.
+    delta: The amount to increment the counter by.
+    buffered: Whether to also increment the total of the counter.
+
+  Returns:
+    An ndb.Future with whether the counter has an up to date total.
   """
-  index = random.randint(0, num_shards - 1)
+  config = yield GeneralCounterShardConfig.get_by_id_async(name)
+  index = random.randint(0, config.num_shards - 1)
   shard_key_string = SHARD_KEY_TEMPLATE.format(name, index)
-  counter = GeneralCounterShard.get_by_id(shard_key_string)
+  counter = yield GeneralCounterShard.get_by_id_async(shard_key_string)
   if counter is None:
     counter = GeneralCounterShard(id=shard_key_string)
-  counter.count += 1
-  counter.put()
-  # Memcache increment does nothing if the name is not a key in memcache
-  memcache.incr(name)
+  counter.count += delta
+  entities = [counter]
+
+  if config.has_total:
+    counter_total = None
+    if buffered:
+      counter_total = yield GeneralCounterTotal.get_by_id_async(name)
+    if counter_total is not None:
+      counter_total.count += delta
+      entities.append(counter_total)
+    else:
+      config.has_total = False
+      entities.append(config)
+  yield ndb.put_multi_async(entities)
+  raise ndb.Return(config.has_total)
+
+
+@ndb.tasklet
+def _RepairTotalAsync(name):
+  """Saves the total of the shards of a counter as its maintained total.
+
+  The shards are read and the total is saved in one transaction so that no
+  concurrent flush is missed. Counters with too many shards for a cross-group
+  transaction are only summed.
+
+  Args:
+    name: The name of the counter.
+
+  Returns:
+    The total of the shards of the counter.
+  """
+  config = yield GeneralCounterShardConfig.get_or_insert_async(name)
+  # The shards, the config and the total are each in their own entity group.
+  if config.num_shards + 2 > shard_helper.MAX_XG_ENTITY_GROUPS:
+    shards = yield ndb.get_multi_async(_ShardKeys(name, config.num_shards))
+    raise ndb.Return(_SumShards(shards))
+
+  @ndb.transactional_tasklet(xg=True)
+  def Repair():
+    config = yield GeneralCounterShardConfig.get_by_id_async(name)
+    shards = yield ndb.get_multi_async(_ShardKeys(name, config.num_shards))
+    total = _SumShards(shards)
+    config.has_total = True
+    yield ndb.put_multi_async([GeneralCounterTotal(id=name, count=total),
+                               config])
+    raise ndb.Return(total)
+
+  total = yield Repair()
+  raise ndb.Return(total)
+
+
+def _ShardKeys(name, num_shards):
+  """Returns the keys of the shards of a counter."""
+  return [ndb.Key(GeneralCounterShard, SHARD_KEY_TEMPLATE.format(name, index))
+          for index in range(num_shards)]
+
+
+def _SumShards(shards):
+  """Returns the total count of a list of shards, which may include None."""
+  return sum(shard.count for shard in shards if shard is not None)
+
+
+def GetShardStats(names):
+  """Returns the number of shards and the contention of counters.
+
+  Args:
+    names: A list of counter names.
+
+  Returns:
+    A dict of each name to a dict with the number of shards, and the writes
+    and collisions since the last scaling.
+  """
+  return shard_helper.GetShardStats(GeneralCounterShardConfig, names)
+
+
+def ScaleShards(names, batch_size=100):
+  """Scales the number of shards of counters to their contention.
+
+  Args:
+    names: A list of counter names.
+    batch_size: The number of counters to scale at a time.
+
+  Returns:
+    A dict of each counter whose number of shards changed to its new number
+    of shards.
+  """
+  scaled = {}
+  for start in range(0, len(names), batch_size):
+    batch_names = names[start:start + batch_size]
+    contention = shard_helper.TakeContention(batch_names)
+    configs = ndb.get_multi([ndb.Key(GeneralCounterShardConfig, name)
+                             for name in batch_names])
+
+    resize_futures = {}
+    for name, config in zip(batch_names, configs):
+      if config is None:
+        continue
+      (writes, collisions) = contention[name]
+      num_shards = shard_helper.GetScaledShardCount(
+          config.num_shards, writes, collisions)
+      if num_shards != config.num_shards:
+        resize_futures[name] = _ResizeAsync(name, num_shards)
+
+    for name, future in resize_futures.items():
+      scaled[name] = future.get_result()
+  return scaled
+
+
+@ndb.transactional_tasklet(xg=True)
+def _ResizeAsync(name, num_shards):
+  """Changes the number of shards of a counter.
+
+  When the number of shards is reduced, the count of each removed shard is
+  merged into a remaining shard. Counters with too many shards to merge in a
+  cross-group transaction keep their shards.
+
+  Args:
+    name: The name of the counter.
+    num_shards: The new number of shards.
+
+  Returns:
+    An ndb.Future with the number of shards of the counter.
+  """
+  config = yield GeneralCounterShardConfig.get_by_id_async(name)
+  if (config.num_shards > num_shards and
+      config.num_shards + 1 > shard_helper.MAX_XG_ENTITY_GROUPS):
+    raise ndb.Return(config.num_shards)
+
+  entities = [config]
+  if config.num_shards > num_shards:
+    shard_keys = _ShardKeys(name, config.num_shards)
+    shards = yield ndb.get_multi_async(shard_keys)
+    for index in range(num_shards, config.num_shards):
+      removed = shards[index]
+      if removed is None or not removed.count:
+        continue
+      target_index = index % num_shards
+      if shards[target_index] is None:
+        shards[target_index] = GeneralCounterShard(
+            id=SHARD_KEY_TEMPLATE.format(name, target_index))
+      shards[target_index].count += removed.count
+    entities.extend(shard for shard in shards[:num_shards] if shard)
+    yield ndb.delete_multi_async(shard_keys[num_shards:])
+
+  config.num_shards = num_shards
+  yield ndb.put_multi_async(entities)
+  raise ndb.Return(num_shards)
 
 
 @ndb.transactional
@@ -134,7 +571,8 @@ def DeleteCounter(name):
     name: The name of the counter to delete.
   """
   all_keys = GeneralCounterShardConfig.AllKeys(name)
+  all_keys.append(ndb.Key(GeneralCounterTotal, name))
   ndb.delete_multi(all_keys)
-  memcache.delete(name)
+  memcache.delete_multi([name, BUFFER_KEY_TEMPLATE.format(name)])
   config_key = ndb.Key('GeneralCounterShardConfig', name)
   config_key.delete()
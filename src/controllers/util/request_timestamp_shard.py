@@ -19,6 +19,16 @@
   Sharding timestamps is used to handle when the last request was made for
   and API Query.
 
+  Refreshes can be throttled to at most one datastore write per timestamp in
+  a period of time. The exact latest timestamp is always kept in memcache.
+  Timestamps with throttled refreshes are marked as dirty, and RollUpLatest
+  periodically saves their latest timestamp in a single entity so it can be
+  read without reading every shard. Throttled refreshes don't write that
+  entity themselves since every refresh of the timestamp would write it.
+
+  Timestamps start with one shard. ScaleShards adds shards to timestamps whose
+  writes collide and merges the shards of timestamps that are mostly idle.
+
   Based on code from:
   https://developers.google.com/appengine/articles/sharding_counters
 """
@@ -26,17 +36,34 @@
 __author__ = 'pete.frisella@gmail.com (Pete Frisella)'
 
 from datetime import datetime
+import logging
 import random
 
+from controllers.util import shard_helper
+
 from google.appengine.api import memcache
 from google.appengine.ext import ndb
 
 SHARD_KEY_TEMPLATE = 'shard-{}-{:d}'
 
+# Memcache key of the marker for a timestamp that was recently written.
+THROTTLE_KEY_TEMPLATE = 'throttle-{}'
+
+# Memcache key of the set of names of timestamps with throttled refreshes that
+# aren't rolled up yet, and of the marker that a timestamp is in the set.
+DIRTY_SET_KEY = 'dirty-timestamps'
+DIRTY_KEY_TEMPLATE = 'dirty-latest-{}'
+
 
 class GeneralTimestampShardConfig(ndb.Model):
-  """Tracks the number of shards for each named timestamp."""
-  num_shards = ndb.IntegerProperty(default=20)
+  """Tracks the number of shards for each named timestamp.
+
+  has_latest is set while the GeneralTimestampLatest of the timestamp is kept
+  up to date by RollUpLatest. It is cleared by unthrottled refreshes since
+  they aren't rolled up.
+  """
+  num_shards = ndb.IntegerProperty(default=shard_helper.MIN_SHARDS)
+  has_latest = ndb.BooleanProperty(default=False)
 
   @classmethod
   def AllKeys(cls, name):
@@ -61,57 +88,366 @@ class GeneralTimestampShard(ndb.Model):
   timestamp = ndb.DateTimeProperty()
 
 
-def GetTimestamp(name):
+class GeneralTimestampLatest(ndb.Model):
+  """The latest timestamp of all the shards of a named timestamp."""
+  timestamp = ndb.DateTimeProperty()
+
+
+def GetTimestamp(name, repair=False):
   """Retrieve the value for a given sharded timestamp.
 
   Args:
     name: The name of the timestamp.
+    repair: Whether to save the latest timestamp of the shards when the
+            timestamp doesn't have an up to date latest timestamp. Only set
+            this for timestamps that are refreshed with a granularity.
 
   Returns:
-    Integer; the cumulative count of all sharded Timestamps for the given
-    Timestamp name.
+    A datetime; the latest of all sharded Timestamps for the given Timestamp
+    name, or None if the timestamp was never refreshed.
   """
   latest_timestamp = memcache.get(name)
   if latest_timestamp is None:
-    all_keys = GeneralTimestampShardConfig.AllKeys(name)
-    for timestamp in ndb.get_multi(all_keys):
-      if timestamp is not None and latest_timestamp is None:
-        latest_timestamp = timestamp.timestamp
-      elif timestamp is not None and timestamp.timestamp > latest_timestamp:
-        latest_timestamp = timestamp.timestamp
+    (config, latest) = ndb.get_multi(
+        [ndb.Key(GeneralTimestampShardConfig, name),
+         ndb.Key(GeneralTimestampLatest, name)])
+    if config and config.has_latest and latest:
+      latest_timestamp = latest.timestamp
+    else:
+      all_keys = GeneralTimestampShardConfig.AllKeys(name)
+      timestamps = [timestamp.timestamp for timestamp in ndb.get_multi(all_keys)
+                    if timestamp is not None and timestamp.timestamp]
+      if timestamps:
+        latest_timestamp = max(timestamps)
+        if repair:
+          latest_timestamp = _RepairLatestAsync(
+              name, latest_timestamp).get_result()
     memcache.add(name, latest_timestamp, 60)
   return latest_timestamp
 
 
-def Refresh(name):
+def GetShardTimestamps(names, repair=False):
+  """Retrieve the latest timestamps of the shards of several timestamps.
+
+  This reads the timestamps that don't have an up to date latest timestamp.
+  The shards of all the timestamps are read in one datastore call and the
+  repairs run in parallel.
+
+  Args:
+    names: A list of timestamp names.
+    repair: Whether to save the latest timestamp of the shards of each
+            timestamp. Only set this for timestamps that are refreshed with a
+            granularity.
+
+  Returns:
+    A dict of each timestamp name to the latest timestamp of its shards, or
+    None if the timestamp was never refreshed.
+  """
+  configs = ndb.get_multi([ndb.Key(GeneralTimestampShardConfig, name)
+                           for name in names])
+  shard_keys = [_ShardKeys(name, config.num_shards) if config else []
+                for name, config in zip(names, configs)]
+  shards = iter(ndb.get_multi([key for keys in shard_keys for key in keys]))
+
+  latest_timestamps = {}
+  for name, keys in zip(names, shard_keys):
+    timestamps = [shard.timestamp for shard in [next(shards) for _ in keys]
+                  if shard is not None and shard.timestamp]
+    latest_timestamps[name] = max(timestamps) if timestamps else None
+
+  if repair:
+    repair_futures = [(name, _RepairLatestAsync(name, timestamp_value))
+                      for name, timestamp_value in latest_timestamps.items()
+                      if timestamp_value]
+    for name, future in repair_futures:
+      latest_timestamps[name] = future.get_result()
+  return latest_timestamps
+
+
+@ndb.transactional_tasklet(xg=True)
+def _RepairLatestAsync(name, timestamp_value):
+  """Saves the latest timestamp of the shards as the maintained timestamp.
+
+  A later timestamp saved by a concurrent refresh is kept.
+
+  Args:
+    name: The name of the timestamp.
+    timestamp_value: The latest timestamp of the shards.
+
+  Returns:
+    An ndb.Future with the latest timestamp.
+  """
+  config = yield GeneralTimestampShardConfig.get_or_insert_async(name)
+  latest = yield GeneralTimestampLatest.get_by_id_async(name)
+  if latest is None:
+    latest = GeneralTimestampLatest(id=name)
+  if latest.timestamp is None or latest.timestamp < timestamp_value:
+    latest.timestamp = timestamp_value
+  config.has_latest = True
+  yield ndb.put_multi_async([latest, config])
+  raise ndb.Return(latest.timestamp)
+
+
+def _ShardKeys(name, num_shards):
+  """Returns the keys of the shards of a timestamp."""
+  return [ndb.Key(GeneralTimestampShard, SHARD_KEY_TEMPLATE.format(name, index))
+          for index in range(num_shards)]
+
+
+def Refresh(name, granularity=0):
   """Refresh the value for a given sharded timestamp.
 
   Args:
     name: The name of the timestamp.
+    granularity: The minimum number of seconds between datastore writes of
+                 the timestamp. 0 writes the timestamp every time.
   """
-  config = GeneralTimestampShardConfig.get_or_insert(name)
-  _Refresh(name, config.num_shards)
+  RefreshMulti([name], granularity)
 
 
-@ndb.transactional
-def _Refresh(name, num_shards):
-  """Transactional helper to refresh the value for a given sharded timestamp.
+def RefreshMulti(names, granularity=0):
+  """Refresh the values for several sharded timestamps.
+
+  Args:
+    names: A list of timestamp names.
+    granularity: The minimum number of seconds between datastore writes of
+                 each timestamp. 0 writes the timestamps every time.
+  """
+  RefreshMultiAsync(names, granularity).get_result()
 
-  Also takes a number of shards to determine which shard will be used.
+
+@ndb.tasklet
+def RefreshMultiAsync(names, granularity=0):
+  """Asynchronously refresh the values for several sharded timestamps.
+
+  The shard transactions for all the timestamps run in parallel. When a
+  granularity is set, a memcache marker that expires after the granularity is
+  added for each timestamp that is written and timestamps that still have a
+  marker are only updated in memcache. Timestamps with throttled writes are
+  marked as dirty for the next RollUpLatest.
+
+  Args:
+    names: A list of timestamp names.
+    granularity: The minimum number of seconds between datastore writes of
+                 each timestamp. 0 writes the timestamps every time.
+
+  Returns:
+    An ndb.Future that is done when all the timestamps are refreshed.
+  """
+  now = datetime.utcnow()
+  context = ndb.get_context()
+  if granularity:
+    added = yield [context.memcache_add(THROTTLE_KEY_TEMPLATE.format(name), 1,
+                                        time=granularity)
+                   for name in names]
+    # Keep the exact latest timestamp in memcache for readers.
+    yield [context.memcache_set(name, now) for name in names]
+    names = [name for name, was_added in zip(names, added) if was_added]
+
+  yield [GeneralTimestampShardConfig.get_or_insert_async(name)
+         for name in names]
+  yield [_RefreshAsync(name, now, throttled=bool(granularity))
+         for name in names]
+  if granularity and names:
+    yield shard_helper.MarkDirtyAsync(DIRTY_SET_KEY, DIRTY_KEY_TEMPLATE, names)
+  if not granularity:
+    # Memcache replace does nothing if the name is not a key in memcache
+    yield [context.memcache_replace(name, now) for name in names]
+
+
+def _RefreshAsync(name, timestamp_value, throttled=False):
+  """Helper to refresh the value for a given sharded timestamp.
+
+  The config of the timestamp must exist. A random shard is refreshed in a
+  transaction, which is attempted again on another shard after a collision.
 
   Args:
       name: The name of the timestamp.
-      num_shards: How many shards to use.
+      timestamp_value: The datetime to set the timestamp to.
+      throttled: Whether the refresh is throttled, so its latest timestamp is
+                 rolled up. Otherwise the latest timestamp is marked as out of
+                 date.
+
+  Returns:
+    An ndb.Future that is done when the timestamp is refreshed.
   """
-  index = random.randint(0, num_shards - 1)
+  return shard_helper.RunTransactionAsync(
+      name, lambda: _RefreshShardAsync(name, timestamp_value, throttled))
+
+
+@ndb.tasklet
+def _RefreshShardAsync(name, timestamp_value, throttled):
+  """Refreshes a random shard of a timestamp within a transaction.
+
+  The config is read in the transaction so that the shard is one that exists
+  after a concurrent change to the number of shards.
+
+  Args:
+      name: The name of the timestamp.
+      timestamp_value: The datetime to set the timestamp to.
+      throttled: Whether the refresh is throttled.
+  """
+  config = yield GeneralTimestampShardConfig.get_by_id_async(name)
+  index = random.randint(0, config.num_shards - 1)
   shard_key_string = SHARD_KEY_TEMPLATE.format(name, index)
-  timestamp = GeneralTimestampShard.get_by_id(shard_key_string)
+  timestamp = yield GeneralTimestampShard.get_by_id_async(shard_key_string)
   if timestamp is None:
     timestamp = GeneralTimestampShard(id=shard_key_string)
-  timestamp.timestamp = datetime.utcnow()
-  timestamp.put()
-  # Memcache replace does nothing if the name is not a key in memcache
-  memcache.replace(name, timestamp.timestamp)
+  timestamp.timestamp = timestamp_value
+  entities = [timestamp]
+
+  if config.has_latest and not throttled:
+    config.has_latest = False
+    entities.append(config)
+  yield ndb.put_multi_async(entities)
+
+
+def RollUpLatest(names=None, batch_size=100):
+  """Saves the latest timestamp of the shards of timestamps.
+
+  Timestamps that aren't rolled up because of an error are marked as dirty
+  again.
+
+  Args:
+    names: A list of timestamp names, or None to roll up the timestamps that
+           are marked as dirty.
+    batch_size: The number of timestamps to roll up at a time.
+
+  Returns:
+    The number of timestamps that were rolled up.
+  """
+  if names is None:
+    names = shard_helper.TakeDirtyNames(DIRTY_SET_KEY, DIRTY_KEY_TEMPLATE)
+
+  rolled_up = 0
+  done = 0
+  try:
+    for start in range(0, len(names), batch_size):
+      rolled_up += _RollUpBatch(names[start:start + batch_size])
+      done = start + batch_size
+  finally:
+    if done < len(names):
+      shard_helper.AddDirtyNamesAsync(
+          DIRTY_SET_KEY, DIRTY_KEY_TEMPLATE, names[done:]).get_result()
+  return rolled_up
+
+
+def _RollUpBatch(names):
+  """Saves the latest timestamp of the shards of a batch of timestamps.
+
+  Args:
+    names: A list of timestamp names.
+
+  Returns:
+    The number of timestamps that were rolled up.
+  """
+  latest_timestamps = GetShardTimestamps(names)
+  repair_futures = dict((name, _RepairLatestAsync(name, timestamp_value))
+                        for name, timestamp_value in latest_timestamps.items()
+                        if timestamp_value)
+  failed = []
+  for name, future in repair_futures.items():
+    try:
+      future.get_result()
+    except Exception, e:
+      logging.warning('Unable to roll up timestamp %s: %s', name, e)
+      failed.append(name)
+  if failed:
+    shard_helper.AddDirtyNamesAsync(
+        DIRTY_SET_KEY, DIRTY_KEY_TEMPLATE, failed).get_result()
+  return len(repair_futures) - len(failed)
+
+
+def GetShardStats(names):
+  """Returns the number of shards and the contention of timestamps.
+
+  Args:
+    names: A list of timestamp names.
+
+  Returns:
+    A dict of each name to a dict with the number of shards, and the writes
+    and collisions since the last scaling.
+  """
+  return shard_helper.GetShardStats(GeneralTimestampShardConfig, names)
+
+
+def ScaleShards(names, batch_size=100):
+  """Scales the number of shards of timestamps to their contention.
+
+  Args:
+    names: A list of timestamp names.
+    batch_size: The number of timestamps to scale at a time.
+
+  Returns:
+    A dict of each timestamp whose number of shards changed to its new number
+    of shards.
+  """
+  scaled = {}
+  for start in range(0, len(names), batch_size):
+    batch_names = names[start:start + batch_size]
+    contention = shard_helper.TakeContention(batch_names)
+    configs = ndb.get_multi([ndb.Key(GeneralTimestampShardConfig, name)
+                             for name in batch_names])
+
+    resize_futures = {}
+    for name, config in zip(batch_names, configs):
+      if config is None:
+        continue
+      (writes, collisions) = contention[name]
+      num_shards = shard_helper.GetScaledShardCount(
+          config.num_shards, writes, collisions)
+      if num_shards != config.num_shards:
+        resize_futures[name] = _ResizeAsync(name, num_shards)
+
+    for name, future in resize_futures.items():
+      scaled[name] = future.get_result()
+  return scaled
+
+
+@ndb.transactional_tasklet(xg=True)
+def _ResizeAsync(name, num_shards):
+  """Changes the number of shards of a timestamp.
+
+  When the number of shards is reduced, each remaining shard keeps the latest
+  of its timestamp and the timestamps of the removed shards merged into it.
+  Timestamps with too many shards to merge in a cross-group transaction keep
+  their shards.
+
+  Args:
+    name: The name of the timestamp.
+    num_shards: The new number of shards.
+
+  Returns:
+    An ndb.Future with the number of shards of the timestamp.
+  """
+  config = yield GeneralTimestampShardConfig.get_by_id_async(name)
+  if (config.num_shards > num_shards and
+      config.num_shards + 1 > shard_helper.MAX_XG_ENTITY_GROUPS):
+    raise ndb.Return(config.num_shards)
+
+  entities = [config]
+  if config.num_shards > num_shards:
+    shard_keys = [
+        ndb.Key(GeneralTimestampShard, SHARD_KEY_TEMPLATE.format(name, index))
+        for index in range(config.num_shards)]
+    shards = yield ndb.get_multi_async(shard_keys)
+    for index in range(num_shards, config.num_shards):
+      removed = shards[index]
+      if removed is None or removed.timestamp is None:
+        continue
+      target_index = index % num_shards
+      target = shards[target_index]
+      if target is None:
+        target = shards[target_index] = GeneralTimestampShard(
+            id=SHARD_KEY_TEMPLATE.format(name, target_index))
+      if target.timestamp is None or target.timestamp < removed.timestamp:
+        target.timestamp = removed.timestamp
+    entities.extend(shard for shard in shards[:num_shards] if shard)
+    yield ndb.delete_multi_async(shard_keys[num_shards:])
+
+  config.num_shards = num_shards
+  yield ndb.put_multi_async(entities)
+  raise ndb.Return(num_shards)
 
 
 @ndb.transactional
@@ -137,7 +473,9 @@ def DeleteTimestamp(name):
     name: The name of the timestamp to delete.
   """
   all_keys = GeneralTimestampShardConfig.AllKeys(name)
+  all_keys.append(ndb.Key(GeneralTimestampLatest, name))
   ndb.delete_multi(all_keys)
-  memcache.delete(name)
+  memcache.delete_multi([name, THROTTLE_KEY_TEMPLATE.format(name),
+                         DIRTY_KEY_TEMPLATE.format(name)])
   config_key = ndb.Key('GeneralTimestampShardConfig', name)
   config_key.delete()
@@ -0,0 +1,209 @@
+#!/usr/bin/python2.7
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-process cache for public API Query responses.
+
+  Each instance keeps the most recently requested responses in memory so that
+  popular queries can be served without a memcache round trip. Entries are
+  tagged with the generation of the response they were cached from. A cached
+  entry is only used while its generation matches the current generation,
+  which changes every time the response is refreshed. The current generation
+  is checked at most once every RESPONSE_CACHE_GENERATION_CHECK_INTERVAL
+  seconds for each entry, so most hits don't make any RPC.
+
+  ResponseCache: A thread-safe, size-bounded LRU cache with expiring entries.
+  Delete: Removes the cached responses of an API Query from this instance.
+  Get: Returns a cached response if it is still current.
+  GetStats: Returns the hit, miss, and eviction counters of this instance.
+  Set: Adds a response to the cache.
+"""
+
+import collections
+import threading
+import time
+
+from controllers.util import co
+from controllers.util import compression_helper
+
+
+class ResponseCache(object):
+  """A thread-safe LRU cache where entries expire and have a generation."""
+
+  def __init__(self, max_entries, check_interval=0):
+    """Initialize the cache.
+
+    Args:
+      max_entries: The maximum number of entries to keep. The least recently
+                   used entry is evicted when the cache is full.
+      check_interval: The number of seconds an entry is used after its
+                      generation was checked before it is checked again. 0
+                      checks the generation on every hit.
+    """
+    self.max_entries = max_entries
+    self.check_interval = check_interval
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.generation_checks = 0
+    self._entries = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+  def Get(self, key, get_generation):
+    """Returns the value of an entry if it is current.
+
+    Args:
+      key: The key of the entry.
+      get_generation: A function that returns the current generation for the
+                      key. It is only called when an unexpired entry exists
+                      whose generation wasn't checked in the last
+                      check_interval seconds.
+
+    Returns:
+      The cached value or None if there is no current entry for the key.
+    """
+    now = time.time()
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry and entry[2] <= now:
+        del self._entries[key]
+        entry = None
+      if not entry:
+        self.misses += 1
+        return None
+
+      value, generation, expires, checked = entry
+      if now - checked < self.check_interval:
+        # Mark the entry as the most recently used.
+        self._entries[key] = self._entries.pop(key)
+        self.hits += 1
+        return value
+      self.generation_checks += 1
+
+    # Don't hold the lock while the generation is being retrieved.
+    current_generation = get_generation()
+
+    with self._lock:
+      if current_generation is None or current_generation != generation:
+        if self._entries.get(key) is entry:
+          del self._entries[key]
+        self.misses += 1
+        return None
+
+      if self._entries.get(key) is entry:
+        # Mark the entry as the most recently used and checked now.
+        del self._entries[key]
+        self._entries[key] = (value, generation, expires, now)
+      elif key in self._entries:
+        self._entries[key] = self._entries.pop(key)
+      self.hits += 1
+      return value
+
+  def Set(self, key, value, generation, ttl):
+    """Adds or replaces an entry.
+
+    The generation of the value is considered checked when it is added.
+
+    Args:
+      key: The key of the entry.
+      value: The value to cache.
+      generation: The current generation of the value.
+      ttl: The number of seconds until the entry expires.
+    """
+    if generation is None or self.max_entries <= 0:
+      return
+
+    now = time.time()
+    with self._lock:
+      self._entries.pop(key, None)
+      self._entries[key] = (value, generation, now + ttl, now)
+      while len(self._entries) > self.max_entries:
+        self._entries.popitem(last=False)
+        self.evictions += 1
+
+  def Delete(self, key):
+    """Removes an entry.
+
+    Args:
+      key: The key of the entry to remove.
+    """
+    with self._lock:
+      self._entries.pop(key, None)
+
+  def GetStats(self):
+    """Returns the counters for the cache.
+
+    Returns:
+      A dict with the current number of entries, the maximum number of
+      entries, and the number of hits, misses, evictions and generation
+      checks.
+    """
+    with self._lock:
+      return {
+          'entries': len(self._entries),
+          'max_entries': self.max_entries,
+          'hits': self.hits,
+          'misses': self.misses,
+          'evictions': self.evictions,
+          'generation_checks': self.generation_checks
+      }
+
+
+_cache = ResponseCache(co.RESPONSE_CACHE_MAX_ENTRIES,
+                       co.RESPONSE_CACHE_GENERATION_CHECK_INTERVAL)
+
+
+def Delete(query_id):
+  """Removes the cached responses in every format for an API Query.
+
+  Args:
+    query_id: The ID of the API Query.
+  """
+  for variant_key in compression_helper.GetVariantKeys():
+    _cache.Delete((query_id, variant_key))
+
+
+def Get(query_id, response_format, get_generation):
+  """Returns a cached response if it is still current.
+
+  Args:
+    query_id: The ID of the API Query.
+    response_format: The variant key of the response format.
+    get_generation: A function that returns the current generation of the
+                    API Query response. It is only called if the generation
+                    of the cached response wasn't checked recently.
+
+  Returns:
+    The cached response or None if there is no current response in the cache.
+  """
+  return _cache.Get((query_id, response_format), get_generation)
+
+
+def GetStats():
+  """Returns the counters for the cache of this instance."""
+  return _cache.GetStats()
+
+
+def Set(query_id, response_format, response, generation, ttl):
+  """Adds a response to the cache.
+
+  Args:
+    query_id: The ID of the API Query.
+    response_format: The variant key of the response format.
+    response: The response to cache.
+    generation: The generation of the API Query response.
+    ttl: The number of seconds until the cached response expires.
+  """
+  _cache.Set((query_id, response_format), response, generation, ttl)
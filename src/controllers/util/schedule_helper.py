@@ -17,6 +17,7 @@
 """Utility functions to handle API Query scheduling.
 
   SetApiQueryScheduleStatus: Start and stop scheduling for an API Query.
+  ScheduleAbandonedApiQuery: Add an abandoned API Query to the task queue.
   ScheduleApiQuery: Attempt to add an API Query to the task queue.
 """
 
@@ -54,6 +55,21 @@ def SetApiQueryScheduleStatus(api_query, status=None):
   return False
 
 
+def ScheduleAbandonedApiQuery(api_query):
+  """Adds a task to refresh the response of an abandoned API Query right away.
+
+  Unlike ScheduleApiQuery, this doesn't check whether the API Query is
+  abandoned. It is used to refresh a response in the background when a request
+  for an abandoned API Query is served the stored response. API Queries that
+  aren't scheduled are never refreshed.
+
+  Args:
+    api_query: the API Query entity to update
+  """
+  if api_query.is_scheduled and not api_query.in_queue:
+    _AddApiQueryTask(api_query, countdown=0)
+
+
 def ScheduleApiQuery(api_query, randomize=False, countdown=None):
   """Adds a task to refresh an API Query response.
 
@@ -75,16 +91,26 @@ def ScheduleApiQuery(api_query, randomize=False, countdown=None):
     if countdown is None:
       countdown = api_query.refresh_interval
 
-    try:
-      taskqueue.add(
-          url=co.LINKS['admin_runtask'],
-          countdown=countdown + random_seconds,
-          params={
-              'query_id': api_query.key(),
-          })
-      api_query.in_queue = True
-      api_query.put()
-    except taskqueue.Error as e:
-      logging.error(
-          'Error adding task to queue. API Query ID: {}. Error: {}'.format(
-              api_query.key(), e))
+    _AddApiQueryTask(api_query, countdown + random_seconds)
+
+
+def _AddApiQueryTask(api_query, countdown):
+  """Adds a task to refresh an API Query response and marks it as queued.
+
+  Args:
+    api_query: the API Query entity to update
+    countdown: How long to wait until executing the query
+  """
+  try:
+    taskqueue.add(
+        url=co.LINKS['admin_runtask'],
+        countdown=countdown,
+        params={
+            'query_id': api_query.key(),
+        })
+    api_query.in_queue = True
+    api_query.put()
+  except taskqueue.Error as e:
+    logging.error(
+        'Error adding task to queue. API Query ID: {}. Error: {}'.format(
+            api_query.key(), e))
@@ -0,0 +1,296 @@
+#!/usr/bin/python2.7
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Utility functions to scale sharded counters and timestamps to contention.
+
+  Writes to a shard run in a transaction without datastore retries so that a
+  collision with a concurrent write is seen and retried on another random
+  shard. The writes and collisions of each name are counted in memcache and
+  periodically used to scale the number of shards of the name: up when writes
+  collide and down, merging shards, when the name is mostly idle.
+
+  Names with writes that are rolled up periodically, like buffered counter
+  increments, are marked as dirty in a set in memcache so the roll up only
+  reads those names. A marker for each name saves adding it to the set on
+  every write.
+
+  AddDirtyNamesAsync: Adds names to a set of dirty names.
+  GetContention: Returns the writes and collisions of names.
+  GetScaledShardCount: Returns the number of shards a name should have.
+  GetShardStats: Returns the number of shards and the contention of names.
+  MarkDirtyAsync: Marks names as dirty unless they already are.
+  RunTransactionAsync: Runs a shard transaction and tracks its collisions.
+  TakeContention: Returns and resets the writes and collisions of names.
+  TakeDirtyNames: Takes the names out of a set of dirty names.
+"""
+
+import logging
+
+from google.appengine.api import datastore_errors
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+# The range of the number of shards of a name. The maximum leaves room in a
+# cross-group transaction for merging or summing all the shards of a name.
+MIN_SHARDS = 1
+MAX_SHARDS = 20
+
+# The maximum number of entity groups in a cross-group transaction.
+MAX_XG_ENTITY_GROUPS = 25
+
+# The number of times a shard transaction is attempted before giving up.
+TRANSACTION_ATTEMPTS = 3
+
+# The number of shards is doubled when at least this many, and this fraction,
+# of the transaction attempts on a name collided since the last scaling.
+SCALE_UP_MIN_COLLISIONS = 2
+SCALE_UP_COLLISION_RATE = 0.05
+
+# The number of shards is halved when there were no collisions and each of the
+# remaining shards would have had at most this many writes since the last
+# scaling.
+SCALE_DOWN_MAX_WRITES_PER_SHARD = 60
+
+# Memcache keys of the writes and collisions of a name since the last scaling.
+WRITES_KEY_TEMPLATE = 'writes-{}'
+COLLISIONS_KEY_TEMPLATE = 'collisions-{}'
+
+# The number of seconds a dirty marker is kept. It expires in case the set of
+# dirty names is evicted.
+DIRTY_MARKER_TIME = 60
+
+# The number of compare-and-set attempts to update a set of dirty names.
+DIRTY_SET_RETRIES = 10
+
+
+@ndb.tasklet
+def AddDirtyNamesAsync(set_key, marker_key_template, names):
+  """Adds names to a set of dirty names.
+
+  Args:
+    set_key: The memcache key of the set.
+    marker_key_template: The template of the memcache key of the marker of
+                         each name in the set.
+    names: A list of counter or timestamp names.
+
+  Returns:
+    An ndb.Future that is done when the names are added.
+  """
+  context = ndb.get_context()
+  for _ in range(DIRTY_SET_RETRIES):
+    dirty = yield context.memcache_gets(set_key)
+    if dirty is None:
+      added = yield context.memcache_add(set_key, set(names))
+    else:
+      added = yield context.memcache_cas(set_key, dirty | set(names))
+    if added:
+      return
+
+  # Remove the markers so that the next writes try again.
+  logging.warning('Unable to mark %d names as dirty in %s', len(names),
+                  set_key)
+  yield [context.memcache_delete(marker_key_template.format(name))
+         for name in names]
+
+
+def GetContention(names):
+  """Returns the writes and collisions of names since the last scaling.
+
+  Args:
+    names: A list of counter or timestamp names.
+
+  Returns:
+    A dict of each name to a tuple of the number of successful writes and the
+    number of collisions.
+  """
+  cached = memcache.get_multi(_ContentionKeys(names))
+  return dict(
+      (name, (int(cached.get(WRITES_KEY_TEMPLATE.format(name)) or 0),
+              int(cached.get(COLLISIONS_KEY_TEMPLATE.format(name)) or 0)))
+      for name in names)
+
+
+def GetScaledShardCount(num_shards, writes, collisions):
+  """Returns the number of shards a name should have given its contention.
+
+  Args:
+    num_shards: The current number of shards of the name.
+    writes: The number of successful writes since the last scaling.
+    collisions: The number of collisions since the last scaling.
+
+  Returns:
+    The number of shards, which is the current number if it shouldn't change.
+  """
+  attempts = writes + collisions
+  if (collisions >= SCALE_UP_MIN_COLLISIONS and
+      float(collisions) / attempts >= SCALE_UP_COLLISION_RATE):
+    return max(min(num_shards * 2, MAX_SHARDS), num_shards)
+
+  half = max(num_shards // 2, MIN_SHARDS)
+  if (not collisions and half < num_shards and
+      writes <= half * SCALE_DOWN_MAX_WRITES_PER_SHARD):
+    return min(half, MAX_SHARDS)
+  return num_shards
+
+
+@ndb.tasklet
+def MarkDirtyAsync(set_key, marker_key_template, names):
+  """Marks names as dirty unless they already have a marker.
+
+  Args:
+    set_key: The memcache key of the set of dirty names.
+    marker_key_template: The template of the memcache key of the marker of
+                         each name in the set.
+    names: A list of counter or timestamp names.
+
+  Returns:
+    An ndb.Future that is done when the names are marked.
+  """
+  context = ndb.get_context()
+  marked = yield [context.memcache_add(marker_key_template.format(name), True,
+                                       time=DIRTY_MARKER_TIME)
+                  for name in names]
+  dirty_names = [name for name, was_marked in zip(names, marked) if was_marked]
+  if dirty_names:
+    yield AddDirtyNamesAsync(set_key, marker_key_template, dirty_names)
+
+
+def GetShardStats(config_class, names):
+  """Returns the number of shards and the contention of names.
+
+  Args:
+    config_class: The shard config model of the names.
+    names: A list of counter or timestamp names.
+
+  Returns:
+    A dict of each name to a dict with the number of shards, and the writes
+    and collisions since the last scaling.
+  """
+  configs = ndb.get_multi([ndb.Key(config_class, name) for name in names])
+  contention = GetContention(names)
+  stats = {}
+  for name, config in zip(names, configs):
+    (writes, collisions) = contention[name]
+    stats[name] = {
+        'num_shards': config.num_shards if config else MIN_SHARDS,
+        'writes': writes,
+        'collisions': collisions
+    }
+  return stats
+
+
+@ndb.tasklet
+def RunTransactionAsync(name, callback):
+  """Runs a shard transaction and counts its writes and collisions.
+
+  The transaction is run without datastore retries. It is attempted again
+  after a collision, so the callback should pick a random shard each time.
+
+  Args:
+    name: The name of the counter or timestamp.
+    callback: A function that returns an ndb.Future of the transaction work.
+
+  Returns:
+    An ndb.Future with the result of the callback.
+
+  Raises:
+    datastore_errors.TransactionFailedError: Every attempt collided.
+  """
+  collisions = 0
+  while True:
+    try:
+      result = yield ndb.transaction_async(callback, retries=0, xg=True)
+      break
+    except datastore_errors.TransactionFailedError:
+      collisions += 1
+      if collisions >= TRANSACTION_ATTEMPTS:
+        yield _CountAsync(name, 0, collisions)
+        raise
+
+  yield _CountAsync(name, 1, collisions)
+  raise ndb.Return(result)
+
+
+def TakeContention(names):
+  """Returns and resets the writes and collisions of names.
+
+  Writes and collisions counted in the meantime are left for the next call.
+
+  Args:
+    names: A list of counter or timestamp names.
+
+  Returns:
+    A dict of each name to a tuple of the number of successful writes and the
+    number of collisions.
+  """
+  contention = GetContention(names)
+  offsets = {}
+  for name, (writes, collisions) in contention.items():
+    if writes:
+      offsets[WRITES_KEY_TEMPLATE.format(name)] = -writes
+    if collisions:
+      offsets[COLLISIONS_KEY_TEMPLATE.format(name)] = -collisions
+  if offsets:
+    memcache.offset_multi(offsets)
+  return contention
+
+
+def TakeDirtyNames(set_key, marker_key_template):
+  """Takes the names out of a set of dirty names.
+
+  Args:
+    set_key: The memcache key of the set.
+    marker_key_template: The template of the memcache key of the marker of
+                         each name in the set.
+
+  Returns:
+    A sorted list of the dirty names.
+  """
+  client = memcache.Client()
+  for _ in range(DIRTY_SET_RETRIES):
+    dirty = client.gets(set_key)
+    if not dirty:
+      return []
+    if client.cas(set_key, set()):
+      # Writes from now on mark their names as dirty again.
+      memcache.delete_multi([marker_key_template.format(name)
+                             for name in dirty])
+      return sorted(dirty)
+  logging.warning('Unable to take the dirty names in %s', set_key)
+  return []
+
+
+@ndb.tasklet
+def _CountAsync(name, writes, collisions):
+  """Adds to the writes and collisions of a name in memcache."""
+  context = ndb.get_context()
+  futures = []
+  if writes:
+    futures.append(context.memcache_incr(WRITES_KEY_TEMPLATE.format(name),
+                                         writes, initial_value=0))
+  if collisions:
+    futures.append(context.memcache_incr(
+        COLLISIONS_KEY_TEMPLATE.format(name), collisions, initial_value=0))
+  yield futures
+
+
+def _ContentionKeys(names):
+  """Returns the memcache keys of the writes and collisions of names."""
+  keys = []
+  for name in names:
+    keys.append(WRITES_KEY_TEMPLATE.format(name))
+    keys.append(COLLISIONS_KEY_TEMPLATE.format(name))
+  return keys
@@ -17,17 +17,28 @@
 """Utility functions to help prepare template values for API Queries.
 
   GetContentForTemplate: Template value for API Query response content.
+  GetCounterFlushForTemplate: Template values for request count flushes.
   GetErrorsForTemplate: Template value for API Query errors responses.
   GetFormatLinksForTemplate: Template value for API Query transform links.
   GetLinksForTemplate: Template values for API Query links.
   GetPropertiesForTemplate: Template values for API Query properties.
+  GetShardsForTemplate: Template values for request count and time shards.
   GetTemplateValuesForAdmin: All template values required for the Admin page.
   GetTemplateValuesForManage: All template values required for the Manage page.
 """
 
 __author__ = 'pete.frisella@gmail.com (Pete Frisella)'
 
+from datetime import datetime
+
 from controllers.util import co
+from controllers.util import models_helper
+from controllers.util import request_counter_shard
+from controllers.util import request_timestamp_shard
+
+from models import db_models
+
+from google.appengine.ext import db
 
 
 def GetContentForTemplate(api_query):
@@ -41,13 +52,36 @@ def GetContentForTemplate(api_query):
   """
   content = {}
   if api_query:
-    api_query_response = api_query.api_query_responses.get()
+    (api_query_response, response_content) = (
+        db_models.ApiQueryResponse.GetWithContent(api_query.response_key))
     if api_query_response:
-      content['response_content'] = api_query_response.content
+      content['response_content'] = response_content
 
   return content
 
 
+def GetCounterFlushForTemplate():
+  """Prepares and returns the template values for request count flushes.
+
+  Returns:
+    A dict containing how long since buffered request counts were last flushed
+    to the datastore and whether the flush is overdue. Empty if request counts
+    aren't buffered.
+  """
+  flush = {}
+  if co.BUFFER_REQUEST_COUNTS:
+    status = request_counter_shard.GetFlushStatus()
+    flush['counter_flush_lag'] = None
+    flush['counter_flush_overdue'] = True
+    if status and status.last_flush:
+      time_delta = datetime.utcnow() - status.last_flush
+      flush['counter_flush_lag'] = models_helper.FormatTimedelta(time_delta)
+      flush['counter_flush_overdue'] = (
+          time_delta.total_seconds() > 2 * co.COUNTER_FLUSH_INTERVAL)
+
+  return flush
+
+
 def GetErrorsForTemplate(api_query):
   """Prepares and returns the template values for API Query error responses.
 
@@ -132,12 +166,14 @@ def GetLinksForTemplate(api_query, hostname):
   return links
 
 
-def GetPropertiesForTemplate(api_query):
+def GetPropertiesForTemplate(api_query, stats=None):
   """Prepares and returns the template value for a set of API Query properties.
 
   Args:
     api_query: The API Query for which to prepare the properties template
                values.
+    stats: The stats of the API Query returned by GetApiQueryStats. If None
+           the stats are read from the API Query.
   Returns:
     A dict containing the template values to use for the API Query properties.
   """
@@ -150,19 +186,74 @@ def GetPropertiesForTemplate(api_query):
         'user_email': api_query.user.email,
         'is_active': api_query.is_active,
         'is_scheduled': api_query.is_scheduled,
-        'is_error_limit_reached': api_query.is_error_limit_reached,
         'in_queue': api_query.in_queue,
-        'refresh_interval': api_query.refresh_interval,
-        'modified_timedelta': api_query.modified_timedelta,
-        'last_request_timedelta': api_query.last_request_timedelta,
-        'request_count': api_query.request_count,
-        'error_count': api_query.api_query_errors.count(
-            limit=co.QUERY_ERROR_LIMIT)
+        'refresh_interval': api_query.refresh_interval
     }
 
+    if stats:
+      now = datetime.utcnow()
+      properties.update({
+          'is_error_limit_reached': (
+              stats['error_count'] >= co.QUERY_ERROR_LIMIT),
+          'modified_timedelta': _FormatAge(stats['response_modified'], now),
+          'last_request_timedelta': _FormatAge(stats['last_request'], now),
+          'request_count': stats['request_count'],
+          'error_count': stats['error_count']
+      })
+    else:
+      properties.update({
+          'is_error_limit_reached': api_query.is_error_limit_reached,
+          'modified_timedelta': api_query.modified_timedelta,
+          'last_request_timedelta': api_query.last_request_timedelta,
+          'request_count': api_query.request_count,
+          'error_count': models_helper.GetApiQueryErrorCount(api_query)
+      })
+
   return properties
 
 
+def _FormatAge(timestamp, now):
+  """Returns how long ago a timestamp was or None if there is no timestamp."""
+  if timestamp:
+    return models_helper.FormatTimedelta(now - timestamp)
+  return None
+
+
+def GetShardsForTemplate(api_query):
+  """Prepares and returns the template values for API Query shards.
+
+  Args:
+    api_query: The API Query for which to prepare the shards template values.
+  Returns:
+    A dict containing the number of shards and the contention since the last
+    scaling of the request counter and the request timestamp.
+  """
+  query_id = str(api_query.key())
+  counter_name = co.REQUEST_COUNTER_KEY_TEMPLATE.format(query_id)
+  timestamp_name = co.REQUEST_TIMESTAMP_KEY_TEMPLATE.format(query_id)
+  counter_stats = request_counter_shard.GetShardStats([counter_name])
+  timestamp_stats = request_timestamp_shard.GetShardStats([timestamp_name])
+
+  return {
+      'request_counter_shards': _FormatShardStats(counter_stats[counter_name]),
+      'request_timestamp_shards': _FormatShardStats(
+          timestamp_stats[timestamp_name])
+  }
+
+
+def _FormatShardStats(stats):
+  """Returns the number of shards and the collision rate of shard stats."""
+  attempts = stats['writes'] + stats['collisions']
+  collision_rate = None
+  if attempts:
+    collision_rate = '%.1f%%' % (100.0 * stats['collisions'] / attempts)
+  return {
+      'num_shards': stats['num_shards'],
+      'writes': stats['writes'],
+      'collision_rate': collision_rate
+  }
+
+
 def GetTemplateValuesForAdmin(api_queries, hostname):
   """Prepares and returns all the template values required for the Admin page.
 
@@ -176,14 +267,29 @@ def GetTemplateValuesForAdmin(api_queries, hostname):
   """
   template_values = []
   if api_queries:
+    api_queries = list(api_queries)
+    stats = models_helper.GetApiQueryStats(api_queries)
+    _PrefetchUsers(api_queries)
     for api_query in api_queries:
       query_values = {}
-      query_values.update(GetPropertiesForTemplate(api_query))
+      query_values.update(GetPropertiesForTemplate(
+          api_query, stats.get(str(api_query.key()))))
       query_values.update(GetLinksForTemplate(api_query, hostname))
       template_values.append(query_values)
   return template_values
 
 
+def _PrefetchUsers(api_queries):
+  """Reads the users of API Queries at once instead of one at a time."""
+  user_keys = set(db_models.ApiQuery.user.get_value_for_datastore(api_query)
+                  for api_query in api_queries)
+  users = dict((user.key(), user) for user in db.get(list(user_keys)) if user)
+  for api_query in api_queries:
+    user = users.get(db_models.ApiQuery.user.get_value_for_datastore(api_query))
+    if user:
+      api_query.user = user
+
+
 def GetTemplateValuesForManage(api_query, hostname):
   """Prepares and returns all the template values required for the Manage page.
 
@@ -201,4 +307,5 @@ def GetTemplateValuesForManage(api_query, hostname):
   template_values.update(GetErrorsForTemplate(api_query))
   template_values.update(GetContentForTemplate(api_query))
   template_values.update(GetFormatLinksForTemplate(api_query, hostname))
+  template_values.update(GetShardsForTemplate(api_query))
   return template_values
@@ -20,9 +20,13 @@
 This provides utitlites to both print TSV files to the standard output
 as well as directly to a file. This logic handles all the utf-8 conversion.
 
+  GetCsvChunkPrinter: Returns an instantiated object to output in chunks.
   GetCsvStringPrinter: Returns an instantiated object to output to a string.
   GetTsvFilePrinter: Returns an instantiated object to output to files.
+  GetTsvChunkPrinter: Returns an instantiated object to output in chunks.
   GetTsvScreenPrinter: Returns an instantiated object to output to the screen.
+  CheckStrings: Checks that the names and cells of a response are strings.
+  ChunkBuffer(): Collects output until it is flushed as a chunk.
   UnicodeWriter(): Utf-8 encodes output.
   ExportPrinter(): Converts the Core Reporting API response into tabular data.
 """
@@ -41,6 +45,15 @@ import types
 SPECIAL_CHARS = ('+', '-', '/', '*', '=')
 # TODO(nm): Test leading numbers.
 
+# The number of rows output in each chunk when streaming.
+ROWS_PER_CHUNK = 1000
+
+
+def GetCsvChunkPrinter():
+  """Returns a ExportPrinter object to output UTF-8 CSV in chunks."""
+  writer = UnicodeWriter(ChunkBuffer())
+  return ExportPrinter(writer)
+
 
 def GetCsvStringPrinter(f):
   """Returns a ExportPrinter object to output to string."""
@@ -62,6 +75,16 @@ def GetTsvFilePrinter(file_name):
   return ExportPrinter(writer)
 
 
+def GetTsvChunkPrinter():
+  """Returns a ExportPrinter object to output UTF-16 TSV in chunks.
+
+  The output is encoded incrementally so the byte order mark is only output
+  at the start of the first chunk.
+  """
+  writer = UnicodeWriter(ChunkBuffer(), dialect='excel-tab', encoding='utf-16')
+  return ExportPrinter(writer)
+
+
 def GetTsvScreenPrinter():
   """Returns a ExportPrinter object to output to std.stdout."""
   writer = UnicodeWriter(sys.stdout, dialect='excel-tab')
@@ -74,6 +97,23 @@ def GetTsvStringPrinter(f):
   return ExportPrinter(writer)
 
 
+class ChunkBuffer(object):
+  """A file-like object that collects output until it is flushed."""
+
+  def __init__(self):
+    self.chunks = []
+
+  def write(self, data):
+    """Collects a string of output."""
+    self.chunks.append(data)
+
+  def Flush(self):
+    """Returns the output collected since the last flush and clears it."""
+    chunk = ''.join(self.chunks)
+    self.chunks = []
+    return chunk
+
+
 # Wrapper to output to utf-8. Taken mostly / directly from Python docs:
 # http://docs.python.org/library/csv.html
 class UnicodeWriter(object):
@@ -199,6 +239,41 @@ class ExportPrinter(object):
         out_row.append(cell)
       self.writer.WriteRow(out_row)
 
+  def StreamHeadersAndRows(self, results, rows_per_chunk=ROWS_PER_CHUNK):
+    """Outputs the headers and rows in chunks.
+
+    The writer must output to a ChunkBuffer. Only one chunk of output is held
+    by the generator at a time. The headers and rows are checked before the
+    generator is returned, so an invalid response raises an error here
+    instead of partway through the output.
+
+    Args:
+      results: The response from the Core Reporting API.
+      rows_per_chunk: The number of rows to output in each chunk.
+
+    Returns:
+      A generator of strings of output in the encoding of the writer.
+
+    Raises:
+      TypeError: A column name or a cell is not a string.
+    """
+    CheckStrings(results)
+    return self._GenerateChunks(results, rows_per_chunk)
+
+  def _GenerateChunks(self, results, rows_per_chunk):
+    """Yields the output of the headers and rows in chunks."""
+    if results.get('columnHeaders'):
+      self.OutputHeaders(results)
+
+    for index, row in enumerate(results.get('rows') or [], 1):
+      self.writer.WriteRow([ExcelEscape(cell) for cell in row])
+      if index % rows_per_chunk == 0:
+        yield self.writer.stream.Flush()
+
+    chunk = self.writer.stream.Flush()
+    if chunk:
+      yield chunk
+
   def OutputRowCounts(self, results):
     """Outputs how many rows were returned vs rows that were matched."""
 
@@ -246,6 +321,25 @@ class ExportPrinter(object):
     self.writer.WriteRows([['Totals For All Rows Matched'], row])
 
 
+def CheckStrings(results):
+  """Checks that the column names and cells of a response are strings.
+
+  Args:
+    results: The response from the Core Reporting API.
+
+  Raises:
+    TypeError: A column name or a cell is not a string.
+  """
+  for header in results.get('columnHeaders') or []:
+    if not isinstance(header.get('name'), basestring):
+      raise TypeError('Column name is not a string: %r' % (header,))
+
+  for row in results.get('rows') or []:
+    for cell in row:
+      if not isinstance(cell, basestring):
+        raise TypeError('Cell is not a string: %r' % (cell,))
+
+
 def ExcelEscape(input_value):
   """Escapes the first character of a string if it is special in Excel.
 
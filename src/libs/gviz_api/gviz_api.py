@@ -69,6 +69,70 @@ class DataTableJSONEncoder(json.JSONEncoder):
       return super(DataTableJSONEncoder, self).default(o)
 
 
+def _CellObject(value):
+  """Returns the JSON cell object of a value returned by CoerceValue."""
+  if value is None:
+    return None
+  elif isinstance(value, tuple):
+    cell_obj = {"v": value[0]}
+    if len(value) > 1 and value[1] is not None:
+      cell_obj["f"] = value[1]
+    if len(value) == 3:
+      cell_obj["p"] = value[2]
+    return cell_obj
+  return {"v": value}
+
+
+def _TrustedCellFunction(value_type):
+  """Returns a function that builds the JSON cells of a column in trusted mode.
+
+  Only the conversions CoerceValue makes for values of the right type are
+  made. Values of any other type, including values with a formatted value,
+  are still passed to CoerceValue.
+
+  Args:
+    value_type: One of "string", "number", "boolean", "date", "datetime" or
+                "timeofday".
+
+  Returns:
+    A function that takes a value of the column and returns its cell object.
+  """
+  if value_type == "string":
+    def StringCell(value):
+      if value is None:
+        return None
+      elif type(value) is unicode:
+        return {"v": value}
+      elif type(value) is str:
+        return {"v": value.decode("utf-8")}
+      return _CellObject(DataTable.CoerceValue(value, value_type))
+    return StringCell
+
+  elif value_type == "boolean":
+    def BooleanCell(value):
+      if value is None:
+        return None
+      elif type(value) is tuple:
+        return _CellObject(DataTable.CoerceValue(value, value_type))
+      return {"v": bool(value)}
+    return BooleanCell
+
+  def ValueCell(value):
+    if value is None:
+      return None
+    elif type(value) is tuple:
+      return _CellObject(DataTable.CoerceValue(value, value_type))
+    return {"v": value}
+  return ValueCell
+
+
+# The function that builds the JSON cells of each column type in trusted mode.
+TRUSTED_CELL_FUNCTIONS = dict(
+    (value_type, _TrustedCellFunction(value_type))
+    for value_type in ("string", "number", "boolean", "date", "datetime",
+                       "timeofday"))
+
+
 class DataTable(object):
   """Wraps the data to convert to a Google Visualization API DataTable.
 
@@ -138,9 +202,18 @@ class DataTable(object):
     a  b  c
     1  2  z
     3  4  w
+
+  A table created with trusted=True skips the type checks of CoerceValue. The
+  caller guarantees every value already has the Python type of its column:
+  unicode or UTF-8 str for string, int, long or float for number, and the
+  date and time types of the other columns. Rows of a table with a single
+  level are stored without checking them against the description, and the
+  JSON cells are built with a function for each column type that is chosen
+  once from the description.
   """
 
-  def __init__(self, table_description, data=None, custom_properties=None):
+  def __init__(self, table_description, data=None, custom_properties=None,
+               trusted=False):
     """Initialize the data table from a table schema and (optionally) data.
 
     See the class documentation for more information on table schema and data
@@ -158,12 +231,18 @@ class DataTable(object):
       custom_properties: Optional. A dictionary from string to string that
                          goes into the table's custom properties. This can be
                          later changed by changing self.custom_properties.
+      trusted: Optional. If True, the values are not checked against the type
+               of their column. See the class documentation.
 
     Raises:
       DataTableException: Raised if the data and the description did not match,
                           or did not use the supported formats.
     """
     self.__columns = self.TableDescriptionParser(table_description)
+    self.trusted = trusted
+    self.__cell_functions = dict(
+        (col["id"], TRUSTED_CELL_FUNCTIONS[col["type"]])
+        for col in self.__columns)
     self.__data = []
     self.custom_properties = {}
     if custom_properties is not None:
@@ -580,12 +659,36 @@ class DataTable(object):
     # If the maximal depth is 0, we simply iterate over the data table
     # lines and insert them using _InnerAppendData. Otherwise, we simply
     # let the _InnerAppendData handle all the levels.
-    if not self.__columns[-1]["depth"]:
+    if self.trusted and not self.__columns[-1]["depth"]:
+      self.__data.extend(self._TrustedRows(data, custom_properties))
+    elif not self.__columns[-1]["depth"]:
       for row in data:
         self._InnerAppendData(({}, custom_properties), row, 0)
     else:
       self._InnerAppendData(({}, custom_properties), data, 0)
 
+  def _TrustedRows(self, data, custom_properties):
+    """Returns the rows to store for the data of a single level table.
+
+    Trusted data is not checked against the table description. Values of
+    columns that are not in the description are stored but never output.
+
+    Args:
+      data: The rows to add to the table.
+      custom_properties: A dictionary of string to string, representing the
+                         custom properties to add to all the rows.
+
+    Returns:
+      A list of (row values dict, custom properties) tuples.
+    """
+    container = self.__columns[0]["container"]
+    if container == "dict":
+      return [(dict(row), custom_properties) for row in data]
+    col_ids = [col["id"] for col in self.__columns]
+    if container == "iter":
+      return [(dict(zip(col_ids, row)), custom_properties) for row in data]
+    return [({col_ids[0]: row}, custom_properties) for row in data]
+
   def _InnerAppendData(self, prev_col_values, data, col_index):
     """Inner function to assist LoadData."""
     # We first check that col_index has not exceeded the columns size
@@ -673,15 +776,25 @@ class DataTable(object):
         raise DataTableException("Expected tuple with second value: "
                                  "'asc' or 'desc'")
 
-    def SortCmpFunc(row1, row2):
-      """cmp function for sorted. Compares by keys and 'asc'/'desc' keywords."""
-      for key, asc_mult in proper_sort_keys:
-        cmp_result = asc_mult * cmp(row1[0].get(key), row2[0].get(key))
-        if cmp_result:
-          return cmp_result
-      return 0
-
-    return sorted(self.__data, cmp=SortCmpFunc)
+    # Adjacent keys in the same direction are compared together as a tuple.
+    key_groups = []
+    for key, asc_mult in proper_sort_keys:
+      if key_groups and key_groups[-1][1] == asc_mult:
+        key_groups[-1][0].append(key)
+      else:
+        key_groups.append(([key], asc_mult))
+
+    # Python sorts are stable, also in reverse, so sorting by the least
+    # significant keys first gives the same order as comparing all the keys.
+    data = self.__data
+    for keys, asc_mult in reversed(key_groups):
+      if len(keys) == 1:
+        sort_key = lambda row, key=keys[0]: row[0].get(key)
+      else:
+        sort_key = lambda row, keys=keys: tuple(row[0].get(key)
+                                                for key in keys)
+      data = sorted(data, key=sort_key, reverse=asc_mult < 0)
+    return data
 
   def ToJSCode(self, name, columns_order=None, order_by=()):
     """Writes the data table as a JS code string.
@@ -933,22 +1046,20 @@ class DataTable(object):
       col_objs.append(col_obj)
 
     # Creating the rows jsons
+    cell_functions = None
+    if self.trusted:
+      cell_functions = [(col, self.__cell_functions[col])
+                        for col in columns_order]
     row_objs = []
     for row, cp in self._PreparedData(order_by):
-      cell_objs = []
-      for col in columns_order:
-        value = self.CoerceValue(row.get(col, None), col_dict[col]["type"])
-        if value is None:
-          cell_obj = None
-        elif isinstance(value, tuple):
-          cell_obj = {"v": value[0]}
-          if len(value) > 1 and value[1] is not None:
-            cell_obj["f"] = value[1]
-          if len(value) == 3:
-            cell_obj["p"] = value[2]
-        else:
-          cell_obj = {"v": value}
-        cell_objs.append(cell_obj)
+      if cell_functions:
+        cell_objs = [cell_function(row.get(col, None))
+                     for col, cell_function in cell_functions]
+      else:
+        cell_objs = [
+            _CellObject(self.CoerceValue(row.get(col, None),
+                                         col_dict[col]["type"]))
+            for col in columns_order]
       row_obj = {"c": cell_objs}
       if cp:
         row_obj["p"] = cp
@@ -0,0 +1,104 @@
+#!/usr/bin/python
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark for the trusted mode of gviz_api.DataTable.
+
+Compares the time to load rows into a DataTable and write them with ToJSon and
+ToJSonResponse, with and without trusted mode, for tables like the Core
+Reporting API responses the superProxy renders. Run from this directory:
+
+  python gviz_api_benchmark.py
+
+Exits with a non-zero status if trusted mode is slower than the default mode
+for any table size.
+"""
+
+import random
+import sys
+import timeit
+
+from gviz_api import DataTable
+
+ROW_COUNTS = (1000, 10000, 100000)
+ITERATIONS = 3
+
+DESCRIPTION = {
+    "ga:pagePath": ("string", "ga:pagePath"),
+    "ga:source": ("string", "ga:source"),
+    "ga:pageviews": ("number", "ga:pageviews"),
+    "ga:avgTimeOnPage": ("number", "ga:avgTimeOnPage")
+}
+COLUMNS_ORDER = ("ga:pagePath", "ga:source", "ga:pageviews",
+                 "ga:avgTimeOnPage")
+
+SOURCES = ("google", "(direct)", "facebook.com", "t.co", "bing", "newsletter")
+
+
+def BuildRows(row_count):
+  """Returns rows of typed values like the superProxy loads into a DataTable.
+
+  Args:
+    row_count: The number of rows to build.
+
+  Returns:
+    A list with a dict for each row.
+  """
+  rng = random.Random(row_count)
+  return [{"ga:pagePath": "/blog/%d/%d-post-title" % (2010 + index % 4, index),
+           "ga:source": rng.choice(SOURCES),
+           "ga:pageviews": rng.randint(1, 50000),
+           "ga:avgTimeOnPage": rng.random() * 600}
+          for index in range(row_count)]
+
+
+def Measure(rows, trusted):
+  """Returns the milliseconds to load and write a table.
+
+  Args:
+    rows: The rows to load into the table.
+    trusted: Whether to create the table in trusted mode.
+
+  Returns:
+    A tuple of the milliseconds to load the rows, to write them with ToJSon,
+    and to write them with ToJSonResponse.
+  """
+  table = DataTable(DESCRIPTION, trusted=trusted)
+  load_time = timeit.timeit(lambda: table.LoadData(rows), number=ITERATIONS)
+  json_time = timeit.timeit(table.ToJSon, number=ITERATIONS)
+  response_time = timeit.timeit(
+      lambda: table.ToJSonResponse(columns_order=COLUMNS_ORDER, req_id=1),
+      number=ITERATIONS)
+  return tuple(total / ITERATIONS * 1e3
+               for total in (load_time, json_time, response_time))
+
+
+def Main():
+  print "%7s  %-8s  %10s  %10s  %10s" % ("rows", "mode", "load ms",
+                                         "json ms", "response ms")
+  slower = False
+  for row_count in ROW_COUNTS:
+    rows = BuildRows(row_count)
+    totals = {}
+    for label, trusted in (("default", False), ("trusted", True)):
+      times = Measure(rows, trusted)
+      totals[label] = sum(times)
+      print "%7d  %-8s  %10.1f  %10.1f  %10.1f" % ((row_count, label) + times)
+    slower = slower or totals["trusted"] > totals["default"]
+  return int(slower)
+
+
+if __name__ == "__main__":
+  sys.exit(Main())
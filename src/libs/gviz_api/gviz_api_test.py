@@ -25,11 +25,20 @@ try:
   import json
 except ImportError:
   import simplejson as json
+import os
+import sys
 import unittest
 
 from gviz_api import DataTable
 from gviz_api import DataTableException
 
+# The superProxy transforms are imported from the src directory.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, os.pardir))
+from controllers.transform import columnar
+from controllers.transform import data_table_encoder
+from controllers.transform import transformers
+
 
 class DataTableTest(unittest.TestCase):
 
@@ -523,6 +532,32 @@ class DataTableTest(unittest.TestCase):
                      table.ToJSCode("mytab",
                                     order_by=[("col1", "desc"), "col2"]))
 
+  def testOrderByMatchesCmp(self):
+    # Many ties and missing values check the sort is stable in both directions.
+    data = [{"a": i % 3, "b": (i * 7) % 4, "c": "x%d" % (i % 2), "d": i}
+            for i in range(40)]
+    for row in data[::5]:
+      del row["b"]
+    description = {"a": "number", "b": "number", "c": "string", "d": "number"}
+    table = DataTable(description, data)
+    rows = table._PreparedData()
+
+    for order_by in ([("b", "desc")], [("a", "desc"), ("b", "desc")],
+                     [("a", "asc"), ("b", "desc"), ("c", "asc")],
+                     [("c", "desc"), ("a", "asc"), ("b", "asc")]):
+      sort_keys = [(key, direction == "asc" and 1 or -1)
+                   for key, direction in order_by]
+
+      def SortCmpFunc(row1, row2, sort_keys=sort_keys):
+        for key, asc_mult in sort_keys:
+          cmp_result = asc_mult * cmp(row1[0].get(key), row2[0].get(key))
+          if cmp_result:
+            return cmp_result
+        return 0
+
+      self.assertEqual(sorted(rows, cmp=SortCmpFunc),
+                       table._PreparedData(order_by))
+
   def testToJSonResponse(self):
     description = ["col1", "col2", "col3"]
     data = [("1", "2", "3"), ("a", "b", "c"), ("One", "Two", "Three")]
@@ -571,6 +606,116 @@ class DataTableTest(unittest.TestCase):
     self.assertRaises(ValueError, table.ToResponse, tqx="SomeWrongTqxFormat")
     self.assertRaises(DataTableException, table.ToResponse, tqx="out:bad")
 
+  def testTrusted(self):
+    descriptions = [
+        [("a", "string"), ("b", "number"), ("c", "boolean"), ("d", "date"),
+         ("e", "datetime"), ("f", "timeofday")],
+        {"a": "string", "b": "number", "c": "boolean", "d": "date",
+         "e": "datetime", "f": "timeofday"}]
+    rows = [["caf\xc3\xa9", 1, True, date(2013, 7, 1),
+             datetime(2013, 7, 1, 12, 30, 5), time(1, 2, 3)],
+            [u"b", 2.5, 0, None, None, None],
+            [("c", "C"), (3, "3$", {"p": "q"}), None, date(2013, 1, 2),
+             datetime(2013, 1, 2, 3, 4, 5, 6000), time(4, 5, 6)]]
+    for description in descriptions:
+      data = rows
+      if isinstance(description, dict):
+        data = [dict(zip("abcdef", row)) for row in rows]
+      table = DataTable(description, data)
+      trusted_table = DataTable(description, data, trusted=True)
+      self.assertTrue(trusted_table.trusted)
+      self.assertEqual(table.ToJSon(), trusted_table.ToJSon())
+      self.assertEqual(table.ToJSon(columns_order=("f", "a", "e", "b", "d",
+                                                   "c"),
+                                    order_by=("b", "desc")),
+                       trusted_table.ToJSon(columns_order=("f", "a", "e", "b",
+                                                           "d", "c"),
+                                            order_by=("b", "desc")))
+      self.assertEqual(table.ToJSonResponse(req_id=3),
+                       trusted_table.ToJSonResponse(req_id=3))
+      self.assertEqual(table.ToCsv(), trusted_table.ToCsv())
+
+    table = DataTable("a", ["x", "y"])
+    trusted_table = DataTable("a", ["x", "y"], trusted=True)
+    self.assertEqual(table.ToJSon(), trusted_table.ToJSon())
+
+  def testTrustedSkipsCoerceValue(self):
+    description = [("a", "string"), ("b", "number")]
+    data = [["a", 1], [u"b", 2.5]]
+    expected = DataTable(description, data).ToJSon()
+
+    def FailCoerceValue(value, value_type):
+      raise AssertionError("CoerceValue called for %r" % (value,))
+    coerce_value = DataTable.CoerceValue
+    DataTable.CoerceValue = staticmethod(FailCoerceValue)
+    try:
+      trusted_table = DataTable(description, data, trusted=True)
+      self.assertEqual(expected, trusted_table.ToJSon())
+      self.assertRaises(AssertionError, DataTable(description, data).ToJSon)
+    finally:
+      DataTable.CoerceValue = staticmethod(coerce_value)
+
+
+class DataTableEncoderTest(unittest.TestCase):
+  """Checks the Data Table encoder writes the same bytes as DataTable."""
+
+  COLUMN_HEADERS = [
+      {"name": "ga:source", "columnType": "DIMENSION", "dataType": "STRING"},
+      {"name": "ga:visits", "columnType": "METRIC", "dataType": "INTEGER"},
+      {"name": "ga:avgTimeOnSite", "columnType": "METRIC",
+       "dataType": "TIME"},
+      {"name": "ga:revenue", "columnType": "METRIC", "dataType": "CURRENCY"},
+      {"name": "ga:bounceRate", "columnType": "METRIC", "dataType": "FLOAT"}]
+
+  def BuildContent(self, rows):
+    return {"columnHeaders": self.COLUMN_HEADERS, "rows": rows}
+
+  def AssertSameOutput(self, content, data_types=None, req_id=0):
+    report = columnar.ColumnarReport.FromContent(content, data_types)
+    schema = transformers.GetDataTableSchema(content)
+    columns_order = transformers.GetColumnOrder(content["columnHeaders"])
+    table = DataTable(schema,
+                      transformers.GetDataTableRowsFromReport(report))
+
+    self.assertEqual(table.ToJSon(),
+                     data_table_encoder.ToJSon(schema, report))
+    self.assertEqual(table.ToJSon(columns_order=columns_order),
+                     data_table_encoder.ToJSon(schema, report,
+                                               columns_order))
+    self.assertEqual(
+        table.ToJSonResponse(columns_order=columns_order, req_id=req_id),
+        data_table_encoder.ToJSonResponse(schema, report, columns_order,
+                                          req_id))
+
+  def testToJSon(self):
+    rows = [[u"google", u"1200", u"75.5", u"10.25", u"45.12345678901234"],
+            [u"(direct)", u"-3", u"0", u"0.0", u"1e-07"],
+            [u"google", u"2147483648", u"1.0", u"1e+16", u"0.1"]]
+    self.AssertSameOutput(self.BuildContent(rows))
+    self.AssertSameOutput(self.BuildContent(rows), req_id=u"7")
+
+  def testSingleColumn(self):
+    content = {"columnHeaders": self.COLUMN_HEADERS[1:2],
+               "rows": [[u"1"], [u"2"]]}
+    self.AssertSameOutput(content)
+
+  def testEscapedStrings(self):
+    rows = [[u"\"quoted\" \\ \n\t\x01 \"rows\":[]", u"1", u"1", u"1", u"1"],
+            [u"caf\xe9 \u2603", u"2", u"2", u"2", u"2"]]
+    self.AssertSameOutput(self.BuildContent(rows))
+
+  def testNonFiniteNumbers(self):
+    rows = [[u"a", u"1", u"nan", u"inf", u"-inf"]]
+    self.AssertSameOutput(self.BuildContent(rows))
+
+  def testWrongType(self):
+    content = self.BuildContent([[u"a", u"1", u"1", u"1", u"1"]])
+    report = columnar.ColumnarReport.FromContent(content)
+    report.columns[1] = [u"1"]
+    schema = transformers.GetDataTableSchema(content)
+    self.assertRaises(data_table_encoder.gviz_api.DataTableException,
+                      data_table_encoder.ToJSon, schema, report)
+
 
 if __name__ == "__main__":
   unittest.main()
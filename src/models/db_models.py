@@ -17,17 +17,22 @@
 """Models for the Google Analytics superProxy.
 
   JsonQueryProperty: Property to store API Responses.
+  CompressedJsonQueryProperty: Property to store API Responses compressed.
   GaSuperProxyUser: Represents the users of the service.
   GaSuperProxyUserInvitation: Represents an user invited to the service.
   ApiQuery: Models the API Queries created by users.
   ApiQueryResponse: Represents a successful response from an API.
+  ApiQueryResponseChunk: Represents a part of a large API Query Response.
+  ApiQueryRenderedResponse: Represents a response rendered in a format.
   ApiErrorResponse: Represents an error response from an API.
 """
 
 __author__ = 'pete.frisella@gmail.com (Pete Frisella)'
 
 import json
+import zlib
 
+from controllers.util import compression_helper
 from controllers.util import models_helper
 
 from google.appengine.ext import db
@@ -50,6 +55,46 @@ class JsonQueryProperty(db.Property):
     return super(JsonQueryProperty, self).make_value_from_datastore(value)
 
 
+class CompressedJsonQueryProperty(JsonQueryProperty):
+  """Property to store/retrieve responses in JSON format compressed with zlib.
+
+  Compressed values start with a header that can't start a JSON value. Values
+  without the header, including values saved by JsonQueryProperty, are read
+  as uncompressed JSON. Small values are stored uncompressed.
+  """
+  HEADER = '\x00zlib1'
+  MIN_COMPRESS_SIZE = 1024  # bytes of JSON
+  COMPRESSION_LEVEL = 6
+
+  @classmethod
+  def Dumps(cls, value):
+    """Returns the stored form of a value."""
+    value = json.dumps(value)
+    if len(value) >= cls.MIN_COMPRESS_SIZE:
+      value = cls.HEADER + zlib.compress(value, cls.COMPRESSION_LEVEL)
+    return value
+
+  @classmethod
+  def Loads(cls, value):
+    """Returns the value of a stored form, compressed or not."""
+    value = str(value)
+    if value.startswith(cls.HEADER):
+      value = zlib.decompress(value[len(cls.HEADER):])
+    return json.loads(value)
+
+  # pylint: disable-msg=C6409
+  def get_value_for_datastore(self, model_instance):
+    value = super(JsonQueryProperty, self).get_value_for_datastore(
+        model_instance)
+    return db.Blob(self.Dumps(value))
+
+  def make_value_from_datastore(self, value):
+    if value is None:
+      return None
+    value = self.Loads(value)
+    return super(JsonQueryProperty, self).make_value_from_datastore(value)
+
+
 class GaSuperProxyUser(db.Model):
   """Models a GaSuperProxyUser and user settings."""
   email = db.StringProperty()
@@ -108,14 +153,136 @@ class ApiQuery(db.Model):
     """Reuturns the request count for the API Query."""
     return models_helper.GetApiQueryRequestCount(str(self.key()))
 
+  @property
+  def response_key(self):
+    """Returns the key of the API Query Response of the API Query."""
+    return db.Key.from_path(ApiQueryResponse.kind(), ApiQueryResponse.KEY_NAME,
+                            parent=self.key())
+
+  @property
+  def error_count_key(self):
+    """Returns the key of the error count of the API Query."""
+    return db.Key.from_path(ApiQueryErrorCount.kind(),
+                            ApiQueryErrorCount.KEY_NAME, parent=self.key())
+
 
 class ApiQueryResponse(db.Model):
-  """Models an API Response."""
+  """Models an API Response.
+
+  The response is a child of the API Query with a fixed key name so it is read
+  with a get by key. Responses saved before this had no parent and are moved
+  under their API Query by MigrateApiQueryResponses.
+
+  Content too large for the entity is stored in chunk_count chunks instead,
+  and the response is the manifest of the chunks. A refresh deletes the chunks
+  of the previous response after the new response is saved, so responses
+  with chunks should be read with GetWithContent.
+  """
+  KEY_NAME = 'response'
+
   api_query = db.ReferenceProperty(ApiQuery,
                                    required=True,
                                    collection_name='api_query_responses')
-  content = JsonQueryProperty(required=True)
+  content = CompressedJsonQueryProperty()
   modified = db.DateTimeProperty(required=True)
+  content_hash = db.StringProperty(indexed=False)
+  chunk_count = db.IntegerProperty(default=0, indexed=False)
+
+  @property
+  def generation(self):
+    """Returns the modified date and content hash of the response."""
+    return {'modified': self.modified, 'content_hash': self.content_hash}
+
+  def ChunkKeys(self):
+    """Returns the keys of the chunks of the content of the response."""
+    key_name_template = '%s.%s.%%d' % (self.KEY_NAME, self.content_hash)
+    return [db.Key.from_path(ApiQueryResponseChunk.kind(),
+                             key_name_template % index,
+                             parent=self.parent_key())
+            for index in range(self.chunk_count)]
+
+  @classmethod
+  def GetWithContent(cls, key):
+    """Returns a response and its content.
+
+    If a chunk of the content is missing, the response was replaced by a
+    refresh while it was read, so the new response is read once more.
+
+    Args:
+      key: The key of the response.
+
+    Returns:
+      A tuple of the response, or None if it doesn't exist, and its content,
+      or None if a chunk of the content is missing.
+    """
+    response = cls.get(key)
+    content = response.GetContent() if response else None
+    if response and response.chunk_count and content is None:
+      response = cls.get(key)
+      content = response.GetContent() if response else None
+    return (response, content)
+
+  def GetContent(self):
+    """Returns the content of the response, reading its chunks if needed.
+
+    Returns:
+      The content or None if a chunk of the content is missing.
+    """
+    if not self.chunk_count:
+      return self.content
+
+    chunks = db.get(self.ChunkKeys())
+    if None in chunks:
+      return None
+    return CompressedJsonQueryProperty.Loads(
+        ''.join(str(chunk.content) for chunk in chunks))
+
+
+class ApiQueryResponseChunk(db.Model):
+  """Models a part of the stored content of a large API Query Response.
+
+  Chunks are children of the API Query. The key name includes the content hash
+  of the response so the chunks of different responses are never combined.
+  """
+  content = db.BlobProperty(required=True)
+
+
+class ApiQueryRenderedResponse(db.Model):
+  """Models an API Response rendered in one of the supported formats.
+
+  Rendered responses are children of the API Query and use the variant key of
+  the format and content encoding as the key name. e.g. 'csv' or 'csv.gzip'.
+  The modified date matches the API Response it was rendered from.
+  """
+  content = db.BlobProperty(required=True)
+  modified = db.DateTimeProperty(required=True)
+
+  @classmethod
+  def AllKeys(cls, api_query):
+    """Returns the keys of the rendered responses for all supported variants.
+
+    Args:
+      api_query: The API Query the responses were rendered for.
+
+    Returns:
+      A list of db.Key values, one for each format and content encoding.
+    """
+    return [db.Key.from_path(cls.kind(), variant_key, parent=api_query.key())
+            for variant_key in compression_helper.GetVariantKeys()]
+
+
+class ApiQueryErrorCount(db.Model):
+  """Models the number of errors of an API Query and the time of the last one.
+
+  The count is a child of the API Query with a fixed key name instead of a
+  property of the API Query, so saving an API Query never overwrites a
+  concurrent update of the count. API Queries saved before errors were
+  counted don't have one.
+  """
+  KEY_NAME = 'error-count'
+
+  count = db.IntegerProperty(default=0, indexed=False)
+  last_error = db.DateTimeProperty(indexed=False)
 
 
 class ApiErrorResponse(db.Model):
@@ -123,5 +290,5 @@ class ApiErrorResponse(db.Model):
   api_query = db.ReferenceProperty(ApiQuery,
                                    required=True,
                                    collection_name='api_query_errors')
-  content = JsonQueryProperty(required=True)
+  content = CompressedJsonQueryProperty(required=True)
   timestamp = db.DateTimeProperty(required=True)
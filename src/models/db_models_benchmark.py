@@ -0,0 +1,141 @@
+#!/usr/bin/python2.7
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark for the compressed storage of API Query Responses.
+
+Compares the stored size, and the time to convert a response to and from its
+stored value, of JsonQueryProperty and CompressedJsonQueryProperty for Core
+Reporting API responses of several sizes. The datastore transfers the stored
+value, so its size drives the datastore latency of reads and writes. Run from
+the src directory with the App Engine SDK on the Python path:
+
+  python -m models.db_models_benchmark
+"""
+
+import os
+import random
+import timeit
+
+os.environ.setdefault('APPLICATION_ID', 'benchmark')
+
+from models import db_models
+
+from google.appengine.ext import db
+
+ROW_COUNTS = (100, 1000, 10000)
+ITERATIONS = 20
+
+SOURCES = ('google', '(direct)', 'facebook.com', 't.co', 'bing', 'newsletter')
+MEDIUMS = ('organic', '(none)', 'referral', 'email', 'cpc')
+
+
+class BenchmarkResponse(db.Model):
+  """Stores a response with both properties. Never saved."""
+  plain = db_models.JsonQueryProperty()
+  compressed = db_models.CompressedJsonQueryProperty()
+
+
+def BuildReport(row_count):
+  """Returns a Core Reporting API response with a number of rows.
+
+  Args:
+    row_count: The number of rows of the report.
+
+  Returns:
+    A dict like the responses saved for API Queries.
+  """
+  rng = random.Random(row_count)
+  rows = []
+  for index in range(row_count):
+    rows.append([
+        '/blog/%d/%s-post-title' % (2010 + index % 4, index),
+        rng.choice(SOURCES),
+        rng.choice(MEDIUMS),
+        str(rng.randint(1, 50000)),
+        str(rng.randint(1, 40000)),
+        '%.14f' % (rng.random() * 600)])
+
+  return {
+      'kind': 'analytics#gaData',
+      'id': 'https://www.googleapis.com/analytics/v3/data/ga?ids=ga:1234',
+      'query': {
+          'start-date': '2013-07-01',
+          'end-date': '2013-07-31',
+          'ids': 'ga:1234',
+          'dimensions': 'ga:pagePath,ga:source,ga:medium',
+          'metrics': ['ga:pageviews', 'ga:uniquePageviews',
+                      'ga:avgTimeOnPage'],
+          'max-results': row_count
+      },
+      'itemsPerPage': row_count,
+      'totalResults': row_count,
+      'containsSampledData': False,
+      'columnHeaders': [
+          {'name': 'ga:pagePath', 'columnType': 'DIMENSION',
+           'dataType': 'STRING'},
+          {'name': 'ga:source', 'columnType': 'DIMENSION',
+           'dataType': 'STRING'},
+          {'name': 'ga:medium', 'columnType': 'DIMENSION',
+           'dataType': 'STRING'},
+          {'name': 'ga:pageviews', 'columnType': 'METRIC',
+           'dataType': 'INTEGER'},
+          {'name': 'ga:uniquePageviews', 'columnType': 'METRIC',
+           'dataType': 'INTEGER'},
+          {'name': 'ga:avgTimeOnPage', 'columnType': 'METRIC',
+           'dataType': 'TIME'}],
+      'totalsForAllResults': {
+          'ga:pageviews': str(sum(int(row[3]) for row in rows)),
+          'ga:uniquePageviews': str(sum(int(row[4]) for row in rows)),
+          'ga:avgTimeOnPage': '120.5'},
+      'rows': rows
+  }
+
+
+def Measure(prop, response):
+  """Returns the stored size and conversion times of a response.
+
+  Args:
+    prop: The property of BenchmarkResponse to measure.
+    response: The BenchmarkResponse to convert.
+
+  Returns:
+    A tuple of the stored size in bytes, and the milliseconds to convert the
+    response to and from its stored value.
+  """
+  stored = prop.get_value_for_datastore(response)
+  write_time = timeit.timeit(lambda: prop.get_value_for_datastore(response),
+                             number=ITERATIONS)
+  read_time = timeit.timeit(lambda: prop.make_value_from_datastore(stored),
+                            number=ITERATIONS)
+  return (len(stored), write_time / ITERATIONS * 1e3,
+          read_time / ITERATIONS * 1e3)
+
+
+def Main():
+  print '%6s  %-10s  %10s  %10s  %10s' % ('rows', 'property', 'bytes',
+                                          'write ms', 'read ms')
+  for row_count in ROW_COUNTS:
+    report = BuildReport(row_count)
+    response = BenchmarkResponse(plain=report, compressed=report)
+    for label, prop in (('plain', BenchmarkResponse.plain),
+                        ('compressed', BenchmarkResponse.compressed)):
+      (size, write_ms, read_ms) = Measure(prop, response)
+      print '%6d  %-10s  %10d  %10.2f  %10.2f' % (row_count, label, size,
+                                                  write_ms, read_ms)
+
+
+if __name__ == '__main__':
+  Main()